@@ -1,6 +1,5 @@
 import asyncio
 import logging
-import re
 import time
 from typing import Optional
 
@@ -11,6 +10,7 @@ from app.agent.experience.work_type import WorkType
 from app.countries import Country
 from app.vector_search.esco_entities import OccupationSkillEntity
 from app.vector_search.esco_search_service import OccupationSkillSearchService, OccupationSearchService
+from app.vector_search.occupation_code_index import UNSEEN_OCCUPATIONS_CODE_PATTERN, SELF_EMPLOYMENT_OCCUPATION_CODE
 from app.vector_search.similarity_search_service import FilterSpec
 from ._contextualization_llm import _ContextualizationLLM
 from ._relevant_occupations_classifier_llm import _RelevantOccupationsClassifierLLM
@@ -96,33 +96,53 @@ class InferOccupationTool:
         self._logger.debug("Contextualizing the experience title took %.2f seconds", time.time() - last_time)
         last_time = time.time()
         
-        # create a task for each title
         # search for the top_p matching occupations for each title initially, and later filter out the irrelevant ones
-        tasks = [self._occupation_skill_search_service.search(query=title, k=top_p) for title in titles]
+        filter_specs: list[Optional[FilterSpec]] = [None]
         if work_type == WorkType.UNSEEN_UNPAID or work_type is None:
             # get the UUIDs of the unseen occupations from the taxonomy domain
-            unseen_occupations = await self._occupation_search_service.get_by_esco_code(code=re.compile("^I.*"))
-            filter_spec = FilterSpec(UUID=[occupation.UUID for occupation in unseen_occupations])
-            unseen_tasks = [self._occupation_skill_search_service.search(query=title, k=top_p, filter_spec=filter_spec)
-                            for title in titles]
-            tasks.extend(unseen_tasks)
+            unseen_occupations = await self._occupation_search_service.get_by_esco_code(code=UNSEEN_OCCUPATIONS_CODE_PATTERN)
+            filter_specs.append(FilterSpec(UUID=[occupation.UUID for occupation in unseen_occupations]))
+
+        # the titles are embedded once, and the embeddings are used for the searches with every filter
+        # (the titles that match the label of an occupation exactly may be searched without an embedding)
+        titles_list = list(titles)
+        titles_batches: list[list[str]] = [titles_list] if titles_list else []
+        titles_queries_batches: list[list[str | list[float]]] = []
+        if titles_list:
+            try:
+                titles_queries_batches = [await self._occupation_skill_search_service.embed_queries(titles_list)]
+            except Exception as e:  # pylint: disable=broad-except
+                # search each title on its own, so that a title that fails to embed fails only its own searches
+                self._logger.warning("Failed to embed the titles together, searching them one by one: %s", e)
+                titles_batches = titles_queries_batches = [[title] for title in titles_list]
+
+        # a task for each batch of titles and filter, so that a failing search does not drop the results of the others
+        tasks = []
+        task_names = []
+        for titles_queries, batch_titles in zip(titles_queries_batches, titles_batches):
+            for filter_spec in filter_specs:
+                tasks.append(self._occupation_skill_search_service.search_many(queries=titles_queries, filter_spec=filter_spec, k=top_p))
+                task_names.append(f"the titles {batch_titles}" + (" in the unseen occupations" if filter_spec is not None else ""))
 
         if work_type == WorkType.SELF_EMPLOYMENT or work_type is None:
             # since there is only one taxonomy domain for self-employment, it is not necessary to search, instead can retrieve the occupations directly
-            self_employment_tasks = [self._occupation_skill_search_service.get_by_esco_code(code="5221_2")]
-            tasks.extend(self_employment_tasks)
+            async def _self_employment_task() -> list[list[OccupationSkillEntity]]:
+                return [await self._occupation_skill_search_service.get_by_esco_code(code=SELF_EMPLOYMENT_OCCUPATION_CODE)]
+
+            tasks.append(_self_employment_task())
+            task_names.append("the self-employment occupation")
 
         # Use return_exceptions=True to handle individual task failures gracefully
         list_of_occupation_list = await asyncio.gather(*tasks, return_exceptions=True)
         
         # Filter out exceptions and log them
         valid_occupation_lists = []
-        for i, result in enumerate(list_of_occupation_list):
+        for task_name, result in zip(task_names, list_of_occupation_list):
             if isinstance(result, Exception):
-                _error = Exception(f"Failed to search occupations for title task {i}. Error: {str(result)}")
+                _error = Exception(f"Failed to search occupations for {task_name}. Error: {str(result)}")
                 self._logger.exception(_error)
             else:
-                valid_occupation_lists.append(result)
+                valid_occupation_lists.extend(result)
         
         # Build a list of unique occupations from the occupation skills based on their UUIDs
         occupations_skills = flattern(valid_occupation_lists)
@@ -5,7 +5,6 @@ from typing import List, Coroutine, Any
 from pydantic import BaseModel
 
 from app.vector_search.similarity_search_service import FilterSpec
-from app.vector_search.vector_search_dependencies import get_embeddings_service
 from ._relevant_skills_classifier_llm import _RelevantSkillsClassifierLLM
 from app.agent.agent_types import LLMStats
 from app.vector_search.esco_entities import OccupationSkillEntity, SkillEntity
@@ -83,20 +82,22 @@ class SkillLinkingTool:
                               "and will not be limited to the skills associated with the occupations provided.")
 
         # 1. Generate the embeddings for the responsibilities (responsibilities_data.responsibilities)
-        embeddings_service = await get_embeddings_service()
-        responsibilities_embeddings = await embeddings_service.embed_batch(responsibilities)
         # 2. For each responsibility (embedding),
-        # Find the top_p most similar skills that are within the list of skills associated with the occupations and get the top_k most relevant skills
+        # 2.1 Find the top_p most similar skills that are within the list of skills associated with the occupations
+        # The responsibilities are embedded in a single batch and searched together
+        filter_spec = FilterSpec(UUID=esco_skills_uuids) if len(esco_skills_uuids) > 0 else None
+        similar_skills_of_each_responsibility = await self._skill_search_service.search_many(queries=responsibilities,
+                                                                                            filter_spec=filter_spec,
+                                                                                            k=top_p)
+        # and get the top_k most relevant skills
         # Parallelize the process to speed up the execution
         tasks: list[Coroutine[Any, Any, tuple[list[SkillEntity], list[LLMStats]]]] = []
-        for responsibility_text, responsibility_embedding in zip(responsibilities, responsibilities_embeddings):
+        for responsibility_text, similar_skills in zip(responsibilities, similar_skills_of_each_responsibility):
             tasks.append(self._responsibility_to_skills(
                 responsibility_text=responsibility_text,
-                responsibility_embedding=responsibility_embedding,
-                esco_skills_uuids=esco_skills_uuids,
+                similar_skills=similar_skills,
                 job_titles=job_titles,
-                top_k=top_k,
-                top_p=top_p
+                top_k=top_k
             ))
         self._logger.debug(f"Executing {len(tasks)} tasks in parallel to find the most relevant skills for the responsibilities.")
         most_relevant_skills_of_each_responsibility: list[tuple[list[SkillEntity], list[LLMStats]]] = await asyncio.gather(*tasks)
@@ -133,11 +134,8 @@ class SkillLinkingTool:
             top_skills=[skill_stat for skill_stat in sorted_skills_score[:top_k]],
             llm_stats=all_llm_stats)
 
-    async def _responsibility_to_skills(self, *, responsibility_text: str, responsibility_embedding: list[float], esco_skills_uuids: list[str],
-                                        job_titles: list[str], top_k: int, top_p: int) -> tuple[list[SkillEntity], list[LLMStats]]:
-        # 2.1 Find the top_p most similar skills that are within the list of skills associated with the occupations
-        filter_spec = FilterSpec(UUID=esco_skills_uuids) if len(esco_skills_uuids) > 0 else None
-        similar_skills = await self._skill_search_service.search(query=responsibility_embedding, filter_spec=filter_spec, k=top_p)
+    async def _responsibility_to_skills(self, *, responsibility_text: str, similar_skills: list[SkillEntity],
+                                        job_titles: list[str], top_k: int) -> tuple[list[SkillEntity], list[LLMStats]]:
         # 2.2 Discard the skills that are not relevant by using the relevance classifier and return the top_k most relevant skills for the responsibility
         relevant_skills_output = await self._relevant_skills_tool.execute(
             job_titles=job_titles,
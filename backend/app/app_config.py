@@ -66,6 +66,12 @@ class ApplicationConfig(BaseModel):
     This is a dictionary that can contain various settings for the pipeline.
     """
 
+    vector_search_config: Optional[dict[str, str | int | float | bool]] = {}
+    """
+    The configuration for the vector search services.
+    This is a dictionary that can contain various settings for the search services, see VectorSearchSettings.
+    """
+
     enable_cv_upload: bool = False
     """
     A flag to enable or disable the CV upload feature.
@@ -16,9 +16,13 @@ from app.metrics.routes.routes import add_metrics_routes
 from app.sentry_init import init_sentry, set_sentry_contexts
 from app.server_dependencies.db_dependencies import CompassDBProvider
 from app.users.auth import Authentication, ApiKeyAuth
+from app.vector_search.cache_warm_up import get_cache_warm_up
+from app.vector_search.cache_warm_up_routes import add_cache_warm_up_routes
 from app.vector_search.occupation_search_routes import add_occupation_search_routes
+from app.vector_search.search_metrics_routes import add_search_metrics_routes
 from app.vector_search.skill_search_routes import add_skill_search_routes
 from app.vector_search.validate_taxonomy_model import validate_taxonomy_model
+from app.vector_search.vector_search_dependencies import get_vector_search_settings, initialize_search_services
 from app.version.version_routes import add_version_routes
 from app.i18n.language_config import load_language_config_from_env
 
@@ -188,6 +192,19 @@ if _experience_pipeline_config:
 else:
     logger.info("No EXPERIENCE_PIPELINE_CONFIG environment variable set, using empty configuration.")
 
+# The vector_search_config environment variable is optional.
+# If it is not provided, it will be set to an empty dictionary.
+_vector_search_config = os.getenv("BACKEND_VECTOR_SEARCH_CONFIG", "{}")
+vector_search_config = {}
+if _vector_search_config:
+    try:
+        vector_search_config = json.loads(_vector_search_config)
+        logger.info(f"Loaded vector search configuration: {vector_search_config}")
+    except json.JSONDecodeError as e:
+        logger.warning(f"Falling back to empty vector search configuration due to error: {e}")
+else:
+    logger.info("No BACKEND_VECTOR_SEARCH_CONFIG environment variable set, using empty configuration.")
+
 # Validate and load BACKEND_LANGUAGE_CONFIG environment variable
 try:
     language_config = load_language_config_from_env()
@@ -231,6 +248,7 @@ application_config = ApplicationConfig(
     embeddings_model_name=os.getenv("EMBEDDINGS_MODEL_NAME"),
     features=backend_features_config,
     experience_pipeline_config=experience_pipeline_config,
+    vector_search_config=vector_search_config,
     enable_cv_upload=_enable_cv_upload,
     cv_storage_bucket=os.getenv("BACKEND_CV_STORAGE_BUCKET", ""),
     cv_max_uploads_per_user=os.getenv("BACKEND_CV_MAX_UPLOADS_PER_USER") or DEFAULT_MAX_UPLOADS_PER_USER,
@@ -289,6 +307,24 @@ async def lifespan(_app: FastAPI):
                                 embeddings_model_name=app_cfg.embeddings_model_name),
     )
 
+    # When the searches are answered from the process memory, load the embeddings, the indexes and the graph before serving requests
+    vector_search_settings = get_vector_search_settings()
+    cache_warm_up_task: asyncio.Task | None = None
+    if (vector_search_settings.backend == "in-memory" or vector_search_settings.occupation_skill_graph
+            or vector_search_settings.occupation_code_index or vector_search_settings.occupation_label_search != "off"
+            or vector_search_settings.cache_warm_up):
+        search_services = await initialize_search_services(taxonomy_db=taxonomy_db,
+                                                           taxonomy_model_id=app_cfg.taxonomy_model_id,
+                                                           embeddings_service_name=app_cfg.embeddings_service_name,
+                                                           embeddings_model_name=app_cfg.embeddings_model_name)
+        # The caches are warmed up in the background, the /ready route reports when they are warm
+        if vector_search_settings.cache_warm_up:
+            cache_warm_up = get_cache_warm_up()
+            cache_warm_up.mark_pending()
+            cache_warm_up_task = asyncio.create_task(cache_warm_up.run(
+                occupation_search_service=search_services.occupation_search_service,
+                occupation_skill_search_service=search_services.occupation_skill_search_service))
+
     # We are initializing the feature loader here
     # so that plugins will be loaded after the application is initialized.
     await feature_loader.init(application_db)
@@ -307,6 +343,9 @@ async def lifespan(_app: FastAPI):
     # Shutdown logic
     logger.info("Shutting down...")
 
+    if cache_warm_up_task is not None and not cache_warm_up_task.done():
+        cache_warm_up_task.cancel()
+
     # close the database connections
     application_db.client.close()
     taxonomy_db.client.close()
@@ -375,6 +414,11 @@ auth = Authentication()
 ############################################
 add_version_routes(app)
 
+############################################
+# Add the readiness route
+############################################
+add_cache_warm_up_routes(app)
+
 ############################################
 # Add routes relevant for the conversation
 ############################################
@@ -406,6 +450,7 @@ api_key_auth = ApiKeyAuth()
 search_router = APIRouter(dependencies=[Depends(api_key_auth)], tags=["Search"])
 add_occupation_search_routes(search_router)
 add_skill_search_routes(search_router)
+add_search_metrics_routes(search_router)
 app.include_router(search_router)
 
 ############################################
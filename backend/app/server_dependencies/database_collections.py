@@ -14,3 +14,4 @@ class Collections:
     COMPASS_METRICS = "metric_events"
     USER_CV_UPLOADS: str = "user_cv_uploads"
     JOB_PREFERENCES: str = "job_preferences"
+    EMBEDDINGS_CACHE: str = "embeddings_cache"
@@ -6,6 +6,7 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
 from common_libs.environment_settings.mongo_db_settings import MongoDbSettings
 from app.app_config import get_application_config
+from app.vector_search.caching_embeddings_service import EMBEDDINGS_CACHE_TTL_SECONDS
 from .database_collections import Collections
 
 
@@ -221,6 +222,11 @@ class CompassDBProvider:
                 ("message_id", 1)
             ], unique=True)
 
+            # Expire the cached query embeddings, the collection would otherwise grow with every distinct user text
+            await application_db.get_collection(Collections.EMBEDDINGS_CACHE).create_index([
+                ("created_at", 1)
+            ], expireAfterSeconds=EMBEDDINGS_CACHE_TTL_SECONDS)
+
             logger.info("Finished creating indexes for the application database")
         except Exception as e:
             logger.exception(e)
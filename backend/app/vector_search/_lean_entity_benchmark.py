@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import bson
+from bson import ObjectId
+from pympler import asizeof
+
+from app.vector_search.esco_entities import LeanEntity, OccupationEntity
+from app.vector_search.esco_search_service import OccupationSearchService
+
+
+# A benchmark of the bytes transferred and the construction cost of the search results,
+# as full OccupationEntity objects and as LeanEntity objects (see AbstractEscoSearchService.search_lean).
+# The documents are synthetic, shaped like the grouped results of the occupations vector search.
+#
+#   python -m app.vector_search._lean_entity_benchmark --results 1000
+
+
+def _get_doc(i: int) -> dict:
+    return {"_id": ObjectId(),
+            "modelId": ObjectId(),
+            "occupationId": ObjectId(),
+            "UUID": str(ObjectId()),
+            "preferredLabel": f"occupation {i}",
+            "description": "A description of the occupation " * 20,
+            "scopeNote": "A scope note of the occupation " * 5,
+            "originUUID": str(ObjectId()),
+            "UUIDHistory": [str(ObjectId()) for _ in range(3)],
+            "altLabels": [f"alt label {j} of occupation {i}" for j in range(10)],
+            "code": f"{i:04d}.1",
+            "score": 0.5}
+
+
+def _project(doc: dict, fields: set[str]) -> dict:
+    return {name: value for name, value in doc.items() if name in fields}
+
+
+def _to_entity(doc: dict) -> OccupationEntity:
+    return OccupationEntity(id=str(doc.get("occupationId", "")), modelId=str(doc.get("modelId", "")), UUID=doc.get("UUID", ""),
+                            code=doc.get("code", ""), preferredLabel=doc.get("preferredLabel", ""),
+                            description=doc.get("description", ""), scopeNote=doc.get("scopeNote", ""),
+                            originUUID=doc.get("originUUID", ""), UUIDHistory=doc.get("UUIDHistory", []),
+                            altLabels=doc.get("altLabels", []), score=doc.get("score", 0.0))
+
+
+def _to_lean_entity(doc: dict) -> LeanEntity[OccupationEntity]:
+    return LeanEntity(id=str(doc.get("occupationId", "")), UUID=doc.get("UUID", ""), preferredLabel=doc.get("preferredLabel", ""),
+                      score=doc.get("score", 0.0), doc=doc, to_entity=_to_entity)
+
+
+def _construction_cost_us(docs: list[dict], build) -> float:
+    start_time = time.perf_counter()
+    for doc in docs:
+        build(doc)
+    return round((time.perf_counter() - start_time) / len(docs) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full and the lean search results.")
+    parser.add_argument("--results", type=int, default=1000, help="The number of search results")
+    args = parser.parse_args()
+
+    docs = [_get_doc(i) for i in range(args.results)]
+    lean_docs = [_project(doc, {"_id", "score", *OccupationSearchService._lean_fields}) for doc in docs]
+
+    full_bytes = sum(len(bson.encode(doc)) for doc in docs)
+    lean_bytes = sum(len(bson.encode(doc)) for doc in lean_docs)
+    print(f"bytes transferred per result: full={full_bytes // args.results}, lean fields={lean_bytes // args.results}")
+
+    full_us = _construction_cost_us(docs, _to_entity)
+    lean_us = _construction_cost_us(docs, _to_lean_entity)
+    print(f"construction cost per result: full={full_us} us, lean={lean_us} us ({full_us / max(lean_us, 0.01):.0f}x)")
+
+    # The lean entities refer to the documents, only their own size is accounted for
+    full_size = asizeof.asizeof([_to_entity(doc) for doc in docs]) // args.results
+    lean_size = sum(asizeof.flatsize(lean) + asizeof.asizeof(lean.id) for lean in map(_to_lean_entity, docs)) // args.results
+    print(f"memory per result: full={full_size} bytes, lean={lean_size} bytes (without the shared documents)")
+
+
+if __name__ == "__main__":
+    main()
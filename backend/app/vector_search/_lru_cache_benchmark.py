@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from bson import ObjectId
+
+from app.vector_search.esco_entities import AssociatedSkillEntity
+from app.vector_search.lru_cache import AsyncLRUCache, freeze
+
+
+# A benchmark of the hit latency and the allocations of the AsyncLRUCache, with and without copying the values.
+# The values are lists of AssociatedSkillEntity, as in the skills of occupation cache.
+#
+#   python -m app.vector_search._lru_cache_benchmark --skills 100 --hits 2000
+
+
+def _get_skills(count: int) -> list[AssociatedSkillEntity]:
+    return [AssociatedSkillEntity(id=str(ObjectId()),
+                                  modelId=str(ObjectId()),
+                                  UUID=str(ObjectId()),
+                                  preferredLabel=f"skill {i}",
+                                  description="A description of the skill " * 10,
+                                  altLabels=[f"alt label {j} of skill {i}" for j in range(5)],
+                                  skillType="skill/competence",
+                                  relationType="essential",
+                                  score=0.0)
+            for i in range(count)]
+
+
+async def _benchmark(*, cache: AsyncLRUCache, keys: int, hits: int) -> dict:
+    # measure the latency
+    start_time = time.perf_counter()
+    for i in range(hits):
+        await cache.get(i % keys)
+    elapsed = time.perf_counter() - start_time
+
+    # measure the allocations
+    tracemalloc.start()
+    for i in range(min(hits, 100)):
+        await cache.get(i % keys)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"mean_hit_latency_us": round(elapsed / hits * 1e6, 2), "peak_allocated_kb_per_100_hits": peak // 1024}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AsyncLRUCache with and without copying the values.")
+    parser.add_argument("--skills", type=int, default=100, help="The number of skills of each cached value")
+    parser.add_argument("--keys", type=int, default=50, help="The number of cached values")
+    parser.add_argument("--hits", type=int, default=2000, help="The number of hits to measure")
+    args = parser.parse_args()
+
+    copying_cache = AsyncLRUCache(name="copy", max_size=args.keys)
+    copy_free_cache = AsyncLRUCache(name="copy-free", max_size=args.keys, copy_values=False)
+    for key in range(args.keys):
+        skills = _get_skills(args.skills)
+        await copying_cache.set(key, skills)
+        await copy_free_cache.set(key, freeze(skills))
+
+    copying_result = await _benchmark(cache=copying_cache, keys=args.keys, hits=args.hits)
+    copy_free_result = await _benchmark(cache=copy_free_cache, keys=args.keys, hits=args.hits)
+    print(f"deepcopy : {copying_result}")
+    print(f"copy-free: {copy_free_result}")
+    print(f"speedup  : {copying_result['mean_hit_latency_us'] / max(copy_free_result['mean_hit_latency_us'], 0.01):.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,397 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Optional
+from unittest.mock import patch
+
+import numpy as np
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from app.agent.experience.work_type import WorkType
+from app.agent.linking_and_ranking_pipeline.cluster_responsibilities_tool.cluster_responsibilties_tool import Cluster, \
+    ClusterResponsibilitiesResponse, ClusterResponsibilitiesTool
+from app.agent.linking_and_ranking_pipeline.experience_pipeline import ExperiencePipeline, ExperiencePipelineConfig
+from app.agent.linking_and_ranking_pipeline.infer_occupation_tool._contextualization_llm import ContextualizationLLMResponse, \
+    _ContextualizationLLM
+from app.agent.linking_and_ranking_pipeline.pick_top_skills_tool import PickTopSkillsTool, PickTopSkillsToolOutput
+from app.agent.linking_and_ranking_pipeline.relevant_entities_classifier_llm import RelevantEntitiesClassifierLLM, \
+    RelevantEntityClassifierOutput
+from app.countries import Country
+from app.vector_search.embeddings_model import EmbeddingService
+from app.vector_search.esco_search_service import OccupationSearchService, OccupationSkillSearchService, SkillSearchService, \
+    VectorSearchConfig, clear_caches
+from app.vector_search.local_embedding_index import LocalEmbeddingIndex, group_doc, normalize_rows
+from app.vector_search.occupation_code_index import OccupationCodeIndex, SELF_EMPLOYMENT_OCCUPATION_CODE
+from app.vector_search.occupation_skill_graph import OccupationSkillGraph
+from app.vector_search.test_utils import FakeEmbeddingService
+from app.vector_search.vector_search_dependencies import SearchServices
+from common_libs.environment_settings.constants import EmbeddingConfig
+
+
+# A benchmark of the throughput, the latency and the allocations of the search services and of the experience pipeline,
+# at several concurrency levels, so that the regressions show up before they are deployed.
+#
+# It runs offline and is repeatable: the taxonomy is synthetic (generated from the seed), the embeddings are computed by
+# a deterministic fake embedding service, and the LLM calls of the pipeline are replaced by deterministic stand-ins
+# (with an optional simulated latency), so that only the search, linking and ranking work is measured.
+#
+# The backends:
+#   - in-process: the services answer from in-memory structures built directly from the synthetic taxonomy
+#                 (the local embedding indexes, the occupation to skill graph and the occupation code index),
+#                 no database is needed.
+#   - mongo: the synthetic taxonomy is written to a local MongoDB (e.g. docker run -p 27017:27017 mongo:7), and the
+#            services load it like in production (the vector searches are always answered by the local indexes,
+#            as $vectorSearch requires Atlas). The database is dropped at the end.
+#
+#   python -m app.vector_search._search_benchmark --concurrency 1 8 32
+#   python -m app.vector_search._search_benchmark --backend mongo --mongo-uri mongodb://localhost:27017 --skill-graph
+#
+# The results are printed as one JSON line per workload and concurrency, with the queries per second,
+# the p50/p95/p99 latencies in milliseconds, and the peak memory allocated while answering a sample of the requests.
+
+_WORKLOADS = ["occupation_search", "skill_search", "occupation_skill_search", "get_by_esco_code", "experience_pipeline"]
+
+_VOCABULARY_SIZE = 2000
+_UNSEEN_OCCUPATIONS_RATIO = 0.05
+
+
+class _WordVectors:
+    """
+    Deterministic embeddings, the embedding of a text is the normalized sum of the random vectors of its words,
+    so that the texts that share words are similar.
+    """
+
+    def __init__(self, dimensions: int, seed: int):
+        self._dimensions = dimensions
+        self._seed = seed
+        self._word_vectors: dict[str, np.ndarray] = {}
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            word_seed = int.from_bytes(hashlib.blake2b(f"{self._seed}:{word}".encode("utf-8"), digest_size=8).digest(), "little")
+            vector = self._word_vectors[word] = np.random.default_rng(word_seed).standard_normal(self._dimensions,
+                                                                                               dtype=np.float32)
+        return vector
+
+    def embed_sync(self, text: str) -> np.ndarray:
+        vector = np.sum([self._word_vector(word) for word in text.lower().split()] or [self._word_vector("")], axis=0)
+        return vector / np.linalg.norm(vector)
+
+    def embed_text(self, text: str) -> list[float]:
+        return self.embed_sync(text).tolist()
+
+
+class _SyntheticTaxonomy:
+    """
+    A taxonomy model with the shape of the embeddings collections: every entity has a document for each embedded field.
+    """
+
+    def __init__(self, *, occupations: int, skills: int, skills_per_occupation: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.model_id = ObjectId()
+        self.vocabulary = [f"word{i}" for i in range(_VOCABULARY_SIZE)]
+
+        def _text(min_words: int, max_words: int) -> str:
+            return " ".join(rng.choice(self.vocabulary, size=int(rng.integers(min_words, max_words + 1))))
+
+        def _docs(base: dict) -> list[dict]:
+            return [{**base, "embedded_field": field, "embedded_text": text}
+                    for field, text in [("preferredLabel", base["preferredLabel"]),
+                                        ("description", base["description"]),
+                                        ("altLabels", "\n".join(base["altLabels"]))]]
+
+        self.occupation_docs: list[dict] = []
+        unseen_occupations = int(occupations * _UNSEEN_OCCUPATIONS_RATIO)
+        for i in range(occupations):
+            if i == 0:
+                code = SELF_EMPLOYMENT_OCCUPATION_CODE
+            elif i <= unseen_occupations:
+                code = f"I{i:04d}"
+            else:
+                code = f"{i:04d}.1"
+            self.occupation_docs.extend(_docs({
+                "modelId": self.model_id, "occupationId": ObjectId(), "UUID": str(ObjectId()), "code": code,
+                "preferredLabel": _text(2, 4), "description": _text(20, 40), "scopeNote": "", "originUUID": "",
+                "UUIDHistory": [], "altLabels": [_text(2, 4) for _ in range(3)]}))
+
+        self.skill_docs: list[dict] = []
+        for _ in range(skills):
+            self.skill_docs.extend(_docs({
+                "modelId": self.model_id, "skillId": ObjectId(), "UUID": str(ObjectId()), "preferredLabel": _text(2, 4),
+                "description": _text(15, 30), "scopeNote": "", "originUUID": "", "UUIDHistory": [],
+                "altLabels": [_text(2, 4) for _ in range(3)], "skillType": "skill/competence"}))
+
+        skill_ids = [doc["skillId"] for doc in self.skill_docs[::3]]
+        self.relation_docs: list[dict] = []
+        for doc in self.occupation_docs[::3]:
+            for j in rng.choice(len(skill_ids), size=min(skills_per_occupation, len(skill_ids)), replace=False):
+                self.relation_docs.append({
+                    "modelId": self.model_id, "requiringOccupationId": doc["occupationId"], "requiredSkillId": skill_ids[j],
+                    "relationType": "essential" if rng.random() < 0.5 else "optional", "signallingValueLabel": ""})
+
+        self.queries = [_text(2, 5) for _ in range(1000)]
+        self.responsibilities = [f"I {_text(3, 6)}" for _ in range(1000)]
+
+    def embed(self, docs: list[dict], word_vectors: _WordVectors):
+        for doc in docs:
+            doc["embedding"] = word_vectors.embed_text(doc["embedded_text"])
+
+
+def _build_local_index(docs: list[dict], service: OccupationSearchService | SkillSearchService) -> LocalEmbeddingIndex:
+    # The documents of an entity are consecutive, as when they are loaded from the database sorted by entity
+    group_fields = service._group_fields()  # pylint: disable=protected-access
+    entity_key = group_fields["_id"].removeprefix("$")
+    entities: list[dict[str, Any]] = []
+    entity_index: dict[ObjectId, int] = {}
+    row_entities = []
+    for doc in docs:
+        if doc[entity_key] not in entity_index:
+            entity_index[doc[entity_key]] = len(entities)
+            entities.append(group_doc(doc, group_fields))
+        row_entities.append(entity_index[doc[entity_key]])
+    embeddings = normalize_rows(np.asarray([doc["embedding"] for doc in docs], dtype=np.float32))
+    return LocalEmbeddingIndex(embeddings=embeddings, row_entities=np.asarray(row_entities), entities=entities)
+
+
+def _build_skill_graph(taxonomy: _SyntheticTaxonomy) -> OccupationSkillGraph:
+    skills = [{field: doc[field] for field in ("skillId", "modelId", "UUID", "preferredLabel", "description", "scopeNote",
+                                               "altLabels", "skillType", "originUUID", "UUIDHistory")}
+              for doc in taxonomy.skill_docs[::3]]
+    skill_index = {skill["skillId"]: i for i, skill in enumerate(skills)}
+    relations_of_occupations: dict[ObjectId, list[dict]] = {}
+    for relation in taxonomy.relation_docs:
+        relations_of_occupations.setdefault(relation["requiringOccupationId"], []).append(relation)
+    relations = [relation for occupation_relations in relations_of_occupations.values() for relation in occupation_relations]
+    relation_types = sorted({relation["relationType"] for relation in relations})
+    return OccupationSkillGraph(
+        skills=skills,
+        occupation_ids=[str(occupation_id) for occupation_id in relations_of_occupations],
+        indptr=np.concatenate([[0], np.cumsum([len(r) for r in relations_of_occupations.values()])]).astype(np.int32),
+        skill_indices=np.asarray([skill_index[relation["requiredSkillId"]] for relation in relations], dtype=np.int32),
+        relation_type_codes=np.asarray([relation_types.index(relation["relationType"]) for relation in relations], dtype=np.int8),
+        relation_types=relation_types,
+        signalling_value_codes=np.zeros(len(relations), dtype=np.int8),
+        signalling_values=[""])
+
+
+async def _get_in_process_search_services(*, taxonomy: _SyntheticTaxonomy,
+                                          embedding_service: EmbeddingService) -> SearchServices:
+    # The services never reach the database, the client fails fast if they do
+    db = AsyncIOMotorClient("mongodb://localhost:1", serverSelectionTimeoutMS=1)["compass-benchmark"]
+    embedding_config = EmbeddingConfig()
+    model_id = str(taxonomy.model_id)
+    occupation_skill_search_service = OccupationSkillSearchService(db, embedding_service, model_id)
+    occupation_search_service = occupation_skill_search_service.occupation_search_service
+    skill_search_service = SkillSearchService(db, embedding_service, VectorSearchConfig(
+        collection_name=embedding_config.skill_collection_name,
+        index_name=embedding_config.embedding_index,
+        embedding_key=embedding_config.embedding_key), model_id)
+    # pylint: disable=protected-access
+    occupation_search_service._local_index = _build_local_index(taxonomy.occupation_docs, occupation_search_service)
+    occupation_search_service._code_index = OccupationCodeIndex([occupation_search_service._to_entity(doc)
+                                                                 for doc in taxonomy.occupation_docs[::3]])
+    skill_search_service._local_index = _build_local_index(taxonomy.skill_docs, skill_search_service)
+    occupation_skill_search_service._skill_graph = _build_skill_graph(taxonomy)
+    return SearchServices(skill_search_service=skill_search_service,
+                          occupation_search_service=occupation_search_service,
+                          occupation_skill_search_service=occupation_skill_search_service)
+
+
+async def _get_mongo_search_services(*, db: AsyncIOMotorDatabase, taxonomy: _SyntheticTaxonomy, embedding_service: EmbeddingService,
+                                     skill_graph: bool, code_index: bool) -> SearchServices:
+    embedding_config = EmbeddingConfig()
+    occupations_collection = db.get_collection(embedding_config.occupation_collection_name)
+    skills_collection = db.get_collection(embedding_config.skill_collection_name)
+    relations_collection = db.get_collection(embedding_config.occupation_to_skill_collection_name)
+    await occupations_collection.insert_many(taxonomy.occupation_docs)
+    await skills_collection.insert_many(taxonomy.skill_docs)
+    await relations_collection.insert_many(taxonomy.relation_docs)
+    # The indexes of the production collections (see scripts/embeddings/_common.py)
+    await occupations_collection.create_index([("modelId", 1), ("occupationId", 1)])
+    await occupations_collection.create_index([("modelId", 1), ("code", 1)])
+    await skills_collection.create_index([("modelId", 1), ("skillId", 1)])
+    await relations_collection.create_index([("modelId", 1), ("requiringOccupationId", 1)])
+
+    model_id = str(taxonomy.model_id)
+    occupation_skill_search_service = OccupationSkillSearchService(db, embedding_service, model_id)
+    skill_search_service = SkillSearchService(db, embedding_service, VectorSearchConfig(
+        collection_name=embedding_config.skill_collection_name,
+        index_name=embedding_config.embedding_index,
+        embedding_key=embedding_config.embedding_key), model_id)
+    await occupation_skill_search_service.enable_local_index(atlas_fallback=False)
+    await skill_search_service.enable_local_index(atlas_fallback=False)
+    if skill_graph:
+        await occupation_skill_search_service.enable_skill_graph()
+    if code_index:
+        await occupation_skill_search_service.enable_code_index()
+    return SearchServices(skill_search_service=skill_search_service,
+                          occupation_search_service=occupation_skill_search_service.occupation_search_service,
+                          occupation_skill_search_service=occupation_skill_search_service)
+
+
+def _patch_llm_calls(llm_latency: float):
+    """
+    Replace the LLM calls of the experience pipeline by deterministic stand-ins, that wait for the given latency.
+    """
+
+    async def _cluster(_self, *, responsibilities: list[str], number_of_clusters: int = 5) -> ClusterResponsibilitiesResponse:
+        await asyncio.sleep(llm_latency)
+        clusters = [Cluster(cluster_name=f"cluster {i}", responsibilities=responsibilities[i::number_of_clusters])
+                    for i in range(min(number_of_clusters, len(responsibilities)))]
+        return ClusterResponsibilitiesResponse(clusters=clusters, llm_stats=[])
+
+    async def _contextualize(_self, *, experience_title: str, responsibilities: list[str], number_of_titles: int = 5,
+                             **_kwargs) -> ContextualizationLLMResponse:
+        await asyncio.sleep(llm_latency)
+        words = " ".join(responsibilities).split()[1:]
+        titles = [f"{experience_title} {word}" for word in words[:number_of_titles]]
+        return ContextualizationLLMResponse(contextual_titles=titles, llm_stats=[])
+
+    async def _classify(_self, *, entities_to_classify: list, top_k: int = 5, **_kwargs) -> RelevantEntityClassifierOutput:
+        await asyncio.sleep(llm_latency)
+        return RelevantEntityClassifierOutput(most_relevant=entities_to_classify[:top_k], remaining=entities_to_classify[top_k:],
+                                              llm_stats=[])
+
+    async def _pick(_self, *, skills_to_rank: list, top_k: int, **_kwargs) -> PickTopSkillsToolOutput:
+        await asyncio.sleep(llm_latency)
+        return PickTopSkillsToolOutput(picked_skills=skills_to_rank[:top_k], remaining_skills=skills_to_rank[top_k:], llm_stats=[])
+
+    patches = [patch.object(ClusterResponsibilitiesTool, "execute", _cluster),
+               patch.object(_ContextualizationLLM, "execute", _contextualize),
+               patch.object(RelevantEntitiesClassifierLLM, "execute", _classify),
+               patch.object(PickTopSkillsTool, "execute", _pick)]
+    for p in patches:
+        p.start()
+    return patches
+
+
+def _get_workload(name: str, *, search_services: SearchServices, taxonomy: _SyntheticTaxonomy, k: int) -> Callable[[int], Awaitable]:
+    queries = taxonomy.queries
+    responsibilities = taxonomy.responsibilities
+    if name == "occupation_search":
+        return lambda i: search_services.occupation_search_service.search(query=queries[i % len(queries)], k=k)
+    if name == "skill_search":
+        return lambda i: search_services.skill_search_service.search(query=responsibilities[i % len(responsibilities)], k=k)
+    if name == "occupation_skill_search":
+        return lambda i: search_services.occupation_skill_search_service.search(query=queries[i % len(queries)], k=k)
+    if name == "get_by_esco_code":
+        codes = [doc["code"] for doc in taxonomy.occupation_docs[::3]]
+        return lambda i: search_services.occupation_skill_search_service.get_by_esco_code(code=codes[i % len(codes)])
+    if name == "experience_pipeline":
+        pipeline = ExperiencePipeline(config=ExperiencePipelineConfig(), search_services=search_services)
+        work_types = [WorkType.FORMAL_SECTOR_WAGED_EMPLOYMENT, WorkType.SELF_EMPLOYMENT, WorkType.UNSEEN_UNPAID]
+        return lambda i: pipeline.execute(experience_title=queries[i % len(queries)],
+                                          responsibilities=[responsibilities[(i * 5 + j) % len(responsibilities)] for j in range(5)],
+                                          company_name=None,
+                                          country_of_interest=Country.SOUTH_AFRICA,
+                                          work_type=work_types[i % len(work_types)])
+    raise ValueError(f"Unknown workload: {name}")
+
+
+async def _run(workload: Callable[[int], Awaitable], *, requests: int, concurrency: int) -> list[float]:
+    """
+    Run the requests with the given number of concurrent workers, and return the latency of each request.
+    """
+    latencies: list[float] = []
+    next_request = 0
+
+    async def _worker():
+        nonlocal next_request
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            start_time = time.perf_counter()
+            await workload(i)
+            latencies.append(time.perf_counter() - start_time)
+
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def _benchmark(workload: Callable[[int], Awaitable], *, requests: int, concurrency: int, allocation_requests: int) -> dict:
+    # The caches are cleared, so that every run starts cold and the runs are comparable
+    await clear_caches()
+    start_time = time.perf_counter()
+    latencies = await _run(workload, requests=requests, concurrency=concurrency)
+    elapsed = time.perf_counter() - start_time
+
+    # measure the allocations on a sample of the requests, tracing slows down the requests
+    await clear_caches()
+    tracemalloc.start()
+    await _run(lambda i: workload(requests + i), requests=allocation_requests, concurrency=concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"requests": requests,
+            "concurrency": concurrency,
+            "queries_per_second": round(requests / elapsed, 1),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            f"peak_allocated_kb_per_{allocation_requests}_requests": peak // 1024}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search services and the experience pipeline offline.")
+    parser.add_argument("--backend", choices=["in-process", "mongo"], default="in-process",
+                        help="Build the in-memory structures directly, or load the taxonomy from a local MongoDB")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="The MongoDB of the mongo backend")
+    parser.add_argument("--skill-graph", action="store_true", help="Mongo backend: answer the skills of the occupations from the graph")
+    parser.add_argument("--code-index", action="store_true", help="Mongo backend: answer the occupation codes from the code index")
+    parser.add_argument("--workloads", nargs="+", choices=_WORKLOADS, default=_WORKLOADS, help="The workloads to run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="The concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=500, help="The number of requests of each run")
+    parser.add_argument("--allocation-requests", type=int, default=20, help="The number of requests traced for allocations")
+    parser.add_argument("--k", type=int, default=10, help="The number of results of each search")
+    parser.add_argument("--occupations", type=int, default=3000, help="The number of occupations of the taxonomy")
+    parser.add_argument("--skills", type=int, default=13000, help="The number of skills of the taxonomy")
+    parser.add_argument("--skills-per-occupation", type=int, default=30, help="The number of skills of each occupation")
+    parser.add_argument("--dimensions", type=int, default=768, help="The number of dimensions of the embeddings")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="The simulated latency of the LLM calls of the pipeline")
+    parser.add_argument("--seed", type=int, default=42, help="The seed of the synthetic taxonomy")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    start_time = time.perf_counter()
+    word_vectors = _WordVectors(dimensions=args.dimensions, seed=args.seed)
+    embedding_service = FakeEmbeddingService(embed_text=word_vectors.embed_text, record_calls=False)
+    taxonomy = _SyntheticTaxonomy(occupations=args.occupations, skills=args.skills,
+                                  skills_per_occupation=args.skills_per_occupation, seed=args.seed)
+    taxonomy.embed(taxonomy.occupation_docs, word_vectors)
+    taxonomy.embed(taxonomy.skill_docs, word_vectors)
+
+    client: Optional[AsyncIOMotorClient] = None
+    db_name = f"compass-benchmark-{taxonomy.model_id}"
+    if args.backend == "mongo":
+        client = AsyncIOMotorClient(args.mongo_uri)
+        search_services = await _get_mongo_search_services(db=client[db_name], taxonomy=taxonomy, embedding_service=embedding_service,
+                                                           skill_graph=args.skill_graph, code_index=args.code_index)
+    else:
+        search_services = await _get_in_process_search_services(taxonomy=taxonomy, embedding_service=embedding_service)
+    print(f"Set up the {args.backend} backend in {time.perf_counter() - start_time:.1f} seconds")
+
+    patches = _patch_llm_calls(args.llm_latency_ms / 1000)
+    try:
+        for name in args.workloads:
+            workload = _get_workload(name, search_services=search_services, taxonomy=taxonomy, k=args.k)
+            for concurrency in args.concurrency:
+                result = await _benchmark(workload, requests=args.requests, concurrency=concurrency,
+                                          allocation_requests=args.allocation_requests)
+                print(json.dumps({"workload": name, "backend": args.backend, **result}))
+    finally:
+        for p in patches:
+            p.stop()
+        if client is not None:
+            await client.drop_database(db_name)
+            client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
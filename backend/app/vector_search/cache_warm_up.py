@@ -0,0 +1,106 @@
+import logging
+import re
+import time
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from app.vector_search.esco_search_service import OccupationSearchService, OccupationSkillSearchService
+from app.vector_search.occupation_code_index import UNSEEN_OCCUPATIONS_CODE_PATTERN, SELF_EMPLOYMENT_OCCUPATION_CODE
+
+logger = logging.getLogger(__name__)
+
+# The codes looked up by the conversation agents on every conversation, see infer_occupation_tool.py
+_WARM_UP_CODES: list[str | re.Pattern] = [UNSEEN_OCCUPATIONS_CODE_PATTERN, SELF_EMPLOYMENT_OCCUPATION_CODE]
+
+CacheWarmUpState = Literal["disabled", "pending", "running", "ready", "failed"]
+
+
+class CacheWarmUpStatus(BaseModel):
+    """
+    The progress of the warm-up of the search caches.
+    """
+
+    state: CacheWarmUpState
+    """
+    - "disabled": the caches are not warmed up, the instance is ready.
+    - "pending": the warm-up has not started yet.
+    - "running": the warm-up is in progress.
+    - "ready": the caches are warm.
+    - "failed": the warm-up failed, the instance is ready but the caches are filled by the requests.
+    """
+
+    occupations_warmed_up: int = 0
+    """
+    The number of occupations whose skills have been loaded into the caches so far,
+    once the warm-up is over, the number of occupations whose skills are still in the caches.
+    """
+
+    duration_seconds: Optional[float] = None
+    """
+    The duration of the warm-up, once it is over.
+    """
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state in ("disabled", "ready", "failed")
+
+
+class CacheWarmUp:
+    """
+    Warms up the search caches of the taxonomy model in the background, at startup,
+    so that the first users after a deploy or a scale-out do not pay the latency of a cold cache.
+    """
+
+    def __init__(self):
+        self._status = CacheWarmUpStatus(state="disabled")
+
+    @property
+    def status(self) -> CacheWarmUpStatus:
+        return self._status.model_copy()
+
+    def mark_pending(self) -> None:
+        """
+        Mark the warm-up as pending, so that the instance is not reported as ready until the warm-up is over.
+        """
+        self._status = CacheWarmUpStatus(state="pending")
+
+    async def run(self, *, occupation_search_service: OccupationSearchService,
+                  occupation_skill_search_service: OccupationSkillSearchService,
+                  batch_size: int = 500) -> None:
+        """
+        Load the occupations looked up by code and all the occupations and their skills into the caches.
+        The errors are logged and not raised, the caches are then filled by the requests.
+        :param occupation_search_service: The occupation search service.
+        :param occupation_skill_search_service: The occupation skill search service.
+        :param batch_size: The number of occupations streamed at once, their skills are retrieved in smaller chunks.
+        """
+        start_time = time.time()
+        self._status = CacheWarmUpStatus(state="running")
+        logger.info("Warming up the search caches...")
+        try:
+            for code in _WARM_UP_CODES:
+                await occupation_search_service.get_by_esco_code(code=code)
+
+            def _on_progress(count: int):
+                self._status.occupations_warmed_up = count
+                logger.debug("Warmed up the search caches with %d occupations", count)
+
+            count = await occupation_skill_search_service.warm_up_caches(batch_size=batch_size, on_progress=_on_progress)
+            self._status = CacheWarmUpStatus(state="ready", occupations_warmed_up=count,
+                                             duration_seconds=round(time.time() - start_time, 2))
+            logger.info("Warmed up the search caches with %d occupations in %.2f seconds", count, time.time() - start_time)
+        except Exception as e:  # pylint: disable=broad-except
+            self._status = CacheWarmUpStatus(state="failed", occupations_warmed_up=self._status.occupations_warmed_up,
+                                             duration_seconds=round(time.time() - start_time, 2))
+            logger.error("Failed to warm up the search caches: %s", e, exc_info=True)
+
+
+_cache_warm_up = CacheWarmUp()
+
+
+def get_cache_warm_up() -> CacheWarmUp:
+    """
+    Get the cache warm-up singleton instance.
+    """
+    return _cache_warm_up
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from app.vector_search.cache_warm_up import CacheWarmUp, CacheWarmUpStatus, get_cache_warm_up
+
+
+def add_cache_warm_up_routes(app: APIRouter) -> None:
+    """ Add the readiness route to the FastAPI app."""
+
+    @app.get("/ready",
+             response_model=CacheWarmUpStatus,
+             responses={503: {"model": CacheWarmUpStatus}},
+             description="""
+             Returns 200 when the instance is ready to serve requests, and 503 while the search caches are warming up.
+             Unlike /version, it is meant for the readiness probe, not the liveness probe.""",
+             )
+    async def _get_readiness(cache_warm_up: CacheWarmUp = Depends(get_cache_warm_up)):
+        status = cache_warm_up.status
+        return JSONResponse(status_code=200 if status.is_ready else 503, content=status.model_dump())
@@ -0,0 +1,186 @@
+import hashlib
+import re
+import unicodedata
+from datetime import datetime, timezone
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+
+from app.vector_search.embeddings_model import EmbeddingService
+from app.vector_search.lru_cache import AsyncLRUCache, nbytes_sizeof
+
+_WHITESPACE_REGEX = re.compile(r"\s+")
+
+# The stored embeddings expire this long after they were stored (TTL index on created_at), so that the collection
+# of the (user provided) texts does not grow forever. An expired text is embedded again on its next use.
+EMBEDDINGS_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before embedding it, so that texts that differ only in unicode representation or whitespace
+    share the same embedding (and the same cache entry).
+    """
+    return _WHITESPACE_REGEX.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCacheStore(ABC):
+    """
+    A persistent tier for the CachingEmbeddingService, shared across processes and restarts.
+    """
+
+    @abstractmethod
+    async def get_many(self, *, model_name: str, texts: list[str]) -> dict[str, list[float]]:
+        """
+        Get the stored embeddings of the given texts.
+        :return: The embeddings found, keyed by text.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_many(self, *, model_name: str, embeddings: dict[str, list[float]]) -> None:
+        """
+        Store the embeddings of the given texts.
+        """
+        raise NotImplementedError
+
+
+class MongoEmbeddingCacheStore(EmbeddingCacheStore):
+    """
+    An EmbeddingCacheStore backed by a MongoDB collection.
+    The documents are keyed by a hash of the model name and the text, and expire EMBEDDINGS_CACHE_TTL_SECONDS after they
+    were stored (see the TTL index created by CompassDBProvider.initialize_application_mongo_db).
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self._collection = collection
+
+    @staticmethod
+    def _key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    async def get_many(self, *, model_name: str, texts: list[str]) -> dict[str, list[float]]:
+        keys = {self._key(model_name, text): text for text in texts}
+        result = {}
+        async for doc in self._collection.find({"_id": {"$in": list(keys.keys())}}, {"embedding": 1}):
+            result[keys[doc["_id"]]] = doc["embedding"]
+        return result
+
+    async def set_many(self, *, model_name: str, embeddings: dict[str, list[float]]) -> None:
+        if not embeddings:
+            return
+        created_at = datetime.now(timezone.utc)
+        await self._collection.bulk_write([
+            UpdateOne({"_id": self._key(model_name, text)},
+                      {"$setOnInsert": {"model_name": model_name, "embedding": embedding, "created_at": created_at}},
+                      upsert=True)
+            for text, embedding in embeddings.items()
+        ], ordered=False)
+
+
+class CachingEmbeddingService(EmbeddingService):
+    """
+    An EmbeddingService decorator that caches the embeddings of the texts.
+    The embeddings are looked up in a bounded in-memory LRU tier, then in an optional persistent tier,
+    and only the remaining texts are embedded by the decorated service (in a single batch).
+
+    The in-memory tier belongs to a single model, the persistent tier is keyed on the model name and the text.
+    The texts are normalized (see normalize_text) before the lookup, the normalized text is also the one that is embedded.
+    """
+
+    def __init__(self, *, embedding_service: EmbeddingService, max_size: int = 2000, store: Optional[EmbeddingCacheStore] = None):
+        """
+        :param embedding_service: The decorated embedding service.
+        :param max_size: The maximum number of embeddings kept in memory, 0 disables the in-memory tier.
+        :param store: An optional persistent tier.
+        """
+        super().__init__(service_name=embedding_service.service_name, model_name=embedding_service.model_name)
+        self._embedding_service = embedding_service
+        self._store = store
+        # The embeddings are kept as float32 arrays, a list of python floats takes ~8x more memory.
+        # The arrays are never modified (they are converted to lists when returned), so they are not copied.
+        self._cache = AsyncLRUCache(name=f"Embeddings of {self.model_name}", max_size=max_size, copy_values=False,
+                                    sizeof=nbytes_sizeof) if max_size > 0 else None
+
+        # Stats
+        self._requests = 0
+        self._memory_hits = 0
+        self._store_hits = 0
+        self._misses = 0
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        normalized_texts = [normalize_text(text) if isinstance(text, str) else text for text in texts]
+        empty_indices = [idx for idx, txt in enumerate(normalized_texts) if not isinstance(txt, str) or not txt]
+        if empty_indices:
+            raise ValueError(f"embed_batch received empty texts at indices: {empty_indices}")
+
+        self._requests += len(normalized_texts)
+        found: dict[str, list[float]] = {}
+        for text in dict.fromkeys(normalized_texts):
+            cached = await self._cache.get(text) if self._cache is not None else None
+            if cached is not None:
+                found[text] = cached.tolist()
+        self._memory_hits += sum(1 for text in normalized_texts if text in found)
+
+        missing = [text for text in dict.fromkeys(normalized_texts) if text not in found]
+        if missing and self._store is not None:
+            try:
+                stored = await self._store.get_many(model_name=self.model_name, texts=missing)
+            except Exception as e:  # pylint: disable=broad-except
+                # the persistent tier is an optimization, embed the texts if it is not available
+                self.logger.warning("Failed to read the embeddings from the persistent cache: %s", e)
+                stored = {}
+            for text, embedding in stored.items():
+                found[text] = embedding
+                await self._cache_set(text, embedding)
+            missing = [text for text in missing if text not in stored]
+            self._store_hits += sum(1 for text in normalized_texts if text in stored)
+
+        if missing:
+            missing_set = set(missing)
+            self._misses += sum(1 for text in normalized_texts if text in missing_set)
+            embeddings = await self._embedding_service.embed_batch(missing)
+            new_embeddings = dict(zip(missing, embeddings))
+            for text, embedding in new_embeddings.items():
+                found[text] = embedding
+                await self._cache_set(text, embedding)
+            if self._store is not None:
+                try:
+                    await self._store.set_many(model_name=self.model_name, embeddings=new_embeddings)
+                except Exception as e:  # pylint: disable=broad-except
+                    self.logger.warning("Failed to write the embeddings to the persistent cache: %s", e)
+
+        return [found[text] for text in normalized_texts]
+
+    async def _cache_set(self, text: str, embedding: list[float]) -> None:
+        if self._cache is not None:
+            await self._cache.set(text, np.asarray(embedding, dtype=np.float32))
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics.
+        :return: A dictionary with the number of requested texts, the hits of each tier, the misses and the hit rate.
+        """
+        hits = self._memory_hits + self._store_hits
+        return {
+            "requests": self._requests,
+            "memory_hits": self._memory_hits,
+            "store_hits": self._store_hits,
+            "misses": self._misses,
+            "hit_rate_percent": round(hits / self._requests * 100, 2) if self._requests else 0.0,
+        }
+
+    def clear_stats(self) -> None:
+        """
+        Clear the cache statistics.
+        """
+        self._requests = 0
+        self._memory_hits = 0
+        self._store_hits = 0
+        self._misses = 0
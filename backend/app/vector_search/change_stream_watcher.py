@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
+
+# The error codes of a change stream that cannot be resumed, e.g. the resume token is no longer in the oplog
+_NON_RESUMABLE_ERROR_CODES = {280, 286}
+
+
+class ChangeStreamWatcher:
+    """
+    Watches the changes of a collection, and reconnects after an error.
+
+    The resume token of the last handled change is kept, so that a reconnect continues where the stream left off
+    instead of missing the changes made in the meantime. If the stream cannot be resumed, on_history_lost is called
+    (e.g. to clear the caches) and the collection is watched again from the current time.
+    """
+
+    def __init__(self, *, collection: AsyncIOMotorCollection,
+                 on_change: Callable[[dict], Awaitable[None]],
+                 on_history_lost: Callable[[], Awaitable[None]],
+                 logger: logging.Logger,
+                 min_retry_delay: float = 1.0,
+                 max_retry_delay: float = 300.0):
+        """
+        :param collection: The collection to watch.
+        :param on_change: Called with each change document, with the full document and, when available,
+                          the full document before the change.
+        :param on_history_lost: Called when the changes since the last resume token cannot be retrieved.
+        :param logger: The logger to use.
+        :param min_retry_delay: The delay before the first reconnect, in seconds. It doubles after each failed attempt.
+        :param max_retry_delay: The maximum delay between reconnects, in seconds.
+        """
+        self._collection = collection
+        self._on_change = on_change
+        self._on_history_lost = on_history_lost
+        self._logger = logger
+        self._min_retry_delay = min_retry_delay
+        self._max_retry_delay = max_retry_delay
+        self.resume_token: Optional[Any] = None
+
+    async def run(self) -> None:
+        """
+        Watch the collection until the task is cancelled.
+        """
+        retry_delay = self._min_retry_delay
+        while True:
+            try:
+                self._logger.info("Watching database changes for collection: %s", self._collection.name)
+                async with self._collection.watch(full_document="updateLookup",
+                                                  full_document_before_change="whenAvailable",
+                                                  resume_after=self.resume_token) as stream:
+                    async for change in stream:
+                        await self._on_change(change)
+                        self.resume_token = stream.resume_token
+                        retry_delay = self._min_retry_delay
+            except OperationFailure as e:
+                if e.code in _NON_RESUMABLE_ERROR_CODES and self.resume_token is not None:
+                    self._logger.warning("Cannot resume watching the collection %s: %s", self._collection.name, e)
+                    self.resume_token = None
+                    await self._on_history_lost()
+                else:
+                    self._logger.error("Error watching database changes of %s: %s", self._collection.name, e)
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Error watching database changes of %s: %s", self._collection.name, e)
+
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, self._max_retry_delay)
+
+
+async def watch_collections(*watchers: ChangeStreamWatcher) -> None:
+    """
+    Run the watchers concurrently, until the task is cancelled.
+    """
+    await asyncio.gather(*(watcher.run() for watcher in watchers))
+
+
+def _is_field_updated(change: dict, field: str) -> bool:
+    """
+    Whether an update may have changed the value of a field, according to the description of the update.
+    """
+    update_description = change.get("updateDescription") or {}
+    changed_fields = list((update_description.get("updatedFields") or {}).keys())
+    changed_fields += update_description.get("removedFields") or []
+    changed_fields += [truncated["field"] for truncated in update_description.get("truncatedArrays") or []]
+    return any(changed_field == field or changed_field.startswith(field + ".") for changed_field in changed_fields)
+
+
+def get_changed_values(change: dict, field: str) -> Optional[set]:
+    """
+    Get the values of a field in the documents affected by a change, before and after the change.
+
+    The documents before the change are only available if the pre-images are enabled on the collection
+    (changeStreamPreAndPostImages), which they are not by default. Without them, the value before an update that
+    changed the field, or before a replace, is not known.
+    :param change: The change document, see ChangeStreamWatcher.
+    :param field: The field of the documents.
+    :return: The values of the field, or None if they are not known (e.g. a delete without the document before the change).
+    """
+    operation = change.get("operationType")
+    if not change.get("fullDocumentBeforeChange") and (
+            operation == "replace" or (operation == "update" and _is_field_updated(change, field))):
+        return None
+    values = {document[field] for document in (change.get("fullDocument"), change.get("fullDocumentBeforeChange"))
+              if document and document.get(field) is not None}
+    return values or None
@@ -1,14 +1,20 @@
+import asyncio
 import logging
 import os
 import time
 from abc import ABC, abstractmethod
-from typing import Coroutine, Any
+from typing import Coroutine, Any, Optional
 
 import vertexai
+from google.api_core.exceptions import BadRequest
 from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel, TextEmbedding
 
 from common_libs.retry import Retry
 
+# The errors of a batch that may be caused by a single text (e.g. an invalid or too long text).
+# The other errors (transport, quota, ...) fail all the texts of the batch alike.
+_PER_TEXT_ERRORS = (ValueError, BadRequest)
+
 
 class EmbeddingService(ABC):
     """ An abstract class for a text embedding service."""
@@ -57,6 +63,10 @@ class GoogleEmbeddingService(EmbeddingService):
         vertexai.init(location=self.region)
         self.model = TextEmbeddingModel.from_pretrained(model_name)
 
+        # https://cloud.google.com/vertex-ai/generative-ai/docs/embeddings/get-text-embeddings#supported-models
+        # As of 14 August 2024, the maximum batch size is 250 of us-central1, and in other regions it is 5
+        self.max_batch_size = 250 if self.region == "us-central1" else 5
+
     async def embed(self, text: str) -> list[float]:
         """
          Generates embeddings for a text input.
@@ -77,12 +87,8 @@ class GoogleEmbeddingService(EmbeddingService):
         # make sure we are in the correct region
         vertexai.init(location=self.region)
 
-        # https://cloud.google.com/vertex-ai/generative-ai/docs/embeddings/get-text-embeddings#supported-models
-        # As of 14 August 2024, the maximum batch size is 250 of us-central1, and in other regions it is 5
-        # create batches of 250 queries at a time
-        batch_size = 250
-        if self.region != "us-central1":
-            batch_size = 5
+        # create batches of the region's maximum batch size
+        batch_size = self.max_batch_size
         embeddings = []
         for i in range(0, len(text_list), batch_size):
             def _callback() -> Coroutine[Any, Any, list[TextEmbedding]]:
@@ -107,3 +113,90 @@ class GoogleEmbeddingService(EmbeddingService):
             raise e
 
 
+class CoalescingEmbeddingService(EmbeddingService):
+    """
+    An EmbeddingService decorator that coalesces the concurrent embedding requests.
+
+    The texts of the embed() and embed_batch() calls arriving within a short window are gathered into a single
+    embed_batch() call of the decorated service (up to its maximum batch size), and the embeddings are fanned back out
+    to the waiting callers, in the order of their texts.
+    If a coalesced batch fails because of its texts (see _PER_TEXT_ERRORS), they are embedded one by one, so that a failing
+    text only fails its own caller. Any other error (e.g. the service is unavailable) fails all the callers of the batch,
+    without multiplying the calls to the failing service.
+    """
+
+    def __init__(self, *, embedding_service: EmbeddingService, window_seconds: float = 0.005, max_batch_size: int = 250):
+        """
+        :param embedding_service: The decorated embedding service.
+        :param window_seconds: How long to wait for other requests before embedding the pending texts.
+        :param max_batch_size: The maximum number of texts embedded at once, a batch is sent as soon as it is full.
+        """
+        super().__init__(service_name=embedding_service.service_name, model_name=embedding_service.model_name)
+        self._embedding_service = embedding_service
+        self._window_seconds = window_seconds
+        self._max_batch_size = max_batch_size
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # keep a reference to the running batches, so they are not garbage collected
+        self._batch_tasks: set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        empty_indices = [idx for idx, txt in enumerate(texts) if not isinstance(txt, str) or not txt.strip()]
+        if empty_indices:
+            raise ValueError(f"embed_batch received empty texts at indices: {empty_indices}")
+        if len(texts) >= self._max_batch_size:
+            # a full batch does not benefit from waiting for other requests
+            return await self._embedding_service.embed_batch(texts)
+
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        self._pending.extend(zip(texts, futures))
+        if len(self._pending) >= self._max_batch_size:
+            self._flush(full_batches_only=True)
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, *, full_batches_only: bool):
+        while self._pending and (not full_batches_only or len(self._pending) >= self._max_batch_size):
+            batch, self._pending = self._pending[:self._max_batch_size], self._pending[self._max_batch_size:]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self._window_seconds)
+        self._flush_task = None
+        self._flush(full_batches_only=False)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        # the callers may have been cancelled while waiting
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            embeddings = await self._embedding_service.embed_batch([text for text, _ in batch])
+            if len(embeddings) != len(batch):
+                raise RuntimeError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+        except _PER_TEXT_ERRORS as e:
+            if len(batch) == 1:
+                self._fail(batch, e)
+                return
+            self.logger.warning("Failed to embed a batch of %d texts, embedding them one by one: %s", len(batch), e)
+            await asyncio.gather(*(self._run_batch([item]) for item in batch))
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            self._fail(batch, e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    @staticmethod
+    def _fail(batch: list[tuple[str, asyncio.Future]], error: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Literal, Optional
+
+import numpy as np
+from bson import ObjectId, json_util
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel
+
+from app.vector_search.local_embedding_index import IndexDType, LocalEmbeddingIndex, group_doc, normalize_rows
+
+# An embeddings snapshot is a directory per taxonomy model:
+#
+#   <snapshot_dir>/<model_id>/
+#       manifest.json                           The SnapshotManifest
+#       <collection>.embeddings.npy             (rows x dimensions) L2 normalized embeddings, the rows of an entity are adjacent
+#       <collection>.row_entities.npy           (rows,) int32 index of the entity of each row
+#       <collection>.entities.jsonl             One extended-JSON document per entity (without the embeddings)
+#
+# The .npy files are memory-mapped read-only when loaded, so all the workers on a node share the same page-cache pages.
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+SnapshotDType = Literal["float32", "float16"]
+
+_MANIFEST_FILE = "manifest.json"
+
+
+class SnapshotCollectionInfo(BaseModel):
+    """
+    Information about the embeddings of a collection in a snapshot.
+    """
+    rows: int
+    entities: int
+    dimensions: int
+    entity_key: str
+    """
+    The field of the documents identifying the entity, e.g. occupationId or skillId
+    """
+
+
+class SnapshotManifest(BaseModel):
+    """
+    The manifest of an embeddings snapshot.
+    """
+    format_version: int
+    model_id: str
+    dtype: SnapshotDType
+    embeddings_service: Optional[dict[str, str]] = None
+    """
+    The embeddings service and model used to generate the embeddings, as found in the model info collection.
+    """
+    created_at: str
+    collections: dict[str, SnapshotCollectionInfo]
+
+
+def get_snapshot_path(*, snapshot_dir: str, model_id: str) -> str:
+    return os.path.join(snapshot_dir, model_id)
+
+
+def _file_path(path: str, collection_name: str, suffix: str) -> str:
+    return os.path.join(path, f"{collection_name}.{suffix}")
+
+
+def read_snapshot_manifest(*, snapshot_dir: str, model_id: str) -> SnapshotManifest:
+    """
+    Read and validate the manifest of the snapshot of a taxonomy model.
+    """
+    path = get_snapshot_path(snapshot_dir=snapshot_dir, model_id=model_id)
+    with open(os.path.join(path, _MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = SnapshotManifest.model_validate_json(f.read())
+    if manifest.format_version != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported embeddings snapshot format version {manifest.format_version}, "
+                         f"expected {SNAPSHOT_FORMAT_VERSION}")
+    if manifest.model_id != model_id:
+        raise ValueError(f"The embeddings snapshot in {path} is for the taxonomy model {manifest.model_id}, expected {model_id}")
+    return manifest
+
+
+def load_embeddings_snapshot(*,
+                             snapshot_dir: str,
+                             model_id: str,
+                             collection_name: str,
+                             group_fields: dict,
+                             logger: logging.Logger,
+                             dtype: IndexDType = "float32") -> LocalEmbeddingIndex:
+    """
+    Load the embeddings of a collection from a snapshot into a LocalEmbeddingIndex.
+    The embeddings matrix is memory-mapped read-only, it is not copied into the process memory.
+    If a smaller type than the one of the snapshot is given, the embeddings are quantized into the process memory,
+    and the memory-mapped embeddings are only read to re-score the best candidates of the searches.
+    :param snapshot_dir: The directory with the snapshots.
+    :param model_id: The taxonomy model id.
+    :param collection_name: The name of the embeddings collection (occupations or skills).
+    :param group_fields: The $group fields of the search service, used to build the entity documents.
+    :param logger: The logger to use.
+    :param dtype: The type the embeddings are stored with in memory, see LocalEmbeddingIndex.quantize.
+    """
+    start_time = time.time()
+    manifest = read_snapshot_manifest(snapshot_dir=snapshot_dir, model_id=model_id)
+    info = manifest.collections.get(collection_name)
+    if info is None:
+        raise ValueError(f"The embeddings snapshot of the taxonomy model {model_id} does not contain {collection_name}")
+
+    path = get_snapshot_path(snapshot_dir=snapshot_dir, model_id=model_id)
+    embeddings = np.load(_file_path(path, collection_name, "embeddings.npy"), mmap_mode="r")
+    row_entities = np.load(_file_path(path, collection_name, "row_entities.npy"), mmap_mode="r")
+    if embeddings.shape != (info.rows, info.dimensions) or len(row_entities) != info.rows:
+        raise ValueError(f"The embeddings snapshot of {collection_name} does not match its manifest")
+
+    entities = []
+    with open(_file_path(path, collection_name, "entities.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            entities.append(group_doc(json_util.loads(line), group_fields))
+
+    logger.info("Loaded the embeddings snapshot of %d embeddings of %d entities of %s in %.2f seconds",
+                info.rows, len(entities), collection_name, time.time() - start_time)
+    return LocalEmbeddingIndex(embeddings=embeddings, row_entities=row_entities, entities=entities).quantize(dtype)
+
+
+async def write_embeddings_snapshot(*,
+                                    snapshot_dir: str,
+                                    model_id: str,
+                                    collections: dict[str, AsyncIOMotorCollection],
+                                    embedding_key: str,
+                                    dtype: SnapshotDType = "float32",
+                                    embeddings_service: Optional[dict[str, str]] = None,
+                                    logger: logging.Logger,
+                                    batch_size: int = 1000) -> SnapshotManifest:
+    """
+    Write the embeddings of a taxonomy model to a snapshot.
+    The snapshot is written to a temporary directory first, and moved in place once complete.
+    :param snapshot_dir: The directory with the snapshots.
+    :param model_id: The taxonomy model id.
+    :param collections: The embeddings collections to write, by the field identifying their entities (e.g. occupationId).
+    :param embedding_key: The key of the embedding in the documents.
+    :param dtype: The type used to store the embeddings.
+    :param embeddings_service: The embeddings service info of the model, stored in the manifest.
+    :param logger: The logger to use.
+    :param batch_size: The cursor batch size.
+    """
+    path = get_snapshot_path(snapshot_dir=snapshot_dir, model_id=model_id)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    collection_infos: dict[str, SnapshotCollectionInfo] = {}
+    for entity_key, collection in collections.items():
+        collection_infos[collection.name] = await _write_collection(path=tmp_path,
+                                                                    model_id=ObjectId(model_id),
+                                                                    collection=collection,
+                                                                    entity_key=entity_key,
+                                                                    embedding_key=embedding_key,
+                                                                    dtype=dtype,
+                                                                    logger=logger,
+                                                                    batch_size=batch_size)
+
+    manifest = SnapshotManifest(
+        format_version=SNAPSHOT_FORMAT_VERSION,
+        model_id=model_id,
+        dtype=dtype,
+        embeddings_service=embeddings_service,
+        created_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        collections=collection_infos
+    )
+    with open(os.path.join(tmp_path, _MANIFEST_FILE), "w", encoding="utf-8") as f:
+        f.write(json.dumps(manifest.model_dump(), indent=2))
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info("Wrote the embeddings snapshot of the taxonomy model %s to %s", model_id, path)
+    return manifest
+
+
+async def _write_collection(*,
+                            path: str,
+                            model_id: ObjectId,
+                            collection: AsyncIOMotorCollection,
+                            entity_key: str,
+                            embedding_key: str,
+                            dtype: SnapshotDType,
+                            logger: logging.Logger,
+                            batch_size: int) -> SnapshotCollectionInfo:
+    start_time = time.time()
+    query = {"modelId": model_id}
+    rows_count = await collection.count_documents(query)
+    if rows_count == 0:
+        raise ValueError(f"No embeddings found in {collection.name} for the taxonomy model {model_id}")
+
+    row_entities = np.empty(rows_count, dtype=np.int32)
+    embeddings: Optional[np.ndarray] = None
+    entity_index: dict[Any, int] = {}
+    row = 0
+    projection = {"embedded_text": 0, "embedded_field": 0}
+    with open(_file_path(path, collection.name, "entities.jsonl"), "w", encoding="utf-8") as entities_file:
+        # Sorting by the entity key keeps the rows of each entity together (see the model_id_and_<id>_index).
+        cursor = collection.find(query, projection).sort([("modelId", 1), (entity_key, 1)]).batch_size(batch_size)
+        async for doc in cursor:
+            if row >= rows_count:
+                break  # documents added while writing
+            vector = doc.pop(embedding_key, None)
+            if not vector:
+                continue
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(_file_path(path, collection.name, "embeddings.npy"),
+                                                       mode="w+", dtype=np.dtype(dtype), shape=(rows_count, len(vector)))
+            embeddings[row] = normalize_rows(np.asarray([vector], dtype=np.float32))[0]
+
+            key = doc.get(entity_key)
+            if key not in entity_index:
+                entity_index[key] = len(entity_index)
+                doc.pop("_id", None)
+                entities_file.write(json_util.dumps(doc) + "\n")
+            row_entities[row] = entity_index[key]
+            row += 1
+
+    if embeddings is None:
+        raise ValueError(f"No embeddings found in {collection.name} for the taxonomy model {model_id}")
+    if row != rows_count:
+        raise ValueError(f"Expected {rows_count} embeddings in {collection.name}, found {row}")
+    dimensions = embeddings.shape[1]
+    embeddings.flush()
+    del embeddings
+    np.save(_file_path(path, collection.name, "row_entities.npy"), row_entities)
+
+    logger.info("Wrote %d embeddings of %d entities of %s in %.2f seconds",
+                rows_count, len(entity_index), collection.name, time.time() - start_time)
+    return SnapshotCollectionInfo(rows=rows_count, entities=len(entity_index), dimensions=dimensions, entity_key=entity_key)
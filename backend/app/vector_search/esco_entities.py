@@ -1,4 +1,4 @@
-from typing import List, Literal, Optional
+from typing import Any, Callable, Generic, List, Literal, Mapping, Optional, TypeVar
 from pydantic import Field
 from pydantic.main import BaseModel
 
@@ -73,3 +73,41 @@ class OccupationSkillEntity(BaseModel):
     """
     occupation: OccupationEntity
     associated_skills: List[AssociatedSkillEntity]
+
+
+EntityT = TypeVar("EntityT", bound=BaseEntity)
+
+
+class LeanEntity(Generic[EntityT]):
+    """
+    A compact search result, with only the fields needed to rank and filter the results.
+    The heavy fields (description, altLabels, scopeNote, UUIDHistory, ...) are not copied out of the document,
+    the full entity is built from the document the first time it is accessed.
+    The lean entities may be shared by several callers (see the search results cache), they must not be modified.
+    """
+    __slots__ = ("id", "UUID", "preferredLabel", "score", "_doc", "_to_entity", "_entity")
+
+    def __init__(self, *, id: str, UUID: str, preferredLabel: str, score: float,  # pylint: disable=redefined-builtin
+                 doc: Mapping[str, Any], to_entity: Callable[[Mapping[str, Any]], EntityT]):
+        self.id = id
+        self.UUID = UUID
+        self.preferredLabel = preferredLabel
+        self.score = score
+        self._doc = doc
+        self._to_entity = to_entity
+        self._entity: Optional[EntityT] = None
+
+    @property
+    def entity(self) -> EntityT:
+        """
+        The full entity, built from the document on first access.
+        """
+        if self._entity is None:
+            self._entity = self._to_entity({**self._doc, "score": self.score})
+        return self._entity
+
+    def __str__(self):
+        return self.preferredLabel
+
+    def __repr__(self):
+        return f"LeanEntity(id={self.id!r}, UUID={self.UUID!r}, preferredLabel={self.preferredLabel!r}, score={self.score!r})"
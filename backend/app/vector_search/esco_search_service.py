@@ -1,18 +1,27 @@
 import asyncio
+import hashlib
 import logging
 import time
 from abc import abstractmethod
-from typing import TypeVar, List, cast
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Literal, TypeVar, List, cast, Optional
 import re
 
+import numpy as np
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorCollection
 from pydantic import BaseModel
 
+from app.vector_search.change_stream_watcher import ChangeStreamWatcher, get_changed_values, watch_collections
 from app.vector_search.embeddings_model import EmbeddingService
 from app.vector_search.esco_entities import OccupationEntity, OccupationSkillEntity, AssociatedSkillEntity, SkillTypeLiteral
-from app.vector_search.esco_entities import SkillEntity
-from app.vector_search.lru_cache import AsyncLRUCache, CacheClearDebouncer
+from app.vector_search.esco_entities import SkillEntity, LeanEntity
+from app.vector_search.embeddings_snapshot import load_embeddings_snapshot
+from app.vector_search.label_index import LabelIndex, build_label_index
+from app.vector_search.local_embedding_index import IndexDType, LocalEmbeddingIndex, load_local_embedding_index
+from app.vector_search.lru_cache import AsyncLRUCache, CacheClearDebouncer, freeze, items_sizeof
+from app.vector_search.occupation_code_index import OccupationCodeIndex, build_occupation_code_index
+from app.vector_search.occupation_skill_graph import OccupationSkillGraph, load_occupation_skill_graph
+from app.vector_search.search_metrics import get_search_metrics
 from app.vector_search.similarity_search_service import SimilaritySearchService, FilterSpec
 from common_libs.environment_settings.constants import EmbeddingConfig
 
@@ -24,12 +33,49 @@ from common_libs.environment_settings.constants import EmbeddingConfig
 #   1000 occupations require approx 85 MB of memory
 #    500 occupations require approx 50 MB of memory
 #    100 occupations require approx 25 MB of memory
-
-_skills_of_occupation_cache = AsyncLRUCache(name="Skills of Occupations", max_size=3050)
+# When the occupation_skill_graph setting is enabled, the skills are answered from the OccupationSkillGraph instead,
+# which holds the complete model in a fraction of that memory (see occupation_skill_graph.py).
+#
+# The caches do not copy their values, deep copying hundreds of entities on every hit is expensive.
+# The values are frozen tuples of entities, and the entities returned by the search services must not be modified.
+#
+# The number of skills per occupation varies by an order of magnitude, so the cache is also bounded by its estimated
+# size, to keep the memory of a worker predictable.
+# Measuring the entries on every set is too slow for the event loop, the size of an entry is estimated from its number
+# of entities instead. The complete model has approx 130k occupation to skill relations, so an associated skill takes
+# approx 1.7 KB of the measured 223 MB, and the complete model fits in the byte budget of the cache.
+_ENTITY_BYTES = 1700
+
+_skills_of_occupation_cache = AsyncLRUCache(name="Skills of Occupations", max_size=3050, copy_values=False,
+                                            max_bytes=256 * 1024 * 1024, sizeof=items_sizeof(_ENTITY_BYTES))
 
 # The Occupations cache is not required to be large, as it is usually used for exact or regex matches
 # for unseen and the microentrepreneurship.
-_occupations_cache = AsyncLRUCache(name="Occupations", max_size=10)
+_occupations_cache = AsyncLRUCache(name="Occupations", max_size=10, copy_values=False, sizeof=items_sizeof(_ENTITY_BYTES))
+
+# The same responsibilities and job titles are searched repeatedly, across conversations and on retries.
+# The results of the vector searches are cached by query vector, filter and k (see _search_results_key),
+# a result is a handful of entities, so a few thousand results take a few MB.
+# The results expire after a while, and are cleared when the searched collections change.
+_search_results_cache = AsyncLRUCache(name="Search Results", max_size=5000, copy_values=False, ttl=60 * 60,
+                                      sizeof=items_sizeof(_ENTITY_BYTES))
+
+# The latencies of the stages of the searches (see search_metrics.py)
+_metrics = get_search_metrics()
+
+# The query vectors are rounded to this number of decimals before they are hashed, so that the embeddings of the same
+# text that differ only by floating point noise share the same results.
+_SEARCH_RESULTS_KEY_DECIMALS = 4
+
+# Without a local index, the searches filtered to a few entities (e.g. the skills of an occupation) load the embeddings
+# of those entities once, and search them exactly in memory instead of running a $vectorSearch with a large $in filter.
+# The indexes are cached by collection, model and filter key (see FilterSpec.key).
+_filter_indexes_cache = AsyncLRUCache(name="Filter Indexes", max_size=64, copy_values=False,
+                                      max_bytes=128 * 1024 * 1024, ttl=60 * 60,
+                                      sizeof=lambda _key, index: index.nbytes + _ENTITY_BYTES * len(index.entities))
+
+# The maximum number of UUIDs of a filter whose embeddings are loaded into a _filter_indexes_cache index
+_MAX_FILTER_INDEX_UUIDS = 300
 
 
 async def clear_caches():
@@ -38,6 +84,126 @@ async def clear_caches():
     """
     await _skills_of_occupation_cache.clear()
     await _occupations_cache.clear()
+    await _search_results_cache.clear()
+    await _filter_indexes_cache.clear()
+
+
+async def get_caches_stats() -> dict[str, dict]:
+    """
+    Get the statistics of the caches used by the search services, by cache name.
+    """
+    return {cache.name: await cache.stats()
+            for cache in (_skills_of_occupation_cache, _occupations_cache, _search_results_cache, _filter_indexes_cache)}
+
+
+def _search_results_key(*, collection_name: str, model_id: ObjectId, embedding: list[float],
+                        filter_spec: Optional[FilterSpec], k: int,
+                        lean: bool = False, fields: Optional[tuple[str, ...]] = None) -> tuple:
+    """
+    The key of the results of a vector search in the _search_results_cache.
+    The query vector is quantized and hashed, and the filter is keyed by its set of UUIDs (see FilterSpec.key).
+    The lean results (see AbstractEscoSearchService.search_lean) are cached by the fields they were retrieved with.
+    """
+    quantized = np.round(np.asarray(embedding, dtype=np.float32) * 10 ** _SEARCH_RESULTS_KEY_DECIMALS).astype(np.int32)
+    vector_hash = hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+    filter_key = filter_spec.key if filter_spec else None
+    return collection_name, str(model_id), vector_hash, filter_key, k, lean, fields
+
+
+# The indexes are shared by all the search services of the same collection and model,
+# e.g. the OccupationSkillSearchService has its own OccupationSearchService instance.
+# They are rebuilt from the database when the collection changes.
+_local_indexes: dict[tuple[str, str, str, str], LocalEmbeddingIndex] = {}
+_local_indexes_lock = asyncio.Lock()
+
+
+async def _get_local_embedding_index(*,
+                                     collection: AsyncIOMotorCollection,
+                                     model_id: ObjectId,
+                                     embedding_key: str,
+                                     group_fields: dict,
+                                     logger: logging.Logger,
+                                     snapshot_dir: Optional[str] = None,
+                                     dtype: IndexDType = "float32",
+                                     rebuild: bool = False) -> LocalEmbeddingIndex:
+    """
+    Get the local embedding index of the collection and taxonomy model, loading it once if needed.
+    If a snapshot directory is given, the index is memory-mapped from the snapshot of the model (see embeddings_snapshot.py),
+    otherwise, or if the snapshot cannot be loaded, the embeddings are loaded from the database.
+    The embeddings are stored in memory with the given type (see LocalEmbeddingIndex.quantize).
+    If rebuild is True, the embeddings are loaded again from the database (the snapshot does not have the changes made
+    since it was taken), and the index replaces the one that was loaded before.
+    """
+    key = (collection.database.name, collection.name, str(model_id), dtype)
+    async with _local_indexes_lock:
+        if rebuild or key not in _local_indexes:
+            index: Optional[LocalEmbeddingIndex] = None
+            if snapshot_dir and not rebuild:
+                try:
+                    index = load_embeddings_snapshot(snapshot_dir=snapshot_dir,
+                                                     model_id=str(model_id),
+                                                     collection_name=collection.name,
+                                                     group_fields=group_fields,
+                                                     logger=logger,
+                                                     dtype=dtype)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.error("Failed to load the embeddings snapshot from %s, loading from the database: %s", snapshot_dir, e)
+            if index is None:
+                index = await load_local_embedding_index(collection=collection,
+                                                         model_id=model_id,
+                                                         embedding_key=embedding_key,
+                                                         group_fields=group_fields,
+                                                         logger=logger,
+                                                         dtype=dtype)
+            _local_indexes[key] = index
+        return _local_indexes[key]
+
+
+# The label indexes of the occupations are built once per collection and taxonomy model, and rebuilt when the
+# occupations change.
+_occupation_label_indexes: dict[tuple[str, str, str], LabelIndex[OccupationEntity]] = {}
+_occupation_label_indexes_lock = asyncio.Lock()
+
+LabelSearchMode = Literal["exact", "hybrid"]
+
+# The code indexes of the occupations are built once per collection and taxonomy model, and rebuilt when the
+# occupations change.
+_occupation_code_indexes: dict[tuple[str, str, str], OccupationCodeIndex] = {}
+_occupation_code_indexes_lock = asyncio.Lock()
+
+# The occupation to skill graphs are built once per database and taxonomy model, and rebuilt when the relations change.
+_occupation_skill_graphs: dict[tuple[str, str], OccupationSkillGraph] = {}
+_occupation_skill_graphs_lock = asyncio.Lock()
+
+# How long to wait for more changes of the relations before rebuilding the occupation to skill graph, in seconds
+_SKILL_GRAPH_REBUILD_DELAY = 5.0
+
+# How long to wait for more changes of a collection before rebuilding its in-memory indexes, in seconds
+_INDEXES_REBUILD_DELAY = 5.0
+
+# The number of occupations whose skills are retrieved and cached at once by the warm-up of the caches,
+# converting and caching the skills of a chunk blocks the event loop for a few milliseconds
+_WARM_UP_CHUNK_SIZE = 50
+
+
+async def _get_occupation_skill_graph(*,
+                                      relations_collection: AsyncIOMotorCollection,
+                                      skills_collection: AsyncIOMotorCollection,
+                                      model_id: ObjectId,
+                                      logger: logging.Logger,
+                                      rebuild: bool = False) -> OccupationSkillGraph:
+    """
+    Get the occupation to skill graph of the taxonomy model, building it once if needed.
+    If rebuild is True, the graph is built again from the database, and replaces the one that was built before.
+    """
+    key = (relations_collection.database.name, str(model_id))
+    async with _occupation_skill_graphs_lock:
+        if rebuild or key not in _occupation_skill_graphs:
+            _occupation_skill_graphs[key] = await load_occupation_skill_graph(relations_collection=relations_collection,
+                                                                              skills_collection=skills_collection,
+                                                                              model_id=model_id,
+                                                                              logger=logger)
+        return _occupation_skill_graphs[key]
 
 
 class VectorSearchConfig(BaseModel):
@@ -88,6 +254,110 @@ class AbstractEscoSearchService(SimilaritySearchService[T]):
         self.config = config
         self._model_id = ObjectId(taxonomy_model_id)
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._local_index: LocalEmbeddingIndex | None = None
+        self._local_index_dtype: IndexDType = "float32"
+        self._atlas_fallback = True
+        self._indexes_changed = False
+        self._indexes_rebuild_task: asyncio.Task | None = None
+
+    async def enable_local_index(self, *, atlas_fallback: bool = True, snapshot_dir: Optional[str] = None,
+                                 dtype: IndexDType = "float32") -> None:
+        """
+        Load the embeddings of the taxonomy model into the process memory, and answer the similarity searches locally.
+        :param atlas_fallback: If True, the searches fall back to Atlas if the index cannot be loaded or fails to answer,
+                               otherwise the error is raised.
+        :param snapshot_dir: If given, the embeddings are memory-mapped from the snapshot of the taxonomy model in this directory.
+        :param dtype: The type the embeddings are stored with in memory, float16 and int8 use less memory,
+                      and the best candidates of the searches are re-scored with float32 precision.
+        """
+        self._atlas_fallback = atlas_fallback
+        self._local_index_dtype = dtype
+        try:
+            self._local_index = await _get_local_embedding_index(collection=self.collection,
+                                                                 model_id=self._model_id,
+                                                                 embedding_key=self.config.embedding_key,
+                                                                 group_fields=self._group_fields(),
+                                                                 logger=self._logger,
+                                                                 snapshot_dir=snapshot_dir,
+                                                                 dtype=dtype)
+        except Exception as e:  # pylint: disable=broad-except
+            if not atlas_fallback:
+                raise
+            self._logger.error("Failed to load the local embedding index, falling back to Atlas: %s", e, exc_info=True)
+
+    def _caches_cleared_on_change(self) -> list[AsyncLRUCache]:
+        """
+        The caches to clear when the collection changes, see watch_db_changes().
+        """
+        # The results of a search depend on all the entities of the collection, so they cannot be evicted by key.
+        return [_search_results_cache, _filter_indexes_cache]
+
+    async def watch_db_changes(self):
+        """
+        Watch for changes in the collection.
+        If there are any changes, clear the caches to ensure that the next search will retrieve the latest data,
+        and rebuild the in-memory indexes of the collection (see _schedule_indexes_rebuild).
+        """
+        debouncers = [CacheClearDebouncer(cache=cache, logger=self._logger) for cache in self._caches_cleared_on_change()]
+
+        async def _schedule_clear():
+            for debouncer in debouncers:
+                await debouncer.schedule_clear()
+            self._schedule_indexes_rebuild()
+
+        async def _on_change(change: dict):
+            if change["operationType"] in {"insert", "update", "replace", "delete"}:
+                self._logger.debug("Detected DB change (%s)", change["operationType"])
+                await _schedule_clear()
+
+        await watch_collections(ChangeStreamWatcher(collection=self.collection,
+                                                    on_change=_on_change,
+                                                    on_history_lost=_schedule_clear,
+                                                    logger=self._logger))
+
+    def _has_indexes(self) -> bool:
+        """
+        Whether the service answers from in-memory indexes of the collection, that are rebuilt when it changes.
+        """
+        return self._local_index is not None
+
+    def _schedule_indexes_rebuild(self):
+        """
+        Rebuild the in-memory indexes of the collection once it stops changing for a while.
+        The changes that arrive while the indexes are rebuilt are picked up by another rebuild.
+        """
+        if not self._has_indexes():
+            return
+        self._indexes_changed = True
+        if self._indexes_rebuild_task is None or self._indexes_rebuild_task.done():
+            self._indexes_rebuild_task = asyncio.create_task(self._rebuild_indexes_after_changes())
+
+    async def _rebuild_indexes_after_changes(self):
+        while self._indexes_changed:
+            await asyncio.sleep(_INDEXES_REBUILD_DELAY)
+            self._indexes_changed = False
+            await self._rebuild_indexes()
+
+    async def _rebuild_indexes(self):
+        """
+        Rebuild the in-memory indexes of the collection, see _schedule_indexes_rebuild().
+        The searches keep using the previous indexes until the new ones are built, and if a rebuild fails.
+        """
+        if self._local_index is not None:
+            try:
+                # both indexes are in memory until the searches switch to the new one
+                self._local_index = await _get_local_embedding_index(collection=self.collection,
+                                                                     model_id=self._model_id,
+                                                                     embedding_key=self.config.embedding_key,
+                                                                     group_fields=self._group_fields(),
+                                                                     logger=self._logger,
+                                                                     dtype=self._local_index_dtype,
+                                                                     rebuild=True)
+                # the results cached since the change was seen were searched in the previous index
+                await _search_results_cache.clear()
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Failed to rebuild the local embedding index, keeping the previous one: %s", e,
+                                   exc_info=True)
 
     @abstractmethod
     def _to_entity(self, doc: dict) -> T:
@@ -99,6 +369,21 @@ class AbstractEscoSearchService(SimilaritySearchService[T]):
         """
         raise NotImplementedError
 
+    # The fields of the documents that are always retrieved for the lean search results, see search_lean()
+    _lean_fields: tuple[str, ...] = ("modelId", "UUID", "preferredLabel")
+
+    @abstractmethod
+    def _entity_id(self, doc: dict) -> str:
+        """
+        Get the id of the entity of a Document object.
+        This method should be implemented by the subclass.
+        """
+        raise NotImplementedError
+
+    def _to_lean_entity(self, doc: dict, score: float) -> LeanEntity[T]:
+        return LeanEntity(id=self._entity_id(doc), UUID=doc.get("UUID", ""), preferredLabel=doc.get("preferredLabel", ""),
+                          score=score, doc=doc, to_entity=self._to_entity)
+
     def _group_fields(self) -> dict:
         """
         Fields to extract when grouping the results of the vector search.
@@ -117,20 +402,202 @@ class AbstractEscoSearchService(SimilaritySearchService[T]):
         :return: A list of T objects.
         """
         search_start_time = time.time()
+        with _metrics.time_operation(service=self.__class__.__name__, operation="search"):
+            embedding = await self._embed_query(query)
+            if embedding is None:
+                return []
+
+            result = (await self._search_embeddings([embedding], filter_spec=filter_spec, k=k))[0]
+        self._logger.debug("Search by embeddings took %.2f seconds", time.time() - search_start_time)
+        return result
+
+    async def embed_queries(self, queries: list[str]) -> list[str | list[float]]:
+        """
+        Embed the text queries with a single batch, so that they can be searched with several filters (see search_many)
+        without embedding them again. The empty queries, and the ones that are answered without an embedding,
+        are returned as they are.
+        :param queries: The text queries.
+        :return: The embedding or the text of each query, in the order of the queries.
+        """
+        result: list[str | list[float]] = list(queries)
+        indices = [i for i, query in enumerate(queries) if query.strip() and self._needs_embedding(query)]
+        if indices:
+            with _metrics.time_operation(service=self.__class__.__name__, operation="embed_queries"), \
+                    _metrics.time_stage(stage="embed"):
+                embeddings = await self.embedding_service.embed_batch([queries[i].strip() for i in indices])
+            for i, embedding in zip(indices, embeddings):
+                result[i] = embedding
+        return result
+
+    def _needs_embedding(self, query: str) -> bool:
+        """
+        Whether a text query needs an embedding to be searched, see embed_queries().
+        """
+        return True
+
+    async def search_lean(self, *, query: str | list[float], filter_spec: FilterSpec = None, k: int = 5,
+                          fields: Optional[Iterable[str]] = None) -> list[LeanEntity[T]]:
+        """
+        Perform a similarity search like search(), but return lean entities, that build the full entities only when
+        they are accessed. It avoids building the entities of the results that are discarded (e.g. ranked out).
+
+        :param query: The text query, or a vector representation to search for.
+        :param filter_spec: A filter to apply to the search.
+        :param k: The number of results to return.
+        :param fields: If given, only these fields (in addition to the id, UUID and preferredLabel) are retrieved
+                       from the database, the other fields of the full entities have their default values.
+                       The results answered by the local index always have all the fields.
+        :return: A list of LeanEntity objects.
+        """
+        search_start_time = time.time()
+        with _metrics.time_operation(service=self.__class__.__name__, operation="search_lean"):
+            embedding = await self._embed_query(query)
+            if embedding is None:
+                return []
+
+            result = (await self._search_embeddings([embedding], filter_spec=filter_spec, k=k,
+                                                    lean=True, fields=tuple(sorted(set(fields))) if fields is not None else None))[0]
+        self._logger.debug("Lean search by embeddings took %.2f seconds", time.time() - search_start_time)
+        return cast(list[LeanEntity[T]], result)
+
+    async def _embed_query(self, query: str | list[float]) -> Optional[list[float]]:
+        """
+        Embed a text query, a vector is returned as it is. An empty text query is not embedded and None is returned.
+        """
+        if not isinstance(query, str):
+            return query
+        stripped_query = query.strip()
+        if not stripped_query:
+            self._logger.warning("Empty text query received; returning no results without embedding.")
+            return None
+        with _metrics.time_stage(stage="embed"):
+            return await self.embedding_service.embed(stripped_query)
+
+    async def search_many(self, *, queries: list[str | list[float]], filter_spec: FilterSpec = None, k: int = 5) -> \
+            list[List[T]]:
+        """
+        Perform a similarity search for each of the queries, see search().
+        The text queries are embedded with a single batch, and the searches are answered by a single matrix
+        multiplication when the local index is enabled, or by concurrent vector searches otherwise.
+
+        :param queries: The text queries, or vector representations to search for.
+        :param filter_spec: A filter to apply to all the searches.
+        :param k: The number of results to return for each query.
+        :return: A list of T objects for each query, in the order of the queries.
+        """
+        search_start_time = time.time()
+        results: list[List[T]] = [[] for _ in queries]
+        # Empty text queries have no results, as in search()
+        indices = [i for i, query in enumerate(queries) if not isinstance(query, str) or query.strip()]
+        if len(indices) < len(queries):
+            self._logger.warning("Empty text queries received; returning no results for them without embedding.")
+        if not indices:
+            return results
+
+        with _metrics.time_operation(service=self.__class__.__name__, operation="search_many"):
+            embeddings: list[list[float]] = [cast(list[float], queries[i]) for i in indices]
+            text_indices = [j for j, i in enumerate(indices) if isinstance(queries[i], str)]
+            if text_indices:
+                with _metrics.time_stage(stage="embed"):
+                    text_embeddings = await self.embedding_service.embed_batch(
+                        [cast(str, queries[indices[j]]).strip() for j in text_indices])
+                for j, text_embedding in zip(text_indices, text_embeddings):
+                    embeddings[j] = text_embedding
+
+            searched = await self._search_embeddings(embeddings, filter_spec=filter_spec, k=k)
+            for i, result in zip(indices, searched):
+                results[i] = result
+        self._logger.debug("Search of %d queries by embeddings took %.2f seconds", len(queries), time.time() - search_start_time)
+        return results
+
+    async def _search_embeddings(self, embeddings: list[list[float]], *, filter_spec: Optional[FilterSpec], k: int,
+                                 lean: bool = False, fields: Optional[tuple[str, ...]] = None) -> list[list]:
+        """
+        Search the embeddings, the results are looked up in the _search_results_cache first, and the remaining
+        embeddings are searched together. The concurrent searches of the same embedding wait for a single search.
+        If lean is True, the results are LeanEntity objects (see search_lean()), otherwise T objects.
+        """
+        keys = [_search_results_key(collection_name=self.config.collection_name, model_id=self._model_id,
+                                    embedding=embedding, filter_spec=filter_spec, k=k, lean=lean, fields=fields)
+                for embedding in embeddings]
+        embeddings_by_key = dict(zip(keys, embeddings))
+
+        with _metrics.time_stage(stage="results_cache", cache="hit") as timer:
+            async def _load(missing_keys: list[tuple]) -> dict[tuple, tuple]:
+                timer.cache = "miss"
+                searched = await self._search_uncached([embeddings_by_key[key] for key in missing_keys], filter_spec=filter_spec,
+                                                       k=k, lean=lean, fields=fields)
+                return {key: freeze(result) for key, result in zip(missing_keys, searched)}
+
+            results = await _search_results_cache.get_or_load_many(keys, _load)
+        return [list(results[key]) for key in keys]
+
+    async def _search_uncached(self, embeddings: list[list[float]], *, filter_spec: Optional[FilterSpec], k: int,
+                               lean: bool = False, fields: Optional[tuple[str, ...]] = None) -> list[list]:
+        if self._local_index is not None:
+            try:
+                return self._search_local_index(embeddings, filter_spec=filter_spec, k=k, lean=lean)
+            except Exception as e:  # pylint: disable=broad-except
+                if not self._atlas_fallback:
+                    raise
+                self._logger.error("Local search failed, falling back to Atlas: %s", e, exc_info=True)
+        if filter_spec and 0 < len(filter_spec.UUID) <= _MAX_FILTER_INDEX_UUIDS:
+            try:
+                return await self._search_filter_index(embeddings, filter_spec=filter_spec, k=k, lean=lean)
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Filtered search failed, falling back to Atlas: %s", e, exc_info=True)
+        return list(await asyncio.gather(*(self._search_atlas(embedding, filter_spec=filter_spec, k=k, lean=lean, fields=fields)
+                                           for embedding in embeddings)))
+
+    def _search_local_index(self, embeddings: list[list[float]], *, filter_spec: Optional[FilterSpec], k: int,
+                            lean: bool = False) -> list[list]:
+        with _metrics.time_stage(stage="local_index"):
+            searched = self._local_index.search_many(np.asarray(embeddings, dtype=np.float32),
+                                                     k=k,
+                                                     uuids=filter_spec.UUID if filter_spec else None,
+                                                     uuids_key=filter_spec.key if filter_spec else None)
+        return self._to_search_results(searched, lean=lean)
+
+    def _to_search_results(self, searched: list[list[tuple[dict, float]]], *, lean: bool) -> list[list]:
+        """
+        Convert the (document, score) results of an in-memory index to entities, or to lean entities.
+        """
+        with _metrics.time_stage(stage="convert"):
+            # The lean entities refer to the documents of the index, they are not copied
+            return [[self._to_lean_entity(doc, score) if lean else self._to_entity({**doc, "score": score}) for doc, score in query_results]
+                    for query_results in searched]
+
+    async def _search_filter_index(self, embeddings: list[list[float]], *, filter_spec: FilterSpec, k: int,
+                                   lean: bool = False) -> list[list]:
+        """
+        Search the embeddings of the entities of the filter only, loading them once (see _filter_indexes_cache).
+        """
+
+        async def _load() -> LocalEmbeddingIndex:
+            return await load_local_embedding_index(collection=self.collection,
+                                                    model_id=self._model_id,
+                                                    embedding_key=self.config.embedding_key,
+                                                    group_fields=self._group_fields(),
+                                                    logger=self._logger,
+                                                    uuids=filter_spec.UUID)
+
+        with _metrics.time_stage(stage="filter_index", cache="hit") as timer:
+            async def _load_index() -> LocalEmbeddingIndex:
+                timer.cache = "miss"
+                return await _load()
+
+            index = await _filter_indexes_cache.get_or_load((self.config.collection_name, str(self._model_id), filter_spec.key),
+                                                            _load_index)
+            # All the entities of the index are in the filter
+            searched = index.search_many(np.asarray(embeddings, dtype=np.float32), k=k)
+        return self._to_search_results(searched, lean=lean)
+
+    async def _search_atlas(self, embedding: list[float], *, filter_spec: Optional[FilterSpec], k: int,
+                            lean: bool = False, fields: Optional[tuple[str, ...]] = None) -> list:
         # Each ESCO entity is duplicated three times, each duplication has a different embedding, one for the
         # preferredLabel, one for the description and one for the altLabels. The search is performed on all three
         # fields, so we need to multiply the number of results by 3 to account for the possible duplication. Those
         # are then grouped by the UUID and the best score is selected. The final number of results is limited to k.
-        embedding: list[float]
-        if isinstance(query, str):
-            stripped_query = query.strip()
-            if not stripped_query:
-                self._logger.warning("Empty text query received; returning no results without embedding.")
-                return []
-            embedding = await self.embedding_service.embed(stripped_query)
-        else:
-            embedding = query
-
         params = {
             "queryVector": embedding,
             "path": self.config.embedding_key,
@@ -144,20 +611,25 @@ class AbstractEscoSearchService(SimilaritySearchService[T]):
         if filter_spec:
             params["filter"].update(filter_spec.to_query_filter())
 
-        fields = self._group_fields().copy()
-        fields.update({"score": {"$max": "$score"}})
+        group_fields = self._group_fields().copy()
+        if fields is not None:
+            # Only the requested fields are grouped, to reduce the size of the results transferred from the database
+            projected_fields = {"_id", *self._lean_fields, *fields}
+            group_fields = {name: value for name, value in group_fields.items() if name in projected_fields}
+        group_fields.update({"score": {"$max": "$score"}})
         pipeline = [
             {"$vectorSearch": params},
             {"$set": {"score": {"$meta": "vectorSearchScore"}}},
-            {"$group": fields},
+            {"$group": group_fields},
             {"$sort": {"score": -1}},
             {"$limit": k},
         ]
-        entries = await self.collection.aggregate(pipeline).to_list(length=k)
-        result = [self._to_entity(entry) for entry in entries]
-        search_end_time = time.time()
-        self._logger.debug("Search by embeddings took %.2f seconds (db)", search_end_time - search_start_time)
-        return result
+        with _metrics.time_stage(stage="db_aggregate"):
+            entries = await self.collection.aggregate(pipeline).to_list(length=k)
+        with _metrics.time_stage(stage="convert"):
+            if lean:
+                return [self._to_lean_entity(entry, entry.get("score", 0.0)) for entry in entries]
+            return [self._to_entity(entry) for entry in entries]
 
 
 def _re_flags_to_mongo_options(flags: int) -> str:
@@ -171,37 +643,125 @@ def _re_flags_to_mongo_options(flags: int) -> str:
     return options
 
 
-async def watch_db_changes(*, collection: AsyncIOMotorCollection, debouncer: CacheClearDebouncer, logger: logging.Logger):
-    try:
-        logger.info("Watching database changes for collection: %s", collection.name)
-        async with collection.watch() as stream:
-            async for change in stream:
-                operation = change["operationType"]
-                if operation in {"update", "replace", "delete"}:
-                    logger.debug("Detected DB change (%s)", operation)
-                    await debouncer.schedule_clear()
-                else:
-                    logger.debug("Ignoring change (%s)", operation)
-    except Exception as e:
-        logger.error("Error watching database changes: %s", e)
-
-
 class OccupationSearchService(AbstractEscoSearchService[OccupationEntity]):
     """
     A service class to perform similarity searches on the occupations' collection.
     """
 
-    async def watch_db_changes(self):
+    def __init__(self, db: AsyncIOMotorDatabase, embedding_service: EmbeddingService, config: VectorSearchConfig, taxonomy_model_id: str):
+        super().__init__(db, embedding_service, config, taxonomy_model_id)
+        self._label_index: LabelIndex[OccupationEntity] | None = None
+        self._label_search_mode: LabelSearchMode = "exact"
+        self._code_index: OccupationCodeIndex | None = None
+
+    async def enable_label_index(self, *, mode: LabelSearchMode = "exact") -> None:
         """
-        Watch for changes in the "Occupations" collection.
-        If there are any changes, clear the caches to ensure that the next search will retrieve the latest data.
-        :return:
+        Build the label index of the occupations of the taxonomy model, and answer the text queries that match a
+        preferred or alternative label exactly from it, with the near-exact matches (see LabelIndex.match).
+        If the index cannot be built, the queries are searched by their embeddings.
+        :param mode: "exact": the queries with an exact match are answered by the label index only, without an embedding,
+                              so they may have fewer than k results.
+                     "hybrid": the matches of the label index are followed by the results of the vector search, up to k.
         """
-        await watch_db_changes(
-            collection=self.collection,
-            debouncer=CacheClearDebouncer(cache=_occupations_cache, logger=self._logger),
-            logger=self._logger
-        )
+        self._label_search_mode = mode
+        try:
+            self._label_index = await self._get_label_index()
+        except Exception as e:  # pylint: disable=broad-except
+            self._logger.error("Failed to build the label index, searching by embeddings only: %s", e, exc_info=True)
+
+    async def _get_label_index(self, *, rebuild: bool = False) -> LabelIndex[OccupationEntity]:
+        """
+        Get the label index of the occupations of the taxonomy model, building it once if needed.
+        If rebuild is True, the index is built again from the database, and replaces the one that was built before.
+        """
+        key = (self.collection.database.name, self.collection.name, str(self._model_id))
+        async with _occupation_label_indexes_lock:
+            if rebuild or key not in _occupation_label_indexes:
+                _occupation_label_indexes[key] = build_label_index(entities=[occupation async for occupation in self.stream_all()],
+                                                                   logger=self._logger)
+            return _occupation_label_indexes[key]
+
+    async def enable_code_index(self) -> None:
+        """
+        Build the code index of the occupations of the taxonomy model, and answer the lookups of an exact code or of a
+        code prefix (e.g. the unseen economy occupations "^I.*") from it, instead of the database (see get_by_esco_code).
+        If the index cannot be built, the occupations are looked up in the database.
+        """
+        try:
+            self._code_index = await self._get_code_index()
+        except Exception as e:  # pylint: disable=broad-except
+            self._logger.error("Failed to build the code index, looking up the codes in the database: %s", e, exc_info=True)
+
+    async def _get_code_index(self, *, rebuild: bool = False) -> OccupationCodeIndex:
+        """
+        Get the code index of the occupations of the taxonomy model, building it once if needed.
+        If rebuild is True, the index is built again from the database, and replaces the one that was built before.
+        """
+        key = (self.collection.database.name, self.collection.name, str(self._model_id))
+        async with _occupation_code_indexes_lock:
+            if rebuild or key not in _occupation_code_indexes:
+                _occupation_code_indexes[key] = build_occupation_code_index(
+                    occupations=[occupation async for occupation in self.stream_all()],
+                    logger=self._logger)
+            return _occupation_code_indexes[key]
+
+    def _has_indexes(self) -> bool:
+        return super()._has_indexes() or self._label_index is not None or self._code_index is not None
+
+    async def _rebuild_indexes(self):
+        await super()._rebuild_indexes()
+        if self._label_index is not None:
+            try:
+                self._label_index = await self._get_label_index(rebuild=True)
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Failed to rebuild the label index, keeping the previous one: %s", e, exc_info=True)
+        if self._code_index is not None:
+            try:
+                self._code_index = await self._get_code_index(rebuild=True)
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Failed to rebuild the code index, keeping the previous one: %s", e, exc_info=True)
+
+    def _needs_embedding(self, query: str) -> bool:
+        # In hybrid mode, the text of a query with an exact match is needed to match it, it is embedded if needed by search_many
+        return self._label_index is None or not self._label_index.match(query, k=1)
+
+    async def search(self, *, query: str | list[float], filter_spec: FilterSpec = None, k: int = 5) -> List[OccupationEntity]:
+        if self._label_index is not None and isinstance(query, str):
+            return (await self.search_many(queries=[query], filter_spec=filter_spec, k=k))[0]
+        return await super().search(query=query, filter_spec=filter_spec, k=k)
+
+    async def search_many(self, *, queries: list[str | list[float]], filter_spec: FilterSpec = None, k: int = 5) -> \
+            list[List[OccupationEntity]]:
+        """
+        Search the occupations for each of the queries, see AbstractEscoSearchService.search_many.
+        If the label index is enabled, the text queries that match a label exactly are answered from it (see enable_label_index).
+        """
+        if self._label_index is None:
+            return await super().search_many(queries=queries, filter_spec=filter_spec, k=k)
+
+        uuids = filter_spec.UUID if filter_spec else None
+        matches = {i: self._label_index.match(query, k=k, uuids=uuids) for i, query in enumerate(queries) if isinstance(query, str)}
+        matches = {i: matched for i, matched in matches.items() if matched}
+        # The other queries, and in hybrid mode the ones with fewer than k matches, are searched by their embeddings
+        vector_indices = [i for i in range(len(queries))
+                          if i not in matches or (self._label_search_mode == "hybrid" and len(matches[i]) < k)]
+        results: list[List[OccupationEntity]] = [[] for _ in queries]
+        if vector_indices:
+            vector_results = await super().search_many(queries=[queries[i] for i in vector_indices], filter_spec=filter_spec, k=k)
+            for i, result in zip(vector_indices, vector_results):
+                results[i] = result
+        for i, matched in matches.items():
+            lexical_results = [occupation.model_copy(update={"score": score}) for occupation, score in matched]
+            matched_uuids = {occupation.UUID for occupation in lexical_results}
+            results[i] = (lexical_results + [occupation for occupation in results[i] if occupation.UUID not in matched_uuids])[:k]
+        self._logger.debug("%d of %d queries matched the labels of the occupations", len(matches), len(queries))
+        return results
+
+    _lean_fields = AbstractEscoSearchService._lean_fields + ("occupationId",)
+
+    def _caches_cleared_on_change(self) -> list[AsyncLRUCache]:
+        # The occupations are cached by code or regex, so a change cannot be mapped to the affected entries.
+        return [_search_results_cache, _filter_indexes_cache, _occupations_cache]
 
     def _group_fields(self) -> dict:
         return {"_id": "$occupationId",
@@ -224,7 +784,7 @@ class OccupationSearchService(AbstractEscoSearchService[OccupationEntity]):
         """
 
         return OccupationEntity(
-            id=str(doc.get("occupationId", "")),
+            id=self._entity_id(doc),
             modelId=str(doc.get("modelId", "")),
             UUID=doc.get("UUID", ""),
             code=doc.get("code", ""),
@@ -237,24 +797,56 @@ class OccupationSearchService(AbstractEscoSearchService[OccupationEntity]):
             score=doc.get("score", 0.0),
         )
 
+    def _entity_id(self, doc: dict) -> str:
+        return str(doc.get("occupationId", ""))
+
     async def get_by_esco_code(self, *, code: str | re.Pattern) -> list[OccupationEntity]:
         """
         Get occupations by occupation code (supports exact and regex match).
 
         There may be up to 3 documents for each occupation due to the embedding strategy used.
         This function groups by modelId and code, and returns one document per group.
+        If the code index is enabled, the exact codes and the prefix patterns are looked up in memory (see enable_code_index).
 
         :param code: The code of the occupation.
         :return: The OccupationEntity object.
         """
         search_start_time = time.time()
+        with _metrics.time_operation(service=self.__class__.__name__, operation="get_by_esco_code"):
+            if self._code_index is not None:
+                with _metrics.time_stage(stage="code_index"):
+                    occupations = self._code_index.lookup(code)
+                if occupations is not None:
+                    return list(occupations)
+            with _metrics.time_stage(stage="occupations_cache", cache="hit") as timer:
+                async def _load() -> tuple[OccupationEntity, ...]:
+                    timer.cache = "miss"
+                    return await self._load_by_esco_code(code)
+
+                # The concurrent searches of the same code wait for a single query to the database
+                result = await _occupations_cache.get_or_load(code if isinstance(code, str) else code.pattern, _load)
+        self._logger.debug("Search by code took %.2f seconds", time.time() - search_start_time)
+        return list(result)
+
+    async def stream_all(self, *, batch_size: int = 500) -> AsyncIterator[OccupationEntity]:
+        """
+        Stream all the occupations of the taxonomy model, one entity per occupation, without their embeddings.
+        :param batch_size: The number of documents fetched from the database per round-trip.
+        """
+        pipeline = [
+            {"$match": {"modelId": self._model_id}},
+            {"$project": {self.config.embedding_key: 0, "embedded_field": 0, "embedded_text": 0}},
+            {"$group": {"_id": "$occupationId", "doc": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$doc"}},
+            {"$sort": {"occupationId": 1}}
+        ]
+        async for doc in self.collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True):
+            yield self._to_entity(doc)
 
-        #  Try cache
-        cached_result = await _occupations_cache.get(code if isinstance(code, str) else code.pattern)
-        if cached_result is not None:
-            self._logger.debug("Search by code took %.2f seconds (cached)", time.time() - search_start_time)
-            return cached_result
-
+    async def _load_by_esco_code(self, code: str | re.Pattern) -> tuple[OccupationEntity, ...]:
+        """
+        Load the occupations with the given code (exact or regex match) from the database.
+        """
         # There should be up to 3 entries (one for each embedded field) for each entity,
         # so we group by the modelId and code, and keep the first document for each group.
         query: dict = {
@@ -286,14 +878,10 @@ class OccupationSearchService(AbstractEscoSearchService[OccupationEntity]):
             }
         ]
 
-        docs = await self.collection.aggregate(pipeline).to_list(length=None)
-        result = [self._to_entity(doc) for doc in docs if doc]  # transform the documents to OccupationEntity objects
-
-        # Cache the result
-        await _occupations_cache.set(code if isinstance(code, str) else code.pattern, result)
-
-        self._logger.debug("Search by code took %.2f seconds (db)", time.time() - search_start_time)
-        return result
+        with _metrics.time_stage(stage="db_aggregate"):
+            docs = await self.collection.aggregate(pipeline).to_list(length=None)
+        with _metrics.time_stage(stage="convert"):
+            return freeze(self._to_entity(doc) for doc in docs if doc)  # transform the documents to OccupationEntity objects
 
 
 class SkillSearchService(AbstractEscoSearchService[SkillEntity]):
@@ -307,7 +895,7 @@ class SkillSearchService(AbstractEscoSearchService[SkillEntity]):
         """
 
         return SkillEntity(
-            id=str(doc.get("$skillId", "")),
+            id=self._entity_id(doc),
             modelId=str(doc.get("modelId", "")),
             UUID=doc.get("UUID", ""),
             preferredLabel=doc.get("preferredLabel", ""),
@@ -320,6 +908,9 @@ class SkillSearchService(AbstractEscoSearchService[SkillEntity]):
             score=doc.get("score", 0.0),
         )
 
+    def _entity_id(self, doc: dict) -> str:
+        return str(doc.get("$skillId", ""))
+
     def _group_fields(self) -> dict:
         return {"_id": "$skillId",
                 "modelId": {"$first": "$modelId"},
@@ -356,22 +947,127 @@ class OccupationSkillSearchService(SimilaritySearchService[OccupationSkillEntity
             embedding_key=self.embedding_config.embedding_key)
         self.occupation_search_service = OccupationSearchService(db, embedding_service, occupation_vector_search_config, taxonomy_model_id)
         self.relations_collection = db.get_collection(self.embedding_config.occupation_to_skill_collection_name)
+        self._skill_graph: OccupationSkillGraph | None = None
+        self._skill_graph_changed = False
+        self._skill_graph_rebuild_task: asyncio.Task | None = None
+
+    async def enable_local_index(self, *, atlas_fallback: bool = True, snapshot_dir: Optional[str] = None,
+                                 dtype: IndexDType = "float32") -> None:
+        """
+        Answer the occupation similarity searches from the process memory, see AbstractEscoSearchService.enable_local_index.
+        """
+        await self.occupation_search_service.enable_local_index(atlas_fallback=atlas_fallback, snapshot_dir=snapshot_dir,
+                                                                dtype=dtype)
+
+    async def enable_label_index(self, *, mode: LabelSearchMode = "exact") -> None:
+        """
+        Answer the occupation searches that match a label exactly without an embedding, see OccupationSearchService.enable_label_index.
+        """
+        await self.occupation_search_service.enable_label_index(mode=mode)
+
+    async def enable_code_index(self) -> None:
+        """
+        Look up the occupations by code in memory, see OccupationSearchService.enable_code_index.
+        """
+        await self.occupation_search_service.enable_code_index()
+
+    async def embed_queries(self, queries: list[str]) -> list[str | list[float]]:
+        """
+        Embed the text queries once, for several searches, see AbstractEscoSearchService.embed_queries.
+        """
+        return await self.occupation_search_service.embed_queries(queries)
+
+    async def enable_skill_graph(self) -> None:
+        """
+        Build the occupation to skill graph of the taxonomy model, and answer the skills of occupations from it
+        instead of the database. If the graph cannot be built, the skills are retrieved from the database.
+        """
+        try:
+            self._skill_graph = await _get_occupation_skill_graph(
+                relations_collection=self.relations_collection,
+                skills_collection=self.database.get_collection(self.embedding_config.skill_collection_name),
+                model_id=self._model_id,
+                logger=self._logger)
+        except Exception as e:  # pylint: disable=broad-except
+            self._logger.error("Failed to build the occupation to skill graph, using the database: %s", e, exc_info=True)
+
+    def _schedule_skill_graph_rebuild(self):
+        """
+        Rebuild the occupation to skill graph once the relations stop changing for a while.
+        The changes that arrive while the graph is rebuilt are picked up by another rebuild.
+        """
+        if self._skill_graph is None:
+            return
+        self._skill_graph_changed = True
+        if self._skill_graph_rebuild_task is None or self._skill_graph_rebuild_task.done():
+            self._skill_graph_rebuild_task = asyncio.create_task(self._rebuild_skill_graph())
+
+    async def _rebuild_skill_graph(self):
+        while self._skill_graph_changed:
+            await asyncio.sleep(_SKILL_GRAPH_REBUILD_DELAY)
+            self._skill_graph_changed = False
+            try:
+                # the searches keep using the previous graph until the new one is built
+                self._skill_graph = await _get_occupation_skill_graph(
+                    relations_collection=self.relations_collection,
+                    skills_collection=self.database.get_collection(self.embedding_config.skill_collection_name),
+                    model_id=self._model_id,
+                    logger=self._logger,
+                    rebuild=True)
+            except Exception as e:  # pylint: disable=broad-except
+                self._logger.error("Failed to rebuild the occupation to skill graph, keeping the previous one: %s", e,
+                                   exc_info=True)
 
     async def watch_db_changes(self):
         """
-        Watch for changes in the "Relations" and "Occupations" collections.
-        If there are any changes, clear the caches to ensure that the next search will retrieve the latest data.
-        :return:
+        Watch for changes in the "Relations" and "Occupations" collections, concurrently.
+        The skills of the occupations affected by a change are evicted from the cache, so that the next search will
+        retrieve the latest data. If the affected occupations are not known (e.g. a deleted document, or a relation moved
+        to another occupation, whose content before the change is not recorded), the whole cache is cleared.
+        When the skills are answered from the occupation to skill graph, the graph is rebuilt after the relations change.
+        The in-memory indexes of the occupations (e.g. the label and code indexes) are rebuilt after the occupations change.
+        The changes of the skills themselves are not watched, they are picked up by the next rebuild (or restart).
         """
-        await watch_db_changes(
-            collection=self.relations_collection,
-            debouncer=CacheClearDebouncer(cache=_skills_of_occupation_cache, logger=self._logger),
-            logger=self._logger
-        )
-        await watch_db_changes(
-            collection=self.occupation_search_service.collection,
-            debouncer=CacheClearDebouncer(cache=_skills_of_occupation_cache, logger=self._logger),
-            logger=self._logger
+        debouncer = CacheClearDebouncer(cache=_skills_of_occupation_cache, logger=self._logger)
+
+        async def _on_relations_history_lost():
+            await debouncer.schedule_clear()
+            self._schedule_skill_graph_rebuild()
+
+        async def _on_occupations_history_lost():
+            await debouncer.schedule_clear()
+            self.occupation_search_service._schedule_indexes_rebuild()
+
+        def _on_change(field: str) -> Callable[[dict], Awaitable[None]]:
+            async def _evict_occupations(change: dict):
+                operation = change["operationType"]
+                if operation not in {"insert", "update", "replace", "delete"}:
+                    self._logger.debug("Ignoring change (%s)", operation)
+                    return
+                if field == "requiringOccupationId":
+                    self._schedule_skill_graph_rebuild()
+                else:
+                    self.occupation_search_service._schedule_indexes_rebuild()
+                occupation_ids = get_changed_values(change, field)
+                if occupation_ids is None:
+                    self._logger.debug("Detected DB change (%s) of unknown occupations", operation)
+                    await debouncer.schedule_clear()
+                    return
+                self._logger.debug("Detected DB change (%s) of occupations %s", operation, occupation_ids)
+                for occupation_id in occupation_ids:
+                    await _skills_of_occupation_cache.delete(str(occupation_id))
+
+            return _evict_occupations
+
+        await watch_collections(
+            ChangeStreamWatcher(collection=self.relations_collection,
+                                on_change=_on_change("requiringOccupationId"),
+                                on_history_lost=_on_relations_history_lost,
+                                logger=self._logger),
+            ChangeStreamWatcher(collection=self.occupation_search_service.collection,
+                                on_change=_on_change("occupationId"),
+                                on_history_lost=_on_occupations_history_lost,
+                                logger=self._logger)
         )
 
     async def _find_skills_of_occupation(self, occupation: OccupationEntity):
@@ -380,17 +1076,43 @@ class OccupationSkillSearchService(SimilaritySearchService[OccupationSkillEntity
         :param occupation: The occupation entity.
         :return: A list of SkillEntity objects.
         """
-        if occupation.modelId != self._model_id.__str__():
-            raise ValueError(f"Occupation {occupation.id} does not belong to the model {self._model_id}")
+        return (await self._find_skills_of_occupations([occupation]))[occupation.id]
 
-        #  Try cache
-        cached_result = await _skills_of_occupation_cache.get(occupation.id)
-        if cached_result is not None:
-            return cached_result
+    async def _find_skills_of_occupations(self, occupations: list[OccupationEntity]) -> dict[str, list[AssociatedSkillEntity]]:
+        """
+        Find the skills associated with each of the occupations.
+        The skills of the occupations that are not cached are retrieved with a single aggregation.
+        :param occupations: The occupation entities.
+        :return: The AssociatedSkillEntity objects of each occupation, by occupation id.
+        """
+        for occupation in occupations:
+            if occupation.modelId != self._model_id.__str__():
+                raise ValueError(f"Occupation {occupation.id} does not belong to the model {self._model_id}")
+
+        if self._skill_graph is not None:
+            with _metrics.time_stage(stage="skill_graph"):
+                return {occupation.id: self._skill_graph.skills_of_occupation(occupation.id) for occupation in occupations}
+
+        with _metrics.time_stage(stage="skills_cache", cache="hit") as timer:
+            async def _load(occupation_ids: list[str]) -> dict[str, tuple[AssociatedSkillEntity, ...]]:
+                timer.cache = "miss"
+                return await self._load_skills_of_occupations(occupation_ids)
 
+            # The skills of the occupations that are being retrieved by concurrent searches are awaited, not retrieved again
+            skills_of_occupations = await _skills_of_occupation_cache.get_or_load_many(
+                (occupation.id for occupation in occupations), _load)
+        return {occupation_id: list(skills) for occupation_id, skills in skills_of_occupations.items()}
+
+    async def _load_skills_of_occupations(self, occupation_ids: list[str]) -> dict[str, tuple[AssociatedSkillEntity, ...]]:
+        """
+        Load the skills of the occupations from the database, with a single aggregation.
+        :param occupation_ids: The ids of the occupations.
+        :return: The frozen AssociatedSkillEntity objects of each occupation, by occupation id.
+        """
         pipeline = [
-            {"$match": {"modelId": self._model_id, "requiringOccupationId": ObjectId(occupation.id)}},
+            {"$match": {"modelId": self._model_id, "requiringOccupationId": {"$in": [ObjectId(_id) for _id in occupation_ids]}}},
             {"$project": {
+                "requiringOccupationId": 1,
                 "requiredSkillId": 1,
                 "modelId": 1,
                 "relationType": 1,
@@ -414,51 +1136,95 @@ class OccupationSkillSearchService(SimilaritySearchService[OccupationSkillEntity
             {"$unwind": "$skills"}
         ]
 
-        skills_relationships = await self.relations_collection.aggregate(pipeline).to_list(length=None)
-        result = [AssociatedSkillEntity(
-            id=str(skill_relationship.get("skills").get("skillId", "")),
-            modelId=str(skill_relationship.get("modelId", "")),
-            UUID=skill_relationship.get("skills").get("UUID", ""),
-            preferredLabel=skill_relationship.get("skills").get("preferredLabel", ""),
-            description=skill_relationship.get("skills").get("description", ""),
-            scopeNote=skill_relationship.get("skills").get("scopeNote", ""),
-            altLabels=skill_relationship.get("skills").get("altLabels", []),
-            skillType=skill_relationship.get("skills").get("skillType", ""),
-            originUUID=skill_relationship.get("skills").get("originUUID", ""),
-            UUIDHistory=skill_relationship.get("skills").get("UUIDHistory", []),
-            relationType=skill_relationship.get("relationType", ""),
-            signallingValueLabel=skill_relationship.get("signallingValueLabel", ""),
-            score=0.0
-        ) for skill_relationship in skills_relationships]
-
-        # Cache the result
-        await _skills_of_occupation_cache.set(occupation.id, result)
-        return result
+        with _metrics.time_stage(stage="db_aggregate"):
+            skills_relationships = await self.relations_collection.aggregate(pipeline).to_list(length=None)
+        with _metrics.time_stage(stage="convert"):
+            # Split the relations per occupation, an occupation without relations has no skills
+            skills_of_occupations: dict[str, list[AssociatedSkillEntity]] = {_id: [] for _id in occupation_ids}
+            for skill_relationship in skills_relationships:
+                skills_of_occupations[str(skill_relationship.get("requiringOccupationId"))].append(
+                    _to_associated_skill_entity(skill_relationship))
+            return {occupation_id: freeze(skills) for occupation_id, skills in skills_of_occupations.items()}
+
+    async def warm_up_caches(self, *, batch_size: int = 500, on_progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Load all the occupations of the taxonomy model and their skills into the caches.
+        The occupations are streamed in batches, and the skills of each batch are retrieved with a single aggregation.
+        When the skills are answered from the occupation to skill graph, only the occupations are streamed.
+        The warm-up runs next to the requests (and the liveness probe), so the skills are retrieved and cached in small
+        chunks, yielding to the event loop between them.
+        :param batch_size: The number of occupations per batch.
+        :param on_progress: Called with the number of occupations warmed up so far, after each batch.
+        :return: The number of occupations whose skills are cached at the end of the warm-up, it is lower than the number
+                 of occupations if the cache is too small to hold them all (a warning is logged).
+        """
+        count = 0
+        batch: list[OccupationEntity] = []
+        evictions_before = (await _skills_of_occupation_cache.stats())["evictions"]
+
+        async def _warm_up_batch():
+            nonlocal count, batch
+            if self._skill_graph is None:
+                for i in range(0, len(batch), _WARM_UP_CHUNK_SIZE):
+                    await self._find_skills_of_occupations(batch[i:i + _WARM_UP_CHUNK_SIZE])
+                    await asyncio.sleep(0)
+            count += len(batch)
+            batch = []
+            if on_progress is not None:
+                on_progress(count)
+
+        async for occupation in self.occupation_search_service.stream_all(batch_size=batch_size):
+            batch.append(occupation)
+            if len(batch) == batch_size:
+                await _warm_up_batch()
+        if batch:
+            await _warm_up_batch()
+        if self._skill_graph is not None:
+            return count
+
+        stats = await _skills_of_occupation_cache.stats()
+        evictions = stats["evictions"] - evictions_before
+        if evictions:
+            self._logger.warning("The warm-up evicted %d entries from the skills cache, it cannot hold the skills of the %d "
+                                 "occupations (max_size=%s, max_bytes=%s, estimated size=%d bytes)",
+                                 evictions, count, stats["max_size"], stats["max_bytes"], stats["memory_usage_bytes"])
+        return min(count, stats["current_size"])
 
     async def _retrieve_skills_of_occupations(self, occupations: list[OccupationEntity]) -> List[OccupationSkillEntity]:
-        # Retrieve the skills of the given occupations by concurrently searching for each occupation,
-        # this is done to speed up the search process.
-
+        # Retrieve the skills of the given occupations in bulk, to reduce the round trips to the database.
         search_start_time = time.time()
-
-        async def task(occupation: OccupationEntity) -> OccupationSkillEntity:
-            associated_skills = await self._find_skills_of_occupation(occupation)
-            return OccupationSkillEntity(occupation=occupation, associated_skills=associated_skills)
-
-        tasks = [task(occupation) for occupation in occupations]
-        results = await asyncio.gather(*tasks)
+        skills_of_occupations = await self._find_skills_of_occupations(occupations)
+        results = [OccupationSkillEntity(occupation=occupation, associated_skills=skills_of_occupations[occupation.id])
+                   for occupation in occupations]
         search_end_time = time.time()
         self._logger.debug("Retrieving skills of occupations took %.2f seconds", search_end_time - search_start_time)
         return results
 
     async def search(self, *, query: str, filter_spec: FilterSpec = None, k: int = 5) -> list[OccupationSkillEntity]:
         search_start_time = time.time()
-        occupations: list[OccupationEntity] = await self.occupation_search_service.search(query=query, filter_spec=filter_spec, k=k)
-        occupation_skills: List[OccupationSkillEntity] = await self._retrieve_skills_of_occupations(occupations=occupations)
+        with _metrics.time_operation(service=self.__class__.__name__, operation="search"):
+            occupations: list[OccupationEntity] = await self.occupation_search_service.search(query=query, filter_spec=filter_spec, k=k)
+            occupation_skills: List[OccupationSkillEntity] = await self._retrieve_skills_of_occupations(occupations=occupations)
         search_end_time = time.time()
         self._logger.debug("Search by embeddings took %.2f seconds", search_end_time - search_start_time)
         return occupation_skills
 
+    async def search_many(self, *, queries: list[str | list[float]], filter_spec: FilterSpec = None, k: int = 5) -> \
+            list[list[OccupationSkillEntity]]:
+        """
+        Search the occupations and their skills for each of the queries, see AbstractEscoSearchService.search_many.
+        """
+        search_start_time = time.time()
+        with _metrics.time_operation(service=self.__class__.__name__, operation="search_many"):
+            list_of_occupations = await self.occupation_search_service.search_many(queries=queries, filter_spec=filter_spec, k=k)
+            # the skills of the occupations of all the queries are retrieved at once
+            skills_of_occupations = await self._find_skills_of_occupations(
+                [occupation for occupations in list_of_occupations for occupation in occupations])
+        list_of_occupation_skills = [[OccupationSkillEntity(occupation=occupation, associated_skills=skills_of_occupations[occupation.id])
+                                      for occupation in occupations] for occupations in list_of_occupations]
+        self._logger.debug("Search of %d queries by embeddings took %.2f seconds", len(queries), time.time() - search_start_time)
+        return list_of_occupation_skills
+
     async def get_by_esco_code(self, *, code: str | re.Pattern) -> list[OccupationSkillEntity]:
         """
         Get an occupation by its ESCO code.
@@ -466,8 +1232,30 @@ class OccupationSkillSearchService(SimilaritySearchService[OccupationSkillEntity
         :return: The OccupationSkillEntity object.
         """
         search_start_time = time.time()
-        occupations: list[OccupationEntity] = await self.occupation_search_service.get_by_esco_code(code=code)
-        occupation_skills: List[OccupationSkillEntity] = await self._retrieve_skills_of_occupations(occupations=occupations)
+        with _metrics.time_operation(service=self.__class__.__name__, operation="get_by_esco_code"):
+            occupations: list[OccupationEntity] = await self.occupation_search_service.get_by_esco_code(code=code)
+            occupation_skills: List[OccupationSkillEntity] = await self._retrieve_skills_of_occupations(occupations=occupations)
         search_end_time = time.time()
         self._logger.debug("Search by esco code took %.2f seconds", search_end_time - search_start_time)
         return occupation_skills
+
+
+def _to_associated_skill_entity(skill_relationship: dict) -> AssociatedSkillEntity:
+    """
+    Convert a relation document, with the looked-up skill document, to an AssociatedSkillEntity object.
+    """
+    return AssociatedSkillEntity(
+        id=str(skill_relationship.get("skills").get("skillId", "")),
+        modelId=str(skill_relationship.get("modelId", "")),
+        UUID=skill_relationship.get("skills").get("UUID", ""),
+        preferredLabel=skill_relationship.get("skills").get("preferredLabel", ""),
+        description=skill_relationship.get("skills").get("description", ""),
+        scopeNote=skill_relationship.get("skills").get("scopeNote", ""),
+        altLabels=skill_relationship.get("skills").get("altLabels", []),
+        skillType=skill_relationship.get("skills").get("skillType", ""),
+        originUUID=skill_relationship.get("skills").get("originUUID", ""),
+        UUIDHistory=skill_relationship.get("skills").get("UUIDHistory", []),
+        relationType=skill_relationship.get("relationType", ""),
+        signallingValueLabel=skill_relationship.get("signallingValueLabel", ""),
+        score=0.0
+    )
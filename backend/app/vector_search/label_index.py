@@ -0,0 +1,157 @@
+import logging
+import math
+import re
+import time
+from collections import defaultdict
+from typing import Generic, Optional, TypeVar
+
+from app.vector_search.caching_embeddings_service import normalize_text
+from app.vector_search.esco_entities import BaseEntity
+
+_TOKEN_REGEX = re.compile(r"\w+")
+
+# The BM25 parameters, see https://en.wikipedia.org/wiki/Okapi_BM25
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+# The lexical scores are in [0, 1], 1 for an exact match of a label.
+# The near-exact matches are scored relative to the best of them, below the exact matches.
+_NEAR_EXACT_MAX_SCORE = 0.9
+
+EntityT = TypeVar("EntityT", bound=BaseEntity)
+
+
+def normalize_label(text: str) -> str:
+    """
+    Normalize a label or a query, so that they match regardless of their case, unicode representation and whitespace.
+    """
+    return normalize_text(text).lower()
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TOKEN_REGEX.findall(text)
+
+
+class LabelIndex(Generic[EntityT]):
+    """
+    An in-memory inverted index of the preferred and alternative labels of the ESCO entities of a taxonomy model.
+
+    The queries that are exactly one of the labels (once normalized, see normalize_label) are matched without
+    an embedding, and the labels can be scored with BM25 (every label is a document of the index).
+    """
+
+    def __init__(self, entities: list[EntityT]):
+        """
+        :param entities: The entities of the taxonomy model, the index keeps a reference to them.
+        """
+        self._entities = entities
+        self._uuid_to_entity: dict[str, int] = {entity.UUID: idx for idx, entity in enumerate(entities)}
+        # the entity of every label, and the entities of every normalized label
+        self._label_entities: list[int] = []
+        self._exact: dict[str, list[int]] = defaultdict(list)
+        # the labels of every token, with the frequency of the token in the label
+        self._postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        self._label_lengths: list[int] = []
+
+        for idx, entity in enumerate(entities):
+            labels = dict.fromkeys(normalize_label(label) for label in [entity.preferredLabel, *entity.altLabels])
+            for label in labels:
+                if not label:
+                    continue
+                if idx not in self._exact[label]:
+                    self._exact[label].append(idx)
+                tokens = _tokenize(label)
+                label_idx = len(self._label_entities)
+                self._label_entities.append(idx)
+                self._label_lengths.append(len(tokens))
+                for token in set(tokens):
+                    self._postings[token].append((label_idx, tokens.count(token)))
+
+        self._average_label_length = sum(self._label_lengths) / len(self._label_lengths) if self._label_lengths else 0.0
+
+    def __len__(self):
+        return len(self._entities)
+
+    def _allowed(self, uuids: Optional[list[str]]) -> Optional[set[int]]:
+        if not uuids:
+            return None
+        return {self._uuid_to_entity[uuid] for uuid in uuids if uuid in self._uuid_to_entity}
+
+    def _label_scores(self, tokens: list[str], *, all_tokens: bool = False) -> dict[int, float]:
+        """
+        The BM25 scores of the labels with any of the tokens, or with all of them if all_tokens is True.
+        """
+        scores: dict[int, float] = defaultdict(float)
+        matched_tokens: dict[int, int] = defaultdict(int)
+        count = len(self._label_lengths)
+        unique_tokens = set(tokens)
+        for token in unique_tokens:
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for label_idx, frequency in postings:
+                length_norm = 1 - _BM25_B + _BM25_B * self._label_lengths[label_idx] / self._average_label_length
+                scores[label_idx] += idf * frequency * (_BM25_K1 + 1) / (frequency + _BM25_K1 * length_norm)
+                matched_tokens[label_idx] += 1
+        if all_tokens:
+            return {label_idx: score for label_idx, score in scores.items() if matched_tokens[label_idx] == len(unique_tokens)}
+        return scores
+
+    def _best_entities(self, label_scores: dict[int, float], *, k: int, allowed: Optional[set[int]],
+                       excluded: set[int]) -> list[tuple[int, float]]:
+        entity_scores: dict[int, float] = {}
+        for label_idx, score in label_scores.items():
+            idx = self._label_entities[label_idx]
+            if idx in excluded or (allowed is not None and idx not in allowed):
+                continue
+            entity_scores[idx] = max(entity_scores.get(idx, 0.0), score)
+        return sorted(entity_scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def bm25(self, query: str, *, k: int = 5, uuids: Optional[list[str]] = None) -> list[tuple[EntityT, float]]:
+        """
+        Find the k entities with the best BM25 score of any of their labels.
+        :param query: The query.
+        :param k: The number of entities to return.
+        :param uuids: If given, only the entities with these UUIDs are considered.
+        :return: A list of (entity, BM25 score) tuples sorted by descending score.
+        """
+        best = self._best_entities(self._label_scores(_tokenize(normalize_label(query))), k=k,
+                                   allowed=self._allowed(uuids), excluded=set())
+        return [(self._entities[idx], score) for idx, score in best]
+
+    def match(self, query: str, *, k: int = 5, uuids: Optional[list[str]] = None) -> list[tuple[EntityT, float]]:
+        """
+        Find the entities with a label that matches the query exactly, followed by the near-exact matches
+        (the entities with a label that contains all the words of the query, ranked by BM25), up to k entities.
+        If no label matches the query exactly, no entity is returned.
+        :param query: The query.
+        :param k: The maximum number of entities to return.
+        :param uuids: If given, only the entities with these UUIDs are considered.
+        :return: A list of (entity, score) tuples sorted by descending score, the exact matches have a score of 1.
+        """
+        label = normalize_label(query)
+        allowed = self._allowed(uuids)
+        exact = [idx for idx in self._exact.get(label, []) if allowed is None or idx in allowed][:k]
+        if not exact:
+            return []
+
+        results = [(self._entities[idx], 1.0) for idx in exact]
+        if len(results) < k:
+            # the labels with all the words of the query
+            near_exact = self._best_entities(self._label_scores(_tokenize(label), all_tokens=True),
+                                             k=k - len(results), allowed=allowed, excluded=set(exact))
+            if near_exact:
+                best_score = near_exact[0][1]
+                results.extend((self._entities[idx], _NEAR_EXACT_MAX_SCORE * score / best_score) for idx, score in near_exact)
+        return results
+
+
+def build_label_index(*, entities: list[EntityT], logger: logging.Logger) -> LabelIndex[EntityT]:
+    """
+    Build the label index of the entities, and log its size.
+    """
+    start_time = time.time()
+    index = LabelIndex(entities)
+    logger.info("Built the label index of %d entities in %.2f seconds", len(index), time.time() - start_time)
+    return index
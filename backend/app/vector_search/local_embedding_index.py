@@ -0,0 +1,351 @@
+import logging
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Literal, Optional, TypeAlias
+
+import numpy as np
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+# The number of rows converted to float32 at a time when the embeddings are stored with a smaller type
+_SCORING_BLOCK_ROWS = 8192
+
+# The types the embeddings can be stored with in memory.
+# float16 halves and int8 quarters the memory of the float32 embeddings, at the cost of some precision of the scores.
+IndexDType: TypeAlias = Literal["float32", "float16", "int8"]
+
+# When the scores are approximate (quantized embeddings), this many candidates per result are re-scored exactly
+_RESCORE_OVERSAMPLING = 4
+_RESCORE_MIN_CANDIDATES = 20
+
+# When a search is filtered to at most this many entities, only the rows of those entities are scored
+_MAX_FILTERED_ENTITIES = 2000
+
+# The number of filters whose candidate entities are kept, see LocalEmbeddingIndex.search_many
+_MAX_CACHED_FILTERS = 64
+
+
+class LocalEmbeddingIndex:
+    """
+    An in-process index of the embeddings of the ESCO entities of a taxonomy model.
+
+    Each ESCO entity is stored up to three times in the embeddings collections (one embedding for the preferredLabel,
+    one for the description and one for the altLabels). The index keeps all the embeddings in a contiguous matrix,
+    where the rows of the same entity are adjacent, so that the score of an entity (the best score of its rows)
+    can be computed with a single vectorized reduction.
+    """
+
+    def __init__(self, *, embeddings: np.ndarray, row_entities: np.ndarray, entities: list[dict[str, Any]],
+                 scales: Optional[np.ndarray] = None, rescore_embeddings: Optional[np.ndarray] = None):
+        """
+        :param embeddings: A (rows x dimensions) matrix with the L2 normalized embeddings.
+                           If it is an int8 matrix, the embeddings are the rows multiplied by their scales.
+        :param row_entities: For each row of the embeddings, the index of the entity in the entities list.
+                             The rows of the same entity must be adjacent and the entities must appear in order.
+        :param entities: The documents of the entities (without the embeddings).
+        :param scales: The (rows,) scales of the int8 embeddings, see quantize_int8().
+        :param rescore_embeddings: If given, the (rows x dimensions) embeddings used to re-score the best candidates
+                                   with float32 precision, e.g. the memory-mapped float32 embeddings of a snapshot.
+                                   Only the rows of the candidates are read.
+        """
+        if embeddings.ndim != 2:
+            raise ValueError(f"The embeddings must be a 2D matrix, got {embeddings.ndim} dimensions")
+        if len(row_entities) != embeddings.shape[0]:
+            raise ValueError(f"Expected {embeddings.shape[0]} row entities, got {len(row_entities)}")
+        if embeddings.dtype == np.int8 and (scales is None or scales.shape != (embeddings.shape[0],)):
+            raise ValueError("The int8 embeddings require a scale for every row")
+        if rescore_embeddings is not None and rescore_embeddings.shape != embeddings.shape:
+            raise ValueError(f"Expected rescore embeddings of shape {embeddings.shape}, got {rescore_embeddings.shape}")
+
+        self._embeddings = embeddings
+        self._scales = scales
+        self._rescore_embeddings = rescore_embeddings
+        self._entities = entities
+        # The first row of every entity, used to reduce the row scores to entity scores
+        self._entity_starts = np.flatnonzero(np.r_[True, row_entities[1:] != row_entities[:-1]]) \
+            if len(row_entities) else np.empty(0, dtype=np.int64)
+        self._entity_ends = np.r_[self._entity_starts[1:], len(row_entities)].astype(np.int64)
+        if np.any(np.diff(row_entities) < 0) or len(self._entity_starts) != len(entities):
+            raise ValueError("The rows of the embeddings must be sorted by entity and cover all the entities")
+
+        self._uuid_to_entity: dict[str, int] = {entity.get("UUID"): idx for idx, entity in enumerate(entities)}
+        # The candidate entities of the recently used filters, by filter key
+        self._filter_candidates: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+
+    @property
+    def dimensions(self) -> int:
+        return self._embeddings.shape[1]
+
+    @property
+    def entities(self) -> list[dict[str, Any]]:
+        return self._entities
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the embeddings used to score the queries, without the rescore embeddings.
+        """
+        return self._embeddings.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def quantize(self, dtype: IndexDType) -> "LocalEmbeddingIndex":
+        """
+        Get an index of the same entities, with the embeddings stored with the given type.
+        The embeddings of this index are used to re-score the best candidates of the quantized index,
+        so they should be memory-mapped (e.g. from a snapshot) for the quantized index to use less memory.
+        """
+        if dtype == "float32" or np.dtype(dtype) == self._embeddings.dtype:
+            return self
+        scales = None
+        if dtype == "int8":
+            embeddings, scales = quantize_int8(self._embeddings)
+        else:
+            embeddings = np.empty(self._embeddings.shape, dtype=np.float16)
+            for start in range(0, self._embeddings.shape[0], _SCORING_BLOCK_ROWS):
+                embeddings[start:start + _SCORING_BLOCK_ROWS] = self._embeddings[start:start + _SCORING_BLOCK_ROWS]
+        return LocalEmbeddingIndex(embeddings=embeddings,
+                                   row_entities=self._row_entities(),
+                                   entities=self._entities,
+                                   scales=scales,
+                                   rescore_embeddings=self._embeddings)
+
+    def _row_entities(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self._entities), dtype=np.int32), self._entity_ends - self._entity_starts)
+
+    def __len__(self):
+        return len(self._entities)
+
+    def entity_mask(self, uuids: list[str]) -> np.ndarray:
+        """
+        Get a boolean mask of the entities with the given UUIDs.
+        UUIDs that are not in the index are ignored.
+        """
+        mask = np.zeros(len(self._entities), dtype=bool)
+        indices = [self._uuid_to_entity[uuid] for uuid in uuids if uuid in self._uuid_to_entity]
+        mask[indices] = True
+        return mask
+
+    def _row_scores(self, queries: np.ndarray) -> np.ndarray:
+        if self._embeddings.dtype == np.float32:
+            return queries @ self._embeddings.T
+        # Embeddings stored with a smaller type (e.g. a float16 snapshot) are scored in blocks,
+        # so that only one block at a time is converted to float32
+        row_scores = np.empty((queries.shape[0], self._embeddings.shape[0]), dtype=np.float32)
+        for start in range(0, self._embeddings.shape[0], _SCORING_BLOCK_ROWS):
+            block = self._embeddings[start:start + _SCORING_BLOCK_ROWS].astype(np.float32)
+            row_scores[:, start:start + block.shape[0]] = queries @ block.T
+        if self._scales is not None:
+            row_scores *= self._scales
+        return row_scores
+
+    def _entity_scores_of(self, queries: np.ndarray, entity_indices: np.ndarray) -> np.ndarray:
+        """
+        Compute the cosine similarity of the queries with the given entities only, from their rows.
+        The rescore embeddings are used if any, so the scores are exact.
+        :return: A (queries x entities) matrix.
+        """
+        starts = self._entity_starts[entity_indices]
+        lengths = self._entity_ends[entity_indices] - starts
+        # the rows of every entity, one entity after the other
+        offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        if self._rescore_embeddings is not None:
+            embeddings = np.asarray(self._rescore_embeddings[rows], dtype=np.float32)
+        else:
+            embeddings = np.asarray(self._embeddings[rows], dtype=np.float32)
+            if self._scales is not None:
+                embeddings *= self._scales[rows][:, np.newaxis]
+        return np.maximum.reduceat(queries @ embeddings.T, offsets, axis=1)
+
+    def _candidates(self, uuids: list[str], uuids_key: Optional[Hashable]) -> np.ndarray:
+        """
+        Get the sorted indices of the entities with the given UUIDs, the ones of the recent keys are reused.
+        """
+        if uuids_key is not None and uuids_key in self._filter_candidates:
+            self._filter_candidates.move_to_end(uuids_key)
+            return self._filter_candidates[uuids_key]
+        candidates = np.flatnonzero(self.entity_mask(uuids))
+        if uuids_key is not None:
+            self._filter_candidates[uuids_key] = candidates
+            if len(self._filter_candidates) > _MAX_CACHED_FILTERS:
+                self._filter_candidates.popitem(last=False)
+        return candidates
+
+    def search(self, query: list[float] | np.ndarray, *, k: int = 5, uuids: Optional[list[str]] = None) -> list[tuple[dict[str, Any], float]]:
+        """
+        Find the k entities most similar to the query vector.
+        :param query: The query vector.
+        :param k: The number of entities to return.
+        :param uuids: If given, only the entities with these UUIDs are considered.
+        :return: A list of (entity document, score) tuples sorted by descending score.
+        """
+        return self.search_many(np.asarray(query, dtype=np.float32)[np.newaxis, :], k=k, uuids=uuids)[0]
+
+    def search_many(self, queries: np.ndarray, *, k: int = 5, uuids: Optional[list[str]] = None,
+                    uuids_key: Optional[Hashable] = None) -> list[list[tuple[dict[str, Any], float]]]:
+        """
+        Find the k entities most similar to each of the query vectors.
+        If the entities are filtered to a few of them, only their rows are scored.
+        :param queries: A (queries x dimensions) matrix.
+        :param k: The number of entities to return for each query.
+        :param uuids: If given, only the entities with these UUIDs are considered.
+        :param uuids_key: If given, a key of the set of uuids (see FilterSpec.key), so that the entities with these UUIDs
+                          are looked up once for all the searches with the same key.
+        :return: For each query, a list of (entity document, score) tuples sorted by descending score.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dimensions:
+            raise ValueError(f"Expected queries with {self.dimensions} dimensions, got shape {queries.shape}")
+        if len(self._entities) == 0 or k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        queries = normalize_rows(queries.copy())
+
+        candidates: Optional[np.ndarray] = None
+        if uuids:
+            candidates = self._candidates(uuids, uuids_key)
+
+        rescore = self._rescore_embeddings is not None
+        if candidates is not None and len(candidates) <= _MAX_FILTERED_ENTITIES:
+            # score the rows of the candidates only, the scores are exact
+            entity_scores = self._entity_scores_of(queries, candidates) if len(candidates) else np.empty((queries.shape[0], 0))
+            rescore = False
+        else:
+            # cosine similarity of every query with every row, then the best row of every entity
+            row_scores = self._row_scores(queries)
+            entity_scores = np.maximum.reduceat(row_scores, self._entity_starts, axis=1)
+            if candidates is not None:
+                entity_scores = entity_scores[:, candidates]
+        # Atlas reports the cosine similarity normalized to [0, 1], keep the scores comparable
+        entity_scores = (1.0 + entity_scores) / 2.0
+
+        results = []
+        n = entity_scores.shape[1]
+        top = min(k, n)
+        # The approximate scores select the candidates, which are re-scored exactly, and the best of them are returned
+        top_candidates = min(max(k * _RESCORE_OVERSAMPLING, _RESCORE_MIN_CANDIDATES), n) if rescore else top
+        for query, scores in zip(queries, entity_scores):
+            if top == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-scores, top_candidates - 1)[:top_candidates] if top_candidates < n else np.arange(n)
+            if rescore:
+                scores = np.zeros(n, dtype=np.float32)
+                exact_scores = self._entity_scores_of(query[np.newaxis, :], candidates[best] if candidates is not None else best)[0]
+                scores[best] = (1.0 + exact_scores) / 2.0
+            best = best[np.argsort(-scores[best], kind="stable")][:top]
+            entity_indices = candidates[best] if candidates is not None else best
+            results.append([(self._entities[idx], float(scores[b])) for idx, b in zip(entity_indices, best)])
+        return results
+
+
+def quantize_int8(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize the embeddings to int8, with a symmetric scale per row: row ~= int8 row * scale.
+    The embeddings are converted in blocks, so that they can be memory-mapped.
+    :return: The (rows x dimensions) int8 embeddings and their (rows,) float32 scales.
+    """
+    quantized = np.empty(embeddings.shape, dtype=np.int8)
+    scales = np.empty(embeddings.shape[0], dtype=np.float32)
+    for start in range(0, embeddings.shape[0], _SCORING_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + _SCORING_BLOCK_ROWS], dtype=np.float32)
+        block_scales = np.abs(block).max(axis=1) / 127.0
+        block_scales[block_scales == 0] = 1.0
+        quantized[start:start + block.shape[0]] = np.rint(block / block_scales[:, np.newaxis])
+        scales[start:start + block.shape[0]] = block_scales
+    return quantized, scales
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2 normalize the rows of the matrix in place.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def group_doc(doc: dict[str, Any], group_fields: dict) -> dict[str, Any]:
+    """
+    Build the document of an entity the same way the $group stage of the vector search does,
+    by keeping the fields referenced by the $first accumulators.
+    """
+    entity = {}
+    for key, spec in group_fields.items():
+        if key == "_id":
+            entity[key] = doc.get(spec.removeprefix("$"))
+        elif isinstance(spec, dict) and isinstance(spec.get("$first"), str):
+            entity[key] = doc.get(spec["$first"].removeprefix("$"))
+    return entity
+
+
+async def load_local_embedding_index(*,
+                                     collection: AsyncIOMotorCollection,
+                                     model_id: ObjectId,
+                                     embedding_key: str,
+                                     group_fields: dict,
+                                     logger: logging.Logger,
+                                     batch_size: int = 1000,
+                                     dtype: IndexDType = "float32",
+                                     uuids: Optional[list[str]] = None) -> LocalEmbeddingIndex:
+    """
+    Stream the embeddings of a taxonomy model from the database into a LocalEmbeddingIndex.
+    If the embeddings are stored with a smaller type than float32, the float32 embeddings are kept in a temporary
+    memory-mapped file, to re-score the best candidates of the searches (see LocalEmbeddingIndex.quantize).
+    :param collection: The embeddings collection (occupations or skills).
+    :param model_id: The taxonomy model id.
+    :param embedding_key: The key of the embedding in the documents.
+    :param group_fields: The $group fields of the search service, the "_id" field is the key of the entity.
+    :param logger: The logger to use.
+    :param batch_size: The cursor batch size.
+    :param dtype: The type the embeddings are stored with in memory.
+    :param uuids: If given, only the embeddings of the entities with these UUIDs are loaded.
+    """
+    start_time = time.time()
+    query: dict[str, Any] = {"modelId": model_id}
+    if uuids:
+        query["UUID"] = {"$in": uuids}
+    rows_count = await collection.count_documents(query)
+
+    projection = {"embedded_text": 0, "embedded_field": 0}
+    entity_key = group_fields["_id"].removeprefix("$")
+    embeddings: Optional[np.ndarray] = None
+    row_entities = np.empty(rows_count, dtype=np.int32)
+    entity_index: dict[Any, int] = {}
+    entities: list[dict[str, Any]] = []
+
+    row = 0
+    # Fill a preallocated matrix, rather than collecting lists of floats, to keep the peak memory close to the final size.
+    # Sorting by the entity key keeps the rows of each entity together (see the model_id_and_<id>_index).
+    async for doc in collection.find(query, projection).sort([("modelId", 1), (entity_key, 1)]).batch_size(batch_size):
+        if row >= rows_count:
+            break  # documents added while loading
+        vector = doc.get(embedding_key)
+        if not vector:
+            continue
+        if embeddings is None:
+            if dtype == "float32":
+                embeddings = np.empty((rows_count, len(vector)), dtype=np.float32)
+            else:
+                # The file is removed when the memory map is closed
+                embeddings = np.memmap(tempfile.TemporaryFile(), mode="w+", dtype=np.float32, shape=(rows_count, len(vector)))
+        embeddings[row] = vector
+
+        key = doc.get(entity_key)
+        if key not in entity_index:
+            entity_index[key] = len(entities)
+            entities.append(group_doc(doc, group_fields))
+        row_entities[row] = entity_index[key]
+        row += 1
+
+    if embeddings is None:
+        raise ValueError(f"No embeddings found in {collection.name} for the taxonomy model {model_id}")
+
+    embeddings = normalize_rows(embeddings[:row])
+    row_entities = row_entities[:row]
+
+    index = LocalEmbeddingIndex(embeddings=embeddings, row_entities=row_entities, entities=entities).quantize(dtype)
+    logger.info("Loaded %d embeddings of %d entities from %s in %.2f seconds (%s, %.1f MB)",
+                row, len(entities), collection.name, time.time() - start_time, dtype, index.nbytes / (1024 * 1024))
+    return index
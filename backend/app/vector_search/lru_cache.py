@@ -1,140 +1,345 @@
 import asyncio
 import copy
 import logging
+import time
 from collections import OrderedDict
-from typing import Literal, Optional, TypeAlias
+from typing import Any, Awaitable, Callable, Iterable, Literal, Optional, TypeAlias, TypeVar
 
 from pympler import asizeof
 
 CacheUnit: TypeAlias = Literal["bytes", "kb", "mb", "gb"]
 
+# Estimates the size in bytes of an entry (key and value) of a cache
+Sizeof: TypeAlias = Callable[[Any, Any], int]
+
+T = TypeVar("T")
+
+# The approximate overhead of an entry of the cache (its key and its slots in the dictionaries of the cache), in bytes
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def deep_sizeof(key, value) -> int:
+    """
+    The size of an entry, measured by walking all the objects it references.
+    It is accurate but slow for large values (milliseconds for a hundred entities), prefer a cheaper estimate
+    for the caches of large values, see items_sizeof() and nbytes_sizeof().
+    """
+    return asizeof.asizeof(key, value)
+
+
+def items_sizeof(item_bytes: int) -> Sizeof:
+    """
+    Estimate the size of the entries whose values are collections of items of similar size (e.g. tuples of entities),
+    as the number of items times the given size of an item.
+    :param item_bytes: The approximate size of an item, in bytes.
+    """
+
+    def _sizeof(_key, value) -> int:
+        return _ENTRY_OVERHEAD_BYTES + item_bytes * len(value)
+
+    return _sizeof
+
+
+def nbytes_sizeof(_key, value) -> int:
+    """
+    Estimate the size of the entries whose values are numpy arrays, or have an nbytes attribute.
+    """
+    return _ENTRY_OVERHEAD_BYTES + int(value.nbytes)
+
 
 class AsyncLRUCache:
     """
-    An asynchronous LRU (Least Recently Used) cache implementation with a maximum size.
-    This cache supports asynchronous operations and is thread-safe.
+    An asynchronous LRU (Least Recently Used) cache implementation with a maximum size,
+    and optionally a maximum memory budget (max_bytes).
+    This cache supports asynchronous operations and is safe to use from concurrent tasks of the same event loop.
+    The operations on the entries do not await while they modify the cache, so they do not need a lock,
+    and the hits are never blocked by other callers.
+
+    By default, the values are deep copied when they are set and when they are returned, so that the callers cannot
+    modify the cached values. Deep copying large values (e.g. lists of entities) is expensive, if copy_values is False
+    the values are stored and returned as they are, and the callers must treat them as immutable
+    (e.g. store tuples of entities and never modify the entities, see freeze()).
+
+    The misses can be loaded with get_or_load() and get_or_load_many(), which run a single loader per key
+    while the other callers of the same key await its result.
+
+    If a ttl is given, the entries expire that many seconds after they are set, an expired entry is a miss.
     """
 
-    def __init__(self, *, name="Cache", max_size=128):
+    def __init__(self, *, name="Cache", max_size=128, copy_values: bool = True, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, sizeof: Sizeof = deep_sizeof):
+        """
+        :param name: The name of the cache, used in the logs.
+        :param max_size: The maximum number of entries.
+        :param copy_values: If False, the values are not copied when they are set and returned.
+        :param max_bytes: If given, the maximum estimated size of the entries, in bytes.
+        :param ttl: If given, the time to live of the entries, in seconds.
+        :param sizeof: Estimates the size of an entry when it is set, it runs on the event loop for every set,
+                       so it should be cheap for the caches of large values (see items_sizeof() and nbytes_sizeof()).
+        """
         self.name = name
+        self._sizeof = sizeof
         self.cache = OrderedDict()
         self.max_size = max_size
+        self.copy_values = copy_values
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entry_bytes: dict = {}
+        # The monotonic time at which each entry expires, only when a ttl is given
+        self._expires_at: dict = {}
+        self._total_bytes = 0
         self._logger = logging.getLogger(self.__class__.__name__)
-        self._lock = asyncio.Lock()  # Async-safe lock
+        # The futures of the keys that are being loaded, see get_or_load_many()
+        # A key is removed when it is deleted or the cache is cleared, so that the value being loaded is not cached
+        self._loading: dict[Any, asyncio.Future] = {}
 
         # Stats
         self._hits = 0
         self._misses = 0
+        self._coalesced = 0
         self._evictions = 0
         self._sets = 0
         self._overwrites = 0
+        self._expirations = 0
+
+    def _copy(self, value):
+        return copy.deepcopy(value) if self.copy_values else value
+
+    def _lookup(self, key) -> tuple[bool, Any]:
+        # Does not await, so it cannot interleave with the other operations on the cache
+        if key in self.cache and self.ttl is not None and self._expires_at[key] <= time.monotonic():
+            self._expirations += 1
+            self._remove(key)
+            self._logger.debug("[CACHE EXPIRED] [%s] Key: %s", self.name, key)
+        if key in self.cache:
+            self._hits += 1
+            self.cache.move_to_end(key)
+            self._logger.debug("[CACHE HIT] [%s] Key: %s", self.name, key)
+            return True, self._copy(self.cache[key])
+        self._misses += 1
+        self._logger.debug("[CACHE MISS] [%s] Key: %s", self.name, key)
+        return False, None
 
     async def get(self, key):
         """
         Get a value from the cache by its key.
-        A deep copy of the value is returned to ensure that the original value in the cache is not modified.
+        A deep copy of the value is returned to ensure that the original value in the cache is not modified,
+        unless copy_values is False.
         :param key: The key to retrieve from the cache.
         :return: The value associated with the key, or None if the key does not exist.
 
         """
-        async with self._lock:
-            if key in self.cache:
-                self._hits += 1
-                self.cache.move_to_end(key)
-                self._logger.debug("[CACHE HIT] [%s] Key: %s", self.name, key)
-                return copy.deepcopy(self.cache[key])
+        _, value = self._lookup(key)
+        return value
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]]):
+        """
+        Get a value from the cache by its key, or load it with the loader if the key does not exist.
+        If the key is already being loaded by another caller, the result of that loader is awaited instead,
+        so that concurrent misses of the same key run a single loader.
+        A value of None is returned as it is, but it is not cached.
+        :param key: The key to retrieve from the cache.
+        :param loader: An async function without arguments that loads the value of the key.
+        :return: The value associated with the key.
+        """
+
+        async def _load(_keys: list) -> dict:
+            return {key: await loader()}
+
+        return (await self.get_or_load_many([key], _load))[key]
+
+    async def get_or_load_many(self, keys: Iterable, loader: Callable[[list], Awaitable[dict]]) -> dict:
+        """
+        Get the values of the keys from the cache, and load the missing ones with a single call of the loader.
+        The keys that are already being loaded by another caller are not passed to the loader,
+        the result of that other loader is awaited instead.
+        If the loader fails, the error is raised to all the callers awaiting its keys.
+        :param keys: The keys to retrieve from the cache.
+        :param loader: An async function that loads the values of a list of keys, and returns them by key.
+                       The keys without a value (missing or None) are returned as None, and are not cached.
+        :return: The values of the keys, by key.
+        """
+        result: dict = {}
+        pending: dict[Any, asyncio.Future] = {}
+        missing_keys: list = []
+        for key in dict.fromkeys(keys):
+            found, value = self._lookup(key)
+            if found:
+                result[key] = value
+            elif key in self._loading:
+                self._coalesced += 1
+                pending[key] = self._loading[key]
             else:
-                self._misses += 1
-                self._logger.debug("[CACHE MISS] [%s] Key: %s", self.name, key)
-                return None
+                missing_keys.append(key)
+
+        if missing_keys:
+            result.update(await self._load(missing_keys, loader))
+
+        reload_keys: list = []
+        for key, future in pending.items():
+            try:
+                result[key] = self._copy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this caller was cancelled
+                # the caller loading the key was cancelled, load it again
+                reload_keys.append(key)
+        if reload_keys:
+            result.update(await self.get_or_load_many(reload_keys, loader))
+        return result
+
+    async def _load(self, keys: list, loader: Callable[[list], Awaitable[dict]]) -> dict:
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in keys}
+        for future in futures.values():
+            # the error is raised to the loading caller, do not log it when no other caller awaits the future
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._loading.update(futures)
+        result = {}
+        try:
+            loaded = await loader(keys)
+            for key, future in futures.items():
+                value = loaded.get(key)
+                # the value of a key that was deleted (or cleared) while it was loaded may be stale
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+                    if value is not None:
+                        await self.set(key, value)
+                future.set_result(value)
+                result[key] = value
+        except BaseException as e:
+            for key, future in futures.items():
+                if future.done():
+                    continue
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            raise
+        return result
 
     async def set(self, key, value) -> None:
         """
         Set a value in the cache with the given key.
-        A deep copy of the value is stored to ensure that the original value is not modified.
+        A deep copy of the value is stored to ensure that the original value is not modified, unless copy_values is False.
+        The size of the entry is estimated once, when it is set, and the least recently used entries are evicted
+        until the cache is within its max_size and max_bytes.
         :param key: The key to set in the cache.
         :param value: The value to set in the cache.
         """
-        async with self._lock:
-            is_new_key = key not in self.cache
+        value = self._copy(value)
+        entry_bytes = self._sizeof(key, value)
 
-            if not is_new_key:
-                self._overwrites += 1
-                self.cache.move_to_end(key)
-            else:
-                self._sets += 1
+        is_new_key = key not in self.cache
+        if not is_new_key:
+            self._overwrites += 1
+            self.cache.move_to_end(key)
+            self._total_bytes -= self._entry_bytes[key]
+        else:
+            self._sets += 1
 
-            self.cache[key] = copy.deepcopy(value)
-            self._logger.debug("[CACHE SET] [%s] Key: %s", self.name, key)
+        self.cache[key] = value
+        self._entry_bytes[key] = entry_bytes
+        self._total_bytes += entry_bytes
+        if self.ttl is not None:
+            self._expires_at[key] = time.monotonic() + self.ttl
+        self._logger.debug("[CACHE SET] [%s] Key: %s", self.name, key)
 
-            if is_new_key and len(self.cache) > self.max_size:
-                self._evictions += 1
-                evicted_key, _ = self.cache.popitem(last=False)
-                self._logger.debug(f"[CACHE EVICT] [%s] Key: %s", self.name, key)
+        while self.cache and (len(self.cache) > self.max_size or
+                              (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            self._evictions += 1
+            evicted_key = next(iter(self.cache))
+            self._remove(evicted_key)
+            self._logger.debug("[CACHE EVICT] [%s] Key: %s", self.name, evicted_key)
+
+    async def delete(self, key) -> bool:
+        """
+        Delete a key from the cache.
+        The value of the key that is being loaded when it is deleted is not cached, as it may be stale,
+        and the next callers of the key load it again. The loads of the other keys are not affected.
+        :param key: The key to delete from the cache.
+        :return: True if the key was in the cache.
+        """
+        self._loading.pop(key, None)
+        if key not in self.cache:
+            return False
+        self._remove(key)
+        self._logger.debug("[CACHE DELETE] [%s] Key: %s", self.name, key)
+        return True
+
+    def _remove(self, key) -> None:
+        del self.cache[key]
+        self._total_bytes -= self._entry_bytes.pop(key)
+        self._expires_at.pop(key, None)
 
     async def clear(self) -> None:
         """
         Clear the cache.
         """
-        async with self._lock:
-            self.cache.clear()
-            self._logger.info(f"[CACHE CLEARED] [%s] All keys have been cleared.", self.name)
+        self.cache.clear()
+        self._entry_bytes.clear()
+        self._expires_at.clear()
+        self._total_bytes = 0
+        # the values being loaded may be stale, they are not cached
+        self._loading.clear()
+        self._logger.info(f"[CACHE CLEARED] [%s] All keys have been cleared.", self.name)
 
     async def size(self) -> int:
         """
         Get the current size of the cache.
         :return: Number of items in the cache.
         """
-        async with self._lock:
-            return len(self.cache)
+        return len(self.cache)
 
     async def stats(self):
         """
-        Get the cache statistics including hits, misses, hit rate, total requests, sets, overwrites, evictions,
+        Get the cache statistics including hits, misses, hit rate, total requests, sets, overwrites, evictions, expirations,
         :return: A dictionary containing cache statistics.
         """
-        async with self._lock:
-            total_requests = self._hits + self._misses
-            hit_rate = (self._hits / total_requests * 100) if total_requests else 0.0
-            return {
-                "hits": self._hits,
-                "misses": self._misses,
-                "hit_rate_percent": round(hit_rate, 2),
-                "total_get_requests": total_requests,
-                "sets": self._sets,
-                "overwrites": self._overwrites,
-                "evictions": self._evictions,
-                "current_size": len(self.cache),
-                "max_size": self.max_size,
-                "memory_usage_bytes": await self._memory_usage_sync("bytes")
-            }
+        total_requests = self._hits + self._misses
+        hit_rate = (self._hits / total_requests * 100) if total_requests else 0.0
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate_percent": round(hit_rate, 2),
+            "total_get_requests": total_requests,
+            "coalesced_loads": self._coalesced,
+            "sets": self._sets,
+            "overwrites": self._overwrites,
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "current_size": len(self.cache),
+            "max_size": self.max_size,
+            "max_bytes": self.max_bytes,
+            "memory_usage_bytes": self._total_bytes
+        }
 
     async def clear_stats(self):
         """
         Clear the cache statistics.
         :return: True if stats were cleared successfully.
         """
-        async with self._lock:
-            self._hits = 0
-            self._misses = 0
-            self._evictions = 0
-            self._sets = 0
-            self._overwrites = 0
-            self._logger.debug(f"[CACHE STATS CLEARED] [%s] All stats have been cleared.", self.name)
-            return True
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._sets = 0
+        self._overwrites = 0
+        self._expirations = 0
+        self._logger.debug(f"[CACHE STATS CLEARED] [%s] All stats have been cleared.", self.name)
+        return True
 
     async def memory_usage(self, unit: CacheUnit = "bytes") -> int:
         """
         Get the current memory usage.
+        The usage is the sum of the sizes of the entries estimated when they were set,
+        the objects shared by several entries are counted for each of them.
         :param unit: The unit of measurement for memory usage. Can be "bytes", "kb", "mb", or "gb".
         :return: Memory usage in the specified unit.
         """
-        async with self._lock:
-            return await self._memory_usage_sync(unit)
-
-    async def _memory_usage_sync(self, unit: CacheUnit = "bytes") -> int:
-        # Total size in bytes (recursively)
-        _bytes = asizeof.asizeof(self.cache)
+        _bytes = self._total_bytes
         if unit == "bytes":
             return _bytes
         elif unit == "kb":
@@ -145,6 +350,14 @@ class AsyncLRUCache:
             return _bytes // (1024 * 1024 * 1024)
 
 
+def freeze(values: Iterable[T]) -> tuple[T, ...]:
+    """
+    Freeze a collection of values into a tuple, to be stored in a cache that does not copy its values.
+    The tuple cannot be modified by the callers, the values themselves must not be modified either.
+    """
+    return tuple(values)
+
+
 class CacheClearDebouncer:
     """
     Manages debounced cache clearing to prevent frequent redundant operations.
@@ -0,0 +1,107 @@
+import bisect
+import logging
+import re
+import time
+from typing import Optional
+
+from app.vector_search.esco_entities import OccupationEntity
+
+# The codes of the occupations of the unseen economy start with "I"
+UNSEEN_OCCUPATIONS_CODE_PATTERN = re.compile("^I.*")
+
+# There is only one occupation for self-employment
+SELF_EMPLOYMENT_OCCUPATION_CODE = "5221_2"
+
+# A regular expression that matches a literal prefix or code: an optional "^", literal characters (or escaped symbols),
+# then optionally ".*" and "$".
+_PREFIX_PATTERN_REGEX = re.compile(r"(\^?)((?:[^\\.^$*+?()\[\]{}|]|\\[^A-Za-z0-9])*)(\.\*)?(\$?)")
+_ESCAPED_CHAR_REGEX = re.compile(r"\\(.)")
+
+
+def _literal_prefix(pattern: re.Pattern) -> Optional[tuple[str, bool]]:
+    """
+    Get the literal prefix of a pattern that only matches the strings that start with a prefix, or a single string.
+    :return: The (literal, exact) tuple, exact is True if the pattern only matches the literal,
+             or None if the pattern is not a prefix or an exact pattern.
+    """
+    if not isinstance(pattern.pattern, str) or pattern.flags & ~re.UNICODE:
+        return None
+    match = _PREFIX_PATTERN_REGEX.fullmatch(pattern.pattern)
+    if match is None:
+        return None
+    anchored, literal, any_suffix, end = match.groups()
+    literal = _ESCAPED_CHAR_REGEX.sub(r"\1", literal)
+    if not anchored:
+        # an unanchored pattern is searched anywhere in the code, unless it matches every code
+        return ("", False) if not literal else None
+    return literal, bool(end) and not any_suffix
+
+
+class OccupationCodeIndex:
+    """
+    An in-memory index of the occupations of a taxonomy model by their code.
+
+    The exact codes are looked up in a dict, and the prefixes of the codes with a binary search in the sorted codes.
+    Like the database lookup (see OccupationSearchService.get_by_esco_code), there is one occupation per code.
+    The occupations of the unseen economy and of self-employment are computed once, when the index is built.
+    """
+
+    def __init__(self, occupations: list[OccupationEntity]):
+        """
+        :param occupations: The occupations of the taxonomy model, one per occupation, the index keeps a reference to them.
+        """
+        self._by_code: dict[str, OccupationEntity] = {}
+        for occupation in occupations:
+            self._by_code.setdefault(occupation.code, occupation)
+        self._codes = sorted(self._by_code.keys())
+
+        self.unseen_occupations = self._lookup_pattern(UNSEEN_OCCUPATIONS_CODE_PATTERN)
+        self.self_employment_occupations = self.by_code(SELF_EMPLOYMENT_OCCUPATION_CODE)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def by_code(self, code: str) -> tuple[OccupationEntity, ...]:
+        """
+        Get the occupation with the given code, if any.
+        """
+        occupation = self._by_code.get(code)
+        return (occupation,) if occupation is not None else ()
+
+    def by_prefix(self, prefix: str) -> tuple[OccupationEntity, ...]:
+        """
+        Get the occupations whose code starts with the given prefix, sorted by code.
+        """
+        start = bisect.bisect_left(self._codes, prefix)
+        end = bisect.bisect_left(self._codes, prefix + "\U0010FFFF") if prefix else len(self._codes)
+        return tuple(self._by_code[code] for code in self._codes[start:end])
+
+    def lookup(self, code: str | re.Pattern) -> Optional[tuple[OccupationEntity, ...]]:
+        """
+        Get the occupations with the given code, or whose code matches the given prefix pattern (e.g. "^I.*").
+        :param code: The code, or a pattern of a prefix or of an exact code.
+        :return: The occupations, or None if the pattern cannot be answered by the index.
+        """
+        if isinstance(code, str):
+            return self.by_code(code)
+        if code.pattern == UNSEEN_OCCUPATIONS_CODE_PATTERN.pattern and code.flags == UNSEEN_OCCUPATIONS_CODE_PATTERN.flags:
+            return self.unseen_occupations
+        return self._lookup_pattern(code)
+
+    def _lookup_pattern(self, pattern: re.Pattern) -> Optional[tuple[OccupationEntity, ...]]:
+        literal_prefix = _literal_prefix(pattern)
+        if literal_prefix is None:
+            return None
+        literal, exact = literal_prefix
+        return self.by_code(literal) if exact else self.by_prefix(literal)
+
+
+def build_occupation_code_index(*, occupations: list[OccupationEntity], logger: logging.Logger) -> OccupationCodeIndex:
+    """
+    Build the code index of the occupations, and log its size.
+    """
+    start_time = time.time()
+    index = OccupationCodeIndex(occupations)
+    logger.info("Built the code index of %d occupation codes in %.2f seconds (%d unseen, %d self-employment)",
+                len(index), time.time() - start_time, len(index.unseen_occupations), len(index.self_employment_occupations))
+    return index
@@ -0,0 +1,190 @@
+import logging
+import time
+from typing import Any
+
+import numpy as np
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.vector_search.esco_entities import AssociatedSkillEntity
+
+# The fields of the skill documents kept in the skills table
+_SKILL_FIELDS = ["skillId", "modelId", "UUID", "preferredLabel", "description", "scopeNote", "altLabels", "skillType",
+                 "originUUID", "UUIDHistory"]
+
+
+class OccupationSkillGraph:
+    """
+    A compact in-memory graph of the occupation to skill relations of a taxonomy model.
+
+    The skills are stored once in an integer-indexed table, and the relations of the occupations as CSR (compressed sparse row) arrays:
+    the edges of the i-th occupation are the entries indptr[i]:indptr[i+1] of the skill indices, relation types and signalling values
+    arrays. The relation types and the signalling values are stored as small integer codes of their vocabularies.
+    Looking up the skills of an occupation is O(degree).
+    """
+
+    def __init__(self, *,
+                 skills: list[dict[str, Any]],
+                 occupation_ids: list[str],
+                 indptr: np.ndarray,
+                 skill_indices: np.ndarray,
+                 relation_type_codes: np.ndarray,
+                 relation_types: list[str],
+                 signalling_value_codes: np.ndarray,
+                 signalling_values: list[str]):
+        """
+        :param skills: The skills table.
+        :param occupation_ids: The ids of the occupations, in the order of the CSR rows.
+        :param indptr: The (occupations + 1) offsets of the edges of each occupation.
+        :param skill_indices: The index in the skills table of each edge.
+        :param relation_type_codes: The relation type code of each edge.
+        :param relation_types: The vocabulary of the relation type codes.
+        :param signalling_value_codes: The signalling value code of each edge.
+        :param signalling_values: The vocabulary of the signalling value codes.
+        """
+        edges = len(skill_indices)
+        if len(indptr) != len(occupation_ids) + 1 or indptr[0] != 0 or indptr[-1] != edges:
+            raise ValueError("The offsets of the edges do not match the occupations and the edges")
+        if len(relation_type_codes) != edges or len(signalling_value_codes) != edges:
+            raise ValueError("Expected a relation type and a signalling value for every edge")
+
+        self._skills = skills
+        self._occupation_index = {occupation_id: i for i, occupation_id in enumerate(occupation_ids)}
+        self._indptr = indptr
+        self._skill_indices = skill_indices
+        self._relation_type_codes = relation_type_codes
+        self._relation_types = relation_types
+        self._signalling_value_codes = signalling_value_codes
+        self._signalling_values = signalling_values
+
+    @property
+    def occupations_count(self) -> int:
+        return len(self._occupation_index)
+
+    @property
+    def skills_count(self) -> int:
+        return len(self._skills)
+
+    @property
+    def edges_count(self) -> int:
+        return len(self._skill_indices)
+
+    def nbytes(self) -> int:
+        """
+        The approximate memory used by the CSR arrays, the skills table is not included.
+        """
+        return int(self._indptr.nbytes + self._skill_indices.nbytes + self._relation_type_codes.nbytes + self._signalling_value_codes.nbytes)
+
+    def skills_of_occupation(self, occupation_id: str) -> list[AssociatedSkillEntity]:
+        """
+        Get the skills associated with an occupation.
+        An occupation without relations in the taxonomy model has no skills.
+        :param occupation_id: The id of the occupation.
+        :return: A list of AssociatedSkillEntity objects, in the order of the relations.
+        """
+        i = self._occupation_index.get(occupation_id)
+        if i is None:
+            return []
+        start, end = self._indptr[i], self._indptr[i + 1]
+        result = []
+        for skill_index, relation_type_code, signalling_value_code in zip(self._skill_indices[start:end],
+                                                                          self._relation_type_codes[start:end],
+                                                                          self._signalling_value_codes[start:end]):
+            skill = self._skills[skill_index]
+            result.append(AssociatedSkillEntity(
+                id=str(skill.get("skillId", "")),
+                modelId=str(skill.get("modelId", "")),
+                UUID=skill.get("UUID", ""),
+                preferredLabel=skill.get("preferredLabel", ""),
+                description=skill.get("description", ""),
+                scopeNote=skill.get("scopeNote", ""),
+                altLabels=list(skill.get("altLabels", [])),
+                skillType=skill.get("skillType", ""),
+                originUUID=skill.get("originUUID", ""),
+                UUIDHistory=list(skill.get("UUIDHistory", [])),
+                relationType=self._relation_types[relation_type_code],
+                signallingValueLabel=self._signalling_values[signalling_value_code],
+                score=0.0
+            ))
+        return result
+
+
+def _code_of(value: str, vocabulary: list[str], codes: dict[str, int]) -> int:
+    if value not in codes:
+        if len(vocabulary) > np.iinfo(np.int8).max:
+            raise ValueError(f"Too many distinct values to encode: {vocabulary}")
+        codes[value] = len(vocabulary)
+        vocabulary.append(value)
+    return codes[value]
+
+
+async def load_occupation_skill_graph(*,
+                                      relations_collection: AsyncIOMotorCollection,
+                                      skills_collection: AsyncIOMotorCollection,
+                                      model_id: ObjectId,
+                                      logger: logging.Logger,
+                                      batch_size: int = 1000) -> OccupationSkillGraph:
+    """
+    Build the occupation to skill graph of a taxonomy model from the relations and the skills collections.
+    The relations to skills that are not found in the skills collection are ignored, as with the $lookup of the search service.
+    :param relations_collection: The occupation to skill relations collection.
+    :param skills_collection: The skills (embeddings) collection.
+    :param model_id: The taxonomy model id.
+    :param logger: The logger to use.
+    :param batch_size: The cursor batch size.
+    """
+    start_time = time.time()
+
+    # Each skill has up to 3 documents (one for each embedded field), keep the first one
+    skills: list[dict[str, Any]] = []
+    skill_index: dict[ObjectId, int] = {}
+    projection = {field: 1 for field in _SKILL_FIELDS}
+    async for doc in skills_collection.find({"modelId": model_id}, projection).batch_size(batch_size):
+        skill_id = doc.get("skillId")
+        if skill_id in skill_index:
+            continue
+        skill_index[skill_id] = len(skills)
+        skills.append({field: doc[field] for field in _SKILL_FIELDS if field in doc})
+
+    occupation_ids: list[str] = []
+    occupation_index: dict[ObjectId, int] = {}
+    edge_occupations: list[int] = []
+    edge_skills: list[int] = []
+    edge_relation_types: list[int] = []
+    edge_signalling_values: list[int] = []
+    relation_types: list[str] = []
+    relation_type_codes: dict[str, int] = {}
+    signalling_values: list[str] = []
+    signalling_value_codes: dict[str, int] = {}
+    projection = {"requiringOccupationId": 1, "requiredSkillId": 1, "relationType": 1, "signallingValueLabel": 1}
+    async for doc in relations_collection.find({"modelId": model_id}, projection).batch_size(batch_size):
+        i = skill_index.get(doc.get("requiredSkillId"))
+        if i is None:
+            continue
+        occupation_id = doc.get("requiringOccupationId")
+        if occupation_id not in occupation_index:
+            occupation_index[occupation_id] = len(occupation_ids)
+            occupation_ids.append(str(occupation_id))
+        edge_occupations.append(occupation_index[occupation_id])
+        edge_skills.append(i)
+        edge_relation_types.append(_code_of(doc.get("relationType", ""), relation_types, relation_type_codes))
+        edge_signalling_values.append(_code_of(doc.get("signallingValueLabel", ""), signalling_values, signalling_value_codes))
+
+    # Group the edges by occupation, keeping the order of the relations of each occupation
+    occupations_of_edges = np.asarray(edge_occupations, dtype=np.int32)
+    order = np.argsort(occupations_of_edges, kind="stable")
+    indptr = np.zeros(len(occupation_ids) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum(np.bincount(occupations_of_edges, minlength=len(occupation_ids)))
+    graph = OccupationSkillGraph(
+        skills=skills,
+        occupation_ids=occupation_ids,
+        indptr=indptr,
+        skill_indices=np.asarray(edge_skills, dtype=np.int32)[order],
+        relation_type_codes=np.asarray(edge_relation_types, dtype=np.int8)[order],
+        relation_types=relation_types,
+        signalling_value_codes=np.asarray(edge_signalling_values, dtype=np.int8)[order],
+        signalling_values=signalling_values
+    )
+    logger.info("Loaded the occupation to skill graph of %d occupations, %d skills and %d relations in %.2f seconds",
+                graph.occupations_count, graph.skills_count, graph.edges_count, time.time() - start_time)
+    return graph
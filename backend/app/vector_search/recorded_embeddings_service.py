@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import os
+from typing import Literal, Optional, TypeAlias
+
+import numpy as np
+
+from app.vector_search.embeddings_model import EmbeddingService
+
+# The prefixes of the embeddings service names that record or replay the embeddings of a service, see get_embeddings_service
+RECORD_SERVICE_PREFIX = "RECORD:"
+REPLAY_SERVICE_PREFIX = "REPLAY:"
+
+# What a replaying service does with a text that was not recorded:
+#   - fail: raise an EmbeddingNotRecordedError.
+#   - hash: return a deterministic random unit vector derived from the model name and the text.
+ReplayMissPolicy: TypeAlias = Literal["fail", "hash"]
+
+# The recordings start with this magic and the number of dimensions (uint32, little endian), followed by the records
+_MAGIC = b"CMPEMB01"
+_HEADER_SIZE = len(_MAGIC) + 4
+_KEY_SIZE = 16
+
+
+class EmbeddingNotRecordedError(Exception):
+    """
+    Raised when replaying the embedding of a text that was not recorded, and the miss policy is "fail".
+    """
+
+
+def _record_key(model_name: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{model_name}\n{text}".encode("utf-8"), digest_size=_KEY_SIZE).digest()
+
+
+def _record_dtype(dimensions: int) -> np.dtype:
+    return np.dtype([("key", f"V{_KEY_SIZE}"), ("vector", "<f4", (dimensions,))])
+
+
+def hashed_embedding(*, model_name: str, text: str, dimensions: int) -> list[float]:
+    """
+    A deterministic random unit vector, derived from the model name and the text.
+    The same text always gets the same vector, but the vectors of similar texts are not similar.
+    """
+    seed = int.from_bytes(_record_key(model_name, text), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class EmbeddingsRecording:
+    """
+    A compact local file of recorded embeddings, keyed by a hash of the model name and the text.
+
+    The file is a fixed-size header followed by fixed-size records (a 16 bytes key and the float32 vector),
+    so that new embeddings are appended as they are recorded, and the file is loaded with a single read.
+    A record that was partially written (e.g. the process was killed) is ignored, and truncated before appending.
+    """
+
+    def __init__(self, path: str, *, dimensions: Optional[int] = None):
+        """
+        :param path: The path of the file, it is created when the first embedding is recorded.
+        :param dimensions: The number of dimensions of the embeddings, if the file does not exist yet.
+                           Otherwise, it is read from the file.
+        """
+        self._path = path
+        self.dimensions = dimensions
+        # The vectors of the recorded rows, followed by unused rows, see flush()
+        self._vectors: Optional[np.ndarray] = None
+        self._rows: dict[bytes, int] = {}
+        self._pending: dict[bytes, list[float]] = {}
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def _load(self):
+        with open(self._path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+            if len(header) < _HEADER_SIZE or not header.startswith(_MAGIC):
+                raise ValueError(f"{self._path} is not an embeddings recording")
+            dimensions = int.from_bytes(header[len(_MAGIC):], "little")
+            if self.dimensions is not None and self.dimensions != dimensions:
+                raise ValueError(f"Expected embeddings with {self.dimensions} dimensions, {self._path} has {dimensions}")
+            self.dimensions = dimensions
+            dtype = _record_dtype(dimensions)
+            records = np.fromfile(f, dtype=dtype, count=(os.path.getsize(self._path) - _HEADER_SIZE) // dtype.itemsize)
+        self._vectors = records["vector"]
+        self._rows = {key.tobytes(): row for row, key in enumerate(records["key"])}
+
+    def get(self, model_name: str, text: str) -> Optional[list[float]]:
+        key = _record_key(model_name, text)
+        if key in self._pending:
+            return self._pending[key]
+        row = self._rows.get(key)
+        return self._vectors[row].tolist() if row is not None else None
+
+    def add(self, model_name: str, text: str, vector: list[float]):
+        """
+        Add an embedding, it is written to the file by flush().
+        """
+        key = _record_key(model_name, text)
+        if key in self._rows or key in self._pending:
+            return
+        if self.dimensions is None:
+            self.dimensions = len(vector)
+        if len(vector) != self.dimensions:
+            raise ValueError(f"Expected an embedding with {self.dimensions} dimensions, got {len(vector)}")
+        self._pending[key] = vector
+
+    def flush(self):
+        """
+        Append the added embeddings to the file.
+        """
+        if not self._pending:
+            return
+        dtype = _record_dtype(self.dimensions)
+        records = np.empty(len(self._pending), dtype=dtype)
+        records["key"] = [np.void(key) for key in self._pending]
+        records["vector"] = list(self._pending.values())
+
+        if not os.path.exists(self._path) or os.path.getsize(self._path) < _HEADER_SIZE:
+            with open(self._path, "wb") as f:
+                f.write(_MAGIC + self.dimensions.to_bytes(4, "little"))
+        else:
+            # drop a partially written record, so that the new records are aligned
+            size = os.path.getsize(self._path)
+            whole_size = _HEADER_SIZE + (size - _HEADER_SIZE) // dtype.itemsize * dtype.itemsize
+            if whole_size != size:
+                os.truncate(self._path, whole_size)
+        with open(self._path, "ab") as f:
+            records.tofile(f)
+
+        first_row = len(self._rows)
+        rows = first_row + len(records)
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if rows > capacity:
+            # the capacity is doubled, so that recording the embeddings one batch at a time takes a linear time
+            vectors = np.empty((max(rows, 2 * capacity), self.dimensions), dtype=np.float32)
+            if first_row:
+                vectors[:first_row] = self._vectors[:first_row]
+            self._vectors = vectors
+        self._vectors[first_row:rows] = records["vector"]
+        self._rows.update({key: first_row + i for i, key in enumerate(self._pending)})
+        self._pending = {}
+
+
+class RecordingEmbeddingService(EmbeddingService):
+    """
+    An EmbeddingService decorator that records the embeddings of the decorated service into a local file,
+    so that they can be replayed offline (see ReplayEmbeddingService).
+    The embeddings that were already recorded are returned from the recording, without calling the decorated service.
+    """
+
+    def __init__(self, *, embedding_service: EmbeddingService, recording: EmbeddingsRecording):
+        super().__init__(service_name=embedding_service.service_name, model_name=embedding_service.model_name)
+        self._embedding_service = embedding_service
+        self._recording = recording
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        embeddings: list[Optional[list[float]]] = [self._recording.get(self.model_name, text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            new_embeddings = await self._embedding_service.embed_batch([texts[i] for i in missing])
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+                self._recording.add(self.model_name, texts[i], embedding)
+            self._recording.flush()
+        return embeddings
+
+
+class ReplayEmbeddingService(EmbeddingService):
+    """
+    An EmbeddingService that replays the embeddings recorded by a RecordingEmbeddingService, without network access.
+    The texts that were not recorded fail, or get a deterministic hashed vector (see ReplayMissPolicy).
+    """
+
+    def __init__(self, *, service_name: str, model_name: str, recording: EmbeddingsRecording,
+                 miss_policy: ReplayMissPolicy = "fail"):
+        """
+        :param service_name: The name of the recorded service, so that the replayed embeddings are interchangeable with it.
+        :param model_name: The name of the recorded model.
+        :param recording: The recorded embeddings.
+        :param miss_policy: What to do with the texts that were not recorded.
+        """
+        super().__init__(service_name=service_name, model_name=model_name)
+        if miss_policy == "hash" and recording.dimensions is None:
+            raise ValueError("The number of dimensions of the hashed embeddings is unknown, the recording is empty")
+        self._recording = recording
+        self._miss_policy = miss_policy
+        self.misses = 0
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        embeddings = []
+        for text in texts:
+            embedding = self._recording.get(self.model_name, text)
+            if embedding is None:
+                self.misses += 1
+                if self._miss_policy == "fail":
+                    raise EmbeddingNotRecordedError(f"The embedding of the text '{text[:50]}' with the model "
+                                                    f"{self.model_name} was not recorded")
+                embedding = hashed_embedding(model_name=self.model_name, text=text, dimensions=self._recording.dimensions)
+            embeddings.append(embedding)
+        return embeddings
+
+
+def get_recording_settings(logger: logging.Logger) -> tuple[str, ReplayMissPolicy, Optional[int]]:
+    """
+    Get the settings of the recording from the environment variables:
+      - EMBEDDINGS_RECORDING_FILE: The path of the recording (required).
+      - EMBEDDINGS_REPLAY_MISS_POLICY: (optional) fail or hash, default is fail.
+      - EMBEDDINGS_REPLAY_DIMENSIONS: (optional) The number of dimensions of the hashed vectors, if the recording is empty.
+    :return: The path, the miss policy and the number of dimensions.
+    """
+    path = os.getenv("EMBEDDINGS_RECORDING_FILE")
+    if not path:
+        raise ValueError("Environment variable 'EMBEDDINGS_RECORDING_FILE' is not set.")
+    miss_policy = os.getenv("EMBEDDINGS_REPLAY_MISS_POLICY", "fail")
+    if miss_policy not in ("fail", "hash"):
+        raise ValueError(f"Unsupported EMBEDDINGS_REPLAY_MISS_POLICY: {miss_policy}, expected fail or hash")
+    dimensions = os.getenv("EMBEDDINGS_REPLAY_DIMENSIONS")
+    logger.info(f"Using the embeddings recording {path} (miss policy: {miss_policy})")
+    return path, miss_policy, int(dimensions) if dimensions else None
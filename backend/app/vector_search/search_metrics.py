@@ -0,0 +1,167 @@
+import bisect
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Literal
+
+from pydantic import BaseModel
+
+CacheLabel = Literal["hit", "miss", "none"]
+
+# The upper bounds of the latency buckets, in seconds, the last bucket is unbounded
+_LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The search operation (service and method) that the stages are timed for, see SearchMetrics.time_operation
+_operation_ctx_var: contextvars.ContextVar[tuple[str, str]] = contextvars.ContextVar("search_operation",
+                                                                                      default=("none", "none"))
+
+
+class StageLatency(BaseModel):
+    """
+    The latency histogram of a stage of a search operation.
+    """
+
+    service: str
+    """
+    The search service, e.g. OccupationSearchService.
+    """
+
+    operation: str
+    """
+    The public method of the search service, e.g. search or get_by_esco_code.
+    """
+
+    stage: str
+    """
+    The stage of the operation, e.g. embed, db_aggregate or convert, or total for the whole operation.
+    """
+
+    cache: CacheLabel
+    """
+    Whether the stage was answered from a cache ("hit"), had to load the value ("miss"), or is not cached ("none").
+    """
+
+    count: int
+    """
+    The number of times the stage was timed.
+    """
+
+    sum_seconds: float
+    """
+    The total time spent in the stage, in seconds.
+    """
+
+    buckets: dict[str, int]
+    """
+    The cumulative number of timings less than or equal to each upper bound, in seconds ("+Inf" for all the timings).
+    """
+
+
+class _Histogram:
+    def __init__(self, bounds: tuple[float, ...]):
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, bounds: tuple[float, ...], seconds: float):
+        self.counts[bisect.bisect_left(bounds, seconds)] += 1
+        self.sum += seconds
+
+
+class StageTimer:
+    """
+    The timer of a stage, the cache label can be set once it is known, before the stage ends.
+    """
+
+    def __init__(self, cache: CacheLabel):
+        self.cache: CacheLabel = cache
+
+
+class SearchMetrics:
+    """
+    Latency histograms of the stages of the search operations (embedding the queries, querying the database,
+    converting the documents to entities, ...), labelled by service, operation, stage and cache hit or miss.
+
+    The histograms are kept in the process memory, they are exposed by the /search/metrics route
+    (see search_metrics_routes.py). The stages are attributed to the operation that runs them (see time_operation),
+    including the stages of the searches that the operation delegates to other services.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = _LATENCY_BUCKETS):
+        self._bounds = buckets
+        self._histograms: dict[tuple[str, str, str, CacheLabel], _Histogram] = {}
+
+    def observe(self, *, service: str, operation: str, stage: str, seconds: float, cache: CacheLabel = "none"):
+        """
+        Record the latency of a stage.
+        """
+        key = (service, operation, stage, cache)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(self._bounds)
+        histogram.observe(self._bounds, seconds)
+
+    @contextmanager
+    def time_operation(self, *, service: str, operation: str, cache: CacheLabel = "none") -> Iterator[StageTimer]:
+        """
+        Time a search operation as its "total" stage, the stages timed while it runs are attributed to it.
+        An operation that runs within another operation (e.g. the occupation search of the occupation skill search)
+        is timed as a "<service>.<operation>" stage of the outer one.
+        """
+        outer = _operation_ctx_var.get()
+        if outer != ("none", "none"):
+            with self.time_stage(stage=f"{service}.{operation}", cache=cache) as timer:
+                yield timer
+            return
+        token = _operation_ctx_var.set((service, operation))
+        try:
+            with self.time_stage(stage="total", cache=cache) as timer:
+                yield timer
+        finally:
+            _operation_ctx_var.reset(token)
+
+    @contextmanager
+    def time_stage(self, *, stage: str, cache: CacheLabel = "none") -> Iterator[StageTimer]:
+        """
+        Time a stage of the current search operation.
+        The stage is recorded even if it fails, so that the slow failures are visible.
+        """
+        timer = StageTimer(cache)
+        start_time = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            service, operation = _operation_ctx_var.get()
+            self.observe(service=service, operation=operation, stage=stage, seconds=time.perf_counter() - start_time,
+                         cache=timer.cache)
+
+    def snapshot(self) -> list[StageLatency]:
+        """
+        Get the latency histograms of all the stages recorded so far.
+        """
+        labels = [str(bound) for bound in self._bounds] + ["+Inf"]
+        result = []
+        for (service, operation, stage, cache), histogram in sorted(self._histograms.items()):
+            cumulative = 0
+            buckets = {}
+            for label, count in zip(labels, histogram.counts):
+                cumulative += count
+                buckets[label] = cumulative
+            result.append(StageLatency(service=service, operation=operation, stage=stage, cache=cache,
+                                       count=cumulative, sum_seconds=histogram.sum, buckets=buckets))
+        return result
+
+    def reset(self):
+        """
+        Discard all the recorded latencies.
+        """
+        self._histograms.clear()
+
+
+_search_metrics = SearchMetrics()
+
+
+def get_search_metrics() -> SearchMetrics:
+    """
+    Get the search metrics singleton instance.
+    """
+    return _search_metrics
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+from app.vector_search.esco_search_service import get_caches_stats
+from app.vector_search.search_metrics import SearchMetrics, StageLatency, get_search_metrics
+
+
+class SearchMetricsResponse(BaseModel):
+    """
+    The response model for the search metrics endpoint.
+    """
+
+    stages: list[StageLatency]
+    """
+    The latency histograms of the stages of the search operations.
+    """
+
+    caches: dict[str, dict]
+    """
+    The statistics of the caches of the search services, by cache name.
+    """
+
+
+def add_search_metrics_routes(app: APIRouter) -> None:
+    """ Add the search metrics route to the FastAPI app."""
+
+    @app.get("/search/metrics",
+             response_model=SearchMetricsResponse,
+             description="""
+             Returns the latency histograms of the stages of the searches (embedding the queries, querying the database,
+             converting the results, ...) with their cache hits and misses, and the statistics of the search caches.
+             The metrics are those of the instance that answers the request.""",
+             )
+    async def _get_search_metrics(search_metrics: SearchMetrics = Depends(get_search_metrics)):
+        return SearchMetricsResponse(stages=search_metrics.snapshot(), caches=await get_caches_stats())
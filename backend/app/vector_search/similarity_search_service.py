@@ -1,7 +1,9 @@
+import asyncio
+import hashlib
 from abc import ABC, abstractmethod
-from typing import Generic, TypeVar, Mapping, Any
+from typing import Generic, TypeVar, Mapping, Any, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 T = TypeVar("T")
 
@@ -19,6 +21,19 @@ class FilterSpec(BaseModel):
     Search for entities with the given UUIDs.
     """
 
+    _key: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def key(self) -> Optional[str]:
+        """
+        A compact handle of the filter, the same for all the filters with the same set of UUIDs, or None without UUIDs.
+        The search services use it to reuse what they derive from the filter (e.g. the candidate entities) across searches.
+        It is computed once, the UUIDs must not be modified after the filter is used.
+        """
+        if self._key is None and self.UUID:
+            self._key = hashlib.blake2b("\0".join(sorted(set(self.UUID))).encode("utf-8"), digest_size=16).hexdigest()
+        return self._key
+
     def to_query_filter(self) -> Mapping[str, Any]:
         query = {}
         if self.UUID:
@@ -44,3 +59,17 @@ class SimilaritySearchService(ABC, Generic[T]):
         :return: A list of T objects.
         """
         raise NotImplementedError
+
+    async def search_many(self, *, queries: list[str | list[float]], filter_spec: FilterSpec = None, k: int = 5) -> list[list[T]]:
+        """
+        Perform a similarity search for each of the queries.
+        Implementations should override it to embed the queries and run the searches in batches,
+        by default the searches are performed concurrently.
+
+        :param queries: The queries to search for.
+        :param filter_spec: A filter to apply to all the searches.
+        :param k: The number of results to return for each query.
+
+        :return: A list of T objects for each query, in the order of the queries.
+        """
+        return list(await asyncio.gather(*(self.search(query=query, filter_spec=filter_spec, k=k) for query in queries)))
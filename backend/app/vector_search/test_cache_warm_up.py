@@ -0,0 +1,82 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.vector_search.cache_warm_up import CacheWarmUp
+
+
+def _get_search_services(*, warmed_up_occupations: int = 0, error: Exception | None = None):
+    given_occupation_search_service = MagicMock()
+    given_occupation_search_service.get_by_esco_code = AsyncMock(return_value=[])
+    given_occupation_skill_search_service = MagicMock()
+
+    async def _warm_up_caches(*, batch_size: int, on_progress):
+        on_progress(warmed_up_occupations)
+        if error is not None:
+            raise error
+        return warmed_up_occupations
+
+    given_occupation_skill_search_service.warm_up_caches = _warm_up_caches
+    return given_occupation_search_service, given_occupation_skill_search_service
+
+
+class TestCacheWarmUp:
+    def test_instance_is_ready_when_the_warm_up_is_disabled(self):
+        # GIVEN a cache warm-up that is not started
+        given_cache_warm_up = CacheWarmUp()
+
+        # WHEN getting its status
+        actual_status = given_cache_warm_up.status
+
+        # THEN the instance is ready
+        assert actual_status.state == "disabled"
+        assert actual_status.is_ready
+
+    def test_instance_is_not_ready_while_the_warm_up_is_pending(self):
+        # GIVEN a pending cache warm-up
+        given_cache_warm_up = CacheWarmUp()
+        given_cache_warm_up.mark_pending()
+
+        # WHEN getting its status
+        actual_status = given_cache_warm_up.status
+
+        # THEN the instance is not ready
+        assert not actual_status.is_ready
+
+    @pytest.mark.asyncio
+    async def test_warm_up_loads_the_codes_and_the_occupations(self):
+        # GIVEN the search services
+        given_occupation_search_service, given_occupation_skill_search_service = _get_search_services(warmed_up_occupations=3)
+        # AND a cache warm-up
+        given_cache_warm_up = CacheWarmUp()
+
+        # WHEN running the warm-up
+        await given_cache_warm_up.run(occupation_search_service=given_occupation_search_service,
+                                      occupation_skill_search_service=given_occupation_skill_search_service)
+
+        # THEN the occupations looked up by code are loaded
+        assert given_occupation_search_service.get_by_esco_code.await_count == 2
+        # AND the instance is ready with the number of occupations warmed up
+        actual_status = given_cache_warm_up.status
+        assert actual_status.state == "ready"
+        assert actual_status.is_ready
+        assert actual_status.occupations_warmed_up == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_warm_up_is_reported_and_not_raised(self):
+        # GIVEN the search services that fail to warm up the caches
+        given_occupation_search_service, given_occupation_skill_search_service = _get_search_services(
+            warmed_up_occupations=2, error=ValueError("foo"))
+        # AND a cache warm-up
+        given_cache_warm_up = CacheWarmUp()
+
+        # WHEN running the warm-up
+        await given_cache_warm_up.run(occupation_search_service=given_occupation_search_service,
+                                      occupation_skill_search_service=given_occupation_skill_search_service)
+
+        # THEN the warm-up is reported as failed, with its progress
+        actual_status = given_cache_warm_up.status
+        assert actual_status.state == "failed"
+        assert actual_status.occupations_warmed_up == 2
+        # AND the instance is ready, the caches are filled by the requests
+        assert actual_status.is_ready
@@ -0,0 +1,97 @@
+import pytest
+
+from app.vector_search.caching_embeddings_service import CachingEmbeddingService, EmbeddingCacheStore
+from app.vector_search.test_utils import FakeEmbeddingService
+
+
+def _embed_text(text: str) -> list[float]:
+    return [float(len(text)), 1.0]
+
+
+class _InMemoryStore(EmbeddingCacheStore):
+    def __init__(self):
+        self.embeddings: dict[tuple[str, str], list[float]] = {}
+
+    async def get_many(self, *, model_name: str, texts: list[str]) -> dict[str, list[float]]:
+        return {text: self.embeddings[(model_name, text)] for text in texts if (model_name, text) in self.embeddings}
+
+    async def set_many(self, *, model_name: str, embeddings: dict[str, list[float]]) -> None:
+        for text, embedding in embeddings.items():
+            self.embeddings[(model_name, text)] = embedding
+
+
+class _FailingStore(EmbeddingCacheStore):
+    async def get_many(self, *, model_name: str, texts: list[str]) -> dict[str, list[float]]:
+        raise Exception("store is down")
+
+    async def set_many(self, *, model_name: str, embeddings: dict[str, list[float]]) -> None:
+        raise Exception("store is down")
+
+
+class TestCachingEmbeddingService:
+    @pytest.mark.asyncio
+    async def test_embed_batch_embeds_only_the_missing_texts(self):
+        # GIVEN a caching embedding service
+        given_wrapped_service = FakeEmbeddingService(embed_text=_embed_text)
+        given_service = CachingEmbeddingService(embedding_service=given_wrapped_service, max_size=10)
+        # AND some texts were already embedded
+        await given_service.embed_batch(["baker", "cook"])
+
+        # WHEN embedding a batch with cached, new, duplicated and differently spaced texts
+        actual_embeddings = await given_service.embed_batch(["baker", "  software   developer ", "software developer", "cook"])
+
+        # THEN the embeddings are returned in the order of the texts
+        assert actual_embeddings == [[5.0, 1.0], [18.0, 1.0], [18.0, 1.0], [4.0, 1.0]]
+        # AND only the new normalized text is embedded, once
+        assert given_wrapped_service.calls == [["baker", "cook"], ["software developer"]]
+        # AND the stats reflect the hits and misses
+        assert given_service.stats() == {"requests": 6, "memory_hits": 2, "store_hits": 0, "misses": 4, "hit_rate_percent": 33.33}
+        # AND the service keeps the names of the wrapped service
+        assert given_service.service_name == given_wrapped_service.service_name
+        assert given_service.model_name == given_wrapped_service.model_name
+
+    @pytest.mark.asyncio
+    async def test_embed_uses_the_persistent_store(self):
+        # GIVEN a persistent store shared by two caching embedding services (e.g. two workers)
+        given_store = _InMemoryStore()
+        given_wrapped_service = FakeEmbeddingService(embed_text=_embed_text)
+        given_first_service = CachingEmbeddingService(embedding_service=given_wrapped_service, max_size=10, store=given_store)
+        given_second_service = CachingEmbeddingService(embedding_service=given_wrapped_service, max_size=10, store=given_store)
+        # AND a text embedded by the first service
+        await given_first_service.embed("baker")
+
+        # WHEN the second service embeds the same text
+        actual_embedding = await given_second_service.embed("baker")
+
+        # THEN the embedding is found in the store
+        assert actual_embedding == [5.0, 1.0]
+        assert given_wrapped_service.calls == [["baker"]]
+        assert given_second_service.stats()["store_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_embed_when_the_store_fails(self):
+        # GIVEN a caching embedding service with a failing persistent store and no in-memory tier
+        given_wrapped_service = FakeEmbeddingService(embed_text=_embed_text)
+        given_service = CachingEmbeddingService(embedding_service=given_wrapped_service, max_size=0, store=_FailingStore())
+
+        # WHEN embedding a text twice
+        await given_service.embed("baker")
+        actual_embedding = await given_service.embed("baker")
+
+        # THEN the texts are embedded by the wrapped service
+        assert actual_embedding == [5.0, 1.0]
+        assert given_wrapped_service.calls == [["baker"], ["baker"]]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("given_texts", [[""], ["baker", "   "], [None]])
+    async def test_embed_batch_rejects_empty_texts(self, given_texts):
+        # GIVEN a caching embedding service
+        given_wrapped_service = FakeEmbeddingService(embed_text=_embed_text)
+        given_service = CachingEmbeddingService(embedding_service=given_wrapped_service)
+
+        # WHEN embedding empty texts
+        # THEN a ValueError is raised
+        with pytest.raises(ValueError):
+            await given_service.embed_batch(given_texts)
+        # AND the wrapped service is not called
+        assert given_wrapped_service.calls == []
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from app.vector_search.change_stream_watcher import ChangeStreamWatcher, get_changed_values
+
+
+class _GivenStream:
+    """
+    A change stream that returns the given changes and then raises the given error, or waits forever.
+    """
+
+    def __init__(self, changes: list[dict], error: Exception | None):
+        self._changes = changes
+        self._error = error
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for change in self._changes:
+            self.resume_token = change["_id"]
+            yield change
+        if self._error is not None:
+            raise self._error
+        await asyncio.Event().wait()
+
+
+def _get_collection(*streams: _GivenStream) -> MagicMock:
+    given_collection = MagicMock()
+    given_collection.name = "foo"
+    given_collection.watch = MagicMock(side_effect=list(streams))
+    return given_collection
+
+
+async def _run_until_watched(watcher: ChangeStreamWatcher, collection: MagicMock, times: int):
+    task = asyncio.create_task(watcher.run())
+    while collection.watch.call_count < times:
+        await asyncio.sleep(0)
+    # let the last stream deliver its changes
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+class TestChangeStreamWatcher:
+    @pytest.mark.asyncio
+    async def test_reconnect_resumes_after_the_last_handled_change(self):
+        # GIVEN a collection whose first stream fails after a change
+        given_change = {"_id": {"_data": "token-1"}, "operationType": "update"}
+        given_collection = _get_collection(_GivenStream([given_change], ConnectionError("dropped")),
+                                           _GivenStream([], None))
+        # AND a watcher of the collection
+        given_on_change = AsyncMock()
+        given_on_history_lost = AsyncMock()
+        given_watcher = ChangeStreamWatcher(collection=given_collection, on_change=given_on_change,
+                                            on_history_lost=given_on_history_lost, logger=logging.getLogger(),
+                                            min_retry_delay=0)
+
+        # WHEN the watcher runs until it reconnects
+        await _run_until_watched(given_watcher, given_collection, times=2)
+
+        # THEN the change is handled
+        given_on_change.assert_awaited_once_with(given_change)
+        # AND the reconnect resumes after the change
+        assert given_collection.watch.call_args_list[0].kwargs["resume_after"] is None
+        assert given_collection.watch.call_args_list[1].kwargs["resume_after"] == {"_data": "token-1"}
+        # AND the history is not lost
+        given_on_history_lost.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_history_is_lost_when_the_stream_cannot_be_resumed(self):
+        # GIVEN a collection whose first stream fails after a change, and that cannot be resumed after it
+        given_change = {"_id": {"_data": "token-1"}, "operationType": "update"}
+        given_collection = _get_collection(_GivenStream([given_change], ConnectionError("dropped")),
+                                           _GivenStream([], OperationFailure("history lost", code=286)),
+                                           _GivenStream([], None))
+        # AND a watcher of the collection
+        given_on_history_lost = AsyncMock()
+        given_watcher = ChangeStreamWatcher(collection=given_collection, on_change=AsyncMock(),
+                                            on_history_lost=given_on_history_lost, logger=logging.getLogger(),
+                                            min_retry_delay=0)
+
+        # WHEN the watcher runs until it reconnects twice
+        await _run_until_watched(given_watcher, given_collection, times=3)
+
+        # THEN the history is reported as lost
+        given_on_history_lost.assert_awaited_once()
+        # AND the collection is watched again from the current time
+        assert given_collection.watch.call_args_list[2].kwargs["resume_after"] is None
+
+
+@pytest.mark.parametrize("given_change, expected_values", [
+    ({"fullDocument": {"foo": 1}, "fullDocumentBeforeChange": {"foo": 2}}, {1, 2}),
+    ({"fullDocument": {"foo": 1}}, {1}),
+    ({"fullDocumentBeforeChange": {"foo": 2}, "fullDocument": None}, {2}),
+    ({"documentKey": {"_id": 3}}, None),
+    ({"operationType": "insert", "fullDocument": {"foo": 1}}, {1}),
+    ({"operationType": "update", "fullDocument": {"foo": 1}, "fullDocumentBeforeChange": {"foo": 2},
+      "updateDescription": {"updatedFields": {"foo": 1}}}, {1, 2}),
+    ({"operationType": "update", "fullDocument": {"foo": 1},
+      "updateDescription": {"updatedFields": {"foo": 1}}}, None),
+    ({"operationType": "update", "fullDocument": {"foo": 1},
+      "updateDescription": {"updatedFields": {}, "removedFields": ["foo.bar"]}}, None),
+    ({"operationType": "update", "fullDocument": {"foo": 1},
+      "updateDescription": {"updatedFields": {"foobar": 3}, "removedFields": ["baz"]}}, {1}),
+    ({"operationType": "replace", "fullDocument": {"foo": 1}}, None),
+    ({"operationType": "replace", "fullDocument": {"foo": 1}, "fullDocumentBeforeChange": {"foo": 2}}, {1, 2}),
+], ids=["before and after", "after only", "before only", "unknown", "insert", "update with pre-image",
+        "update of the field without pre-image", "update of a sub field without pre-image",
+        "update of other fields without pre-image", "replace without pre-image", "replace with pre-image"])
+def test_get_changed_values(given_change: dict, expected_values: set | None):
+    # GIVEN a change document
+
+    # WHEN getting the changed values of a field
+    actual_values = get_changed_values(given_change, "foo")
+
+    # THEN the values before and after the change are returned
+    assert actual_values == expected_values
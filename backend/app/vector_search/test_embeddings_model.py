@@ -0,0 +1,102 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+
+from app.vector_search.embeddings_model import CoalescingEmbeddingService
+from app.vector_search.test_utils import FakeEmbeddingService
+
+
+class TestCoalescingEmbeddingService:
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_coalesced(self):
+        # GIVEN a coalescing embedding service
+        given_wrapped_service = FakeEmbeddingService()
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service, window_seconds=0.01, max_batch_size=10)
+
+        # WHEN embedding texts concurrently
+        actual_embeddings = await asyncio.gather(given_service.embed("a"),
+                                                 given_service.embed_batch(["bb", "ccc"]),
+                                                 given_service.embed("dddd"))
+
+        # THEN the texts are embedded in a single batch
+        assert given_wrapped_service.calls == [["a", "bb", "ccc", "dddd"]]
+        # AND each caller gets the embeddings of its texts, in order
+        assert actual_embeddings == [[1.0], [[2.0], [3.0]], [4.0]]
+
+    @pytest.mark.asyncio
+    async def test_requests_are_split_by_the_max_batch_size(self):
+        # GIVEN a coalescing embedding service with a small maximum batch size
+        given_wrapped_service = FakeEmbeddingService()
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service, window_seconds=10, max_batch_size=2)
+
+        # WHEN embedding more texts concurrently than the maximum batch size
+        actual_embeddings = await asyncio.wait_for(asyncio.gather(*(given_service.embed(text) for text in ["a", "bb", "ccc", "dddd"])),
+                                                   timeout=1)
+
+        # THEN the full batches are sent without waiting for the window to end
+        assert given_wrapped_service.calls == [["a", "bb"], ["ccc", "dddd"]]
+        assert actual_embeddings == [[1.0], [2.0], [3.0], [4.0]]
+
+    @pytest.mark.asyncio
+    async def test_a_failing_text_fails_only_its_caller(self):
+        # GIVEN a coalescing embedding service that fails to embed a text
+        given_wrapped_service = FakeEmbeddingService(failing_texts={"bad"})
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service, window_seconds=0.01, max_batch_size=10)
+
+        # WHEN embedding texts concurrently with the failing one
+        actual_results = await asyncio.gather(given_service.embed("a"),
+                                              given_service.embed("bad"),
+                                              given_service.embed("ccc"),
+                                              return_exceptions=True)
+
+        # THEN the other callers get their embeddings
+        assert actual_results[0] == [1.0]
+        assert actual_results[2] == [3.0]
+        # AND the caller of the failing text gets the error
+        assert isinstance(actual_results[1], Exception)
+
+    @pytest.mark.asyncio
+    async def test_a_failing_service_fails_the_whole_batch(self):
+        # GIVEN a coalescing embedding service of an unavailable service
+        given_error = ServiceUnavailable("service is down")
+        given_wrapped_service = FakeEmbeddingService(error=given_error)
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service, window_seconds=0.01, max_batch_size=10)
+
+        # WHEN embedding texts concurrently
+        actual_results = await asyncio.gather(*(given_service.embed(text) for text in ["a", "bb", "ccc"]),
+                                              return_exceptions=True)
+
+        # THEN all the callers get the error
+        assert actual_results == [given_error] * 3
+        # AND the texts are not embedded one by one
+        assert given_wrapped_service.calls == [["a", "bb", "ccc"]]
+
+    @pytest.mark.asyncio
+    async def test_missing_embeddings_fail_the_callers(self):
+        # GIVEN a coalescing embedding service of a service that returns fewer embeddings than texts
+        given_wrapped_service = FakeEmbeddingService()
+        given_wrapped_service.embed_batch = AsyncMock(return_value=[[1.0]])
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service, window_seconds=0.01, max_batch_size=10)
+
+        # WHEN embedding texts concurrently
+        actual_results = await asyncio.wait_for(asyncio.gather(given_service.embed("a"), given_service.embed("bb"),
+                                                               return_exceptions=True),
+                                                timeout=1)
+
+        # THEN all the callers get an error, instead of waiting forever
+        assert all(isinstance(result, RuntimeError) for result in actual_results)
+
+    @pytest.mark.asyncio
+    async def test_embed_batch_rejects_empty_texts(self):
+        # GIVEN a coalescing embedding service
+        given_wrapped_service = FakeEmbeddingService()
+        given_service = CoalescingEmbeddingService(embedding_service=given_wrapped_service)
+
+        # WHEN embedding an empty text
+        # THEN a ValueError is raised
+        with pytest.raises(ValueError):
+            await given_service.embed_batch(["a", " "])
+        # AND the wrapped service is not called
+        assert given_wrapped_service.calls == []
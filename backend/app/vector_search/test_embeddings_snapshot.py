@@ -0,0 +1,103 @@
+import logging
+import os
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app.vector_search.embeddings_snapshot import write_embeddings_snapshot, load_embeddings_snapshot, read_snapshot_manifest
+
+_GROUP_FIELDS = {"_id": "$occupationId",
+                 "occupationId": {"$first": "$occupationId"},
+                 "modelId": {"$first": "$modelId"},
+                 "UUID": {"$first": "$UUID"},
+                 "preferredLabel": {"$first": "$preferredLabel"},
+                 "score": {"$max": "$score"}}
+
+
+async def _insert_embeddings(collection, model_id: ObjectId, given_entities: dict[str, list[list[float]]]) -> None:
+    documents = []
+    for uuid, vectors in given_entities.items():
+        occupation_id = ObjectId()
+        for field, vector in zip(["preferredLabel", "description", "altLabels"], vectors):
+            documents.append({"modelId": model_id,
+                              "occupationId": occupation_id,
+                              "UUID": uuid,
+                              "preferredLabel": f"label of {uuid}",
+                              "embedded_field": field,
+                              "embedded_text": f"{field} of {uuid}",
+                              "embedding": vector})
+    await collection.insert_many(documents)
+
+
+class TestEmbeddingsSnapshot:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("given_dtype", ["float32", "float16"])
+    async def test_write_and_load_snapshot(self, in_memory_taxonomy_database, tmp_path, given_dtype):
+        # GIVEN the embeddings of two taxonomy models in the occupations collection
+        given_model_id = ObjectId()
+        given_collection = in_memory_taxonomy_database.get_collection("occupationmodelsembeddings")
+        await _insert_embeddings(given_collection, given_model_id, {
+            "uuid-1": [[1, 0, 0], [0.5, 0.5, 0]],
+            "uuid-2": [[0, 2, 0]],
+            "uuid-3": [[0, 0, 1], [0, 0.1, 1], [0.1, 0, 1]],
+        })
+        await _insert_embeddings(given_collection, ObjectId(), {"uuid-of-other-model": [[1, 0, 0]]})
+
+        # WHEN writing a snapshot of the model
+        manifest = await write_embeddings_snapshot(snapshot_dir=str(tmp_path),
+                                                   model_id=str(given_model_id),
+                                                   collections={"occupationId": given_collection},
+                                                   embedding_key="embedding",
+                                                   dtype=given_dtype,
+                                                   embeddings_service={"service_name": "foo", "model_name": "bar"},
+                                                   logger=logging.getLogger())
+
+        # THEN the manifest describes the embeddings of the model only
+        assert manifest.collections[given_collection.name].rows == 6
+        assert manifest.collections[given_collection.name].entities == 3
+        assert manifest.collections[given_collection.name].dimensions == 3
+        assert read_snapshot_manifest(snapshot_dir=str(tmp_path), model_id=str(given_model_id)) == manifest
+        # AND no temporary directory is left behind
+        assert os.listdir(tmp_path) == [str(given_model_id)]
+
+        # AND WHEN loading the snapshot
+        actual_index = load_embeddings_snapshot(snapshot_dir=str(tmp_path),
+                                                model_id=str(given_model_id),
+                                                collection_name=given_collection.name,
+                                                group_fields=_GROUP_FIELDS,
+                                                logger=logging.getLogger())
+
+        # THEN the index answers the searches like the original embeddings
+        actual_results = actual_index.search([0, 1, 0], k=3)
+        assert [entity["UUID"] for entity, _ in actual_results] == ["uuid-2", "uuid-1", "uuid-3"]
+        assert actual_results[0][1] == pytest.approx(1.0, abs=1e-3)
+        # AND the entity documents are built from the group fields
+        assert set(actual_results[0][0].keys()) == {"_id", "occupationId", "modelId", "UUID", "preferredLabel"}
+        assert actual_results[0][0]["modelId"] == given_model_id
+        # AND the embeddings are memory-mapped rather than copied into the process memory
+        assert isinstance(actual_index._embeddings, np.memmap)
+
+    @pytest.mark.asyncio
+    async def test_load_snapshot_of_another_model_fails(self, in_memory_taxonomy_database, tmp_path):
+        # GIVEN a snapshot of a taxonomy model
+        given_model_id = ObjectId()
+        given_collection = in_memory_taxonomy_database.get_collection("occupationmodelsembeddings")
+        await _insert_embeddings(given_collection, given_model_id, {"uuid-1": [[1, 0, 0]]})
+        await write_embeddings_snapshot(snapshot_dir=str(tmp_path),
+                                        model_id=str(given_model_id),
+                                        collections={"occupationId": given_collection},
+                                        embedding_key="embedding",
+                                        logger=logging.getLogger())
+        # AND the snapshot is (wrongly) placed under the directory of another model
+        given_other_model_id = str(ObjectId())
+        os.rename(tmp_path / str(given_model_id), tmp_path / given_other_model_id)
+
+        # WHEN loading the snapshot of the other model
+        # THEN a ValueError is raised
+        with pytest.raises(ValueError):
+            load_embeddings_snapshot(snapshot_dir=str(tmp_path),
+                                     model_id=given_other_model_id,
+                                     collection_name=given_collection.name,
+                                     group_fields=_GROUP_FIELDS,
+                                     logger=logging.getLogger())
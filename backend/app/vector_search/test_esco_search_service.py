@@ -0,0 +1,574 @@
+import re
+from unittest.mock import MagicMock, AsyncMock
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app.vector_search.embeddings_model import EmbeddingService
+from app.vector_search.esco_entities import OccupationEntity
+from app.vector_search.esco_search_service import OccupationSearchService, VectorSearchConfig, OccupationSkillSearchService, \
+    clear_caches, _skills_of_occupation_cache
+from app.vector_search.local_embedding_index import LocalEmbeddingIndex
+from app.vector_search.search_metrics import get_search_metrics
+from app.vector_search.similarity_search_service import FilterSpec
+from app.vector_search.test_utils import FakeEmbeddingService
+
+_VECTORS = {"baker": [1.0, 0.0, 0.0], "cook": [0.0, 1.0, 0.0], "driver": [0.0, 0.0, 1.0]}
+
+
+def _get_occupation_search_service(embedding_service: EmbeddingService) -> OccupationSearchService:
+    given_model_id = ObjectId()
+    service = OccupationSearchService(MagicMock(),
+                                      embedding_service,
+                                      VectorSearchConfig(collection_name="occupations", index_name="index", embedding_key="embedding"),
+                                      str(given_model_id))
+    entities = [{"occupationId": ObjectId(), "modelId": given_model_id, "UUID": f"uuid-{label}", "preferredLabel": label}
+                for label in _VECTORS.keys()]
+    service._local_index = LocalEmbeddingIndex(embeddings=np.asarray(list(_VECTORS.values()), dtype=np.float32),
+                                               row_entities=np.arange(len(entities)),
+                                               entities=entities)
+    return service
+
+
+class TestSearchMany:
+    @pytest.mark.asyncio
+    async def test_search_many_embeds_the_queries_once(self):
+        # GIVEN an occupation search service with a local index
+        given_embedding_service = FakeEmbeddingService(embed_text=_VECTORS.__getitem__)
+        given_service = _get_occupation_search_service(given_embedding_service)
+
+        # WHEN searching for many text, empty and vector queries
+        actual_results = await given_service.search_many(queries=["cook", " ", [0.0, 0.0, 1.0], " baker "], k=1)
+
+        # THEN the text queries are embedded in a single batch
+        assert given_embedding_service.calls == [["cook", "baker"]]
+        # AND the results of each query are returned in the order of the queries
+        assert [[entity.preferredLabel for entity in result] for result in actual_results] == [["cook"], [], ["driver"], ["baker"]]
+
+    @pytest.mark.asyncio
+    async def test_search_many_returns_the_same_results_as_search(self):
+        # GIVEN an occupation search service with a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        # AND a filter
+        given_filter_spec = FilterSpec(UUID=["uuid-cook", "uuid-driver"])
+
+        # WHEN searching for many queries
+        actual_results = await given_service.search_many(queries=["baker", "cook"], filter_spec=given_filter_spec, k=2)
+
+        # THEN the results are the same as searching for each query (not from the cached results)
+        await clear_caches()
+        for query, actual_result in zip(["baker", "cook"], actual_results):
+            assert actual_result == await given_service.search(query=query, filter_spec=given_filter_spec, k=2)
+
+
+class TestSearchResultsCache:
+    @pytest.mark.asyncio
+    async def test_repeated_search_is_answered_from_the_cache(self):
+        # GIVEN an occupation search service with a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service._search_local_index = MagicMock(wraps=given_service._search_local_index)
+        # AND the results of a search
+        given_results = await given_service.search(query=[1.0, 0.0, 0.0], k=2)
+
+        # WHEN searching for a vector that differs only by floating point noise
+        actual_results = await given_service.search(query=[1.0, 1e-7, 0.0], k=2)
+
+        # THEN the results are the same
+        assert actual_results == given_results
+        # AND the index is searched only once
+        assert given_service._search_local_index.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_search_with_another_filter_or_k_is_not_answered_from_the_cache(self):
+        # GIVEN an occupation search service with a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        # AND the results of a search
+        await given_service.search(query="baker", k=1)
+
+        # WHEN searching for the same query with a filter and with another k
+        actual_filtered_results = await given_service.search(query="baker", filter_spec=FilterSpec(UUID=["uuid-cook"]), k=1)
+        actual_more_results = await given_service.search(query="baker", k=2)
+
+        # THEN the results of each search are returned
+        assert [entity.preferredLabel for entity in actual_filtered_results] == ["cook"]
+        assert len(actual_more_results) == 2
+
+    @pytest.mark.asyncio
+    async def test_filtered_search_without_local_index_loads_the_entities_of_the_filter_once(self, mocker):
+        # GIVEN an occupation search service without a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_index = given_service._local_index
+        given_service._local_index = None
+        given_service.collection.aggregate = MagicMock()
+        # AND the embeddings of the entities of a filter are loaded from the database
+        given_load = mocker.patch("app.vector_search.esco_search_service.load_local_embedding_index",
+                                  AsyncMock(return_value=given_index))
+        await clear_caches()
+
+        # WHEN searching twice with filters of the same UUIDs in a different order
+        actual_results = await given_service.search(query="baker", filter_spec=FilterSpec(UUID=["uuid-cook", "uuid-baker"]), k=1)
+        actual_other_results = await given_service.search(query="cook", filter_spec=FilterSpec(UUID=["uuid-baker", "uuid-cook"]), k=1)
+
+        # THEN the results are searched in memory
+        assert [entity.preferredLabel for entity in actual_results] == ["baker"]
+        assert [entity.preferredLabel for entity in actual_other_results] == ["cook"]
+        # AND the embeddings of the filter are loaded once
+        given_load.assert_awaited_once()
+        assert given_load.call_args.kwargs["uuids"] == ["uuid-cook", "uuid-baker"]
+        # AND the vector search is not used
+        given_service.collection.aggregate.assert_not_called()
+
+
+class TestGetByEscoCode:
+    @pytest.mark.asyncio
+    async def test_get_by_esco_code_with_the_code_index_does_not_query_the_database(self):
+        # GIVEN an occupation search service
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service.collection.aggregate = MagicMock()
+        # AND the code index of its occupations
+        given_occupations = [OccupationEntity(id=str(ObjectId()), UUID=f"uuid-{code}", code=code, preferredLabel=code,
+                                              altLabels=[], description="", score=0.0) for code in ["I1", "I2", "1234"]]
+
+        async def _stream_all(**_kwargs):
+            for occupation in given_occupations:
+                yield occupation
+
+        given_service.stream_all = _stream_all
+        await given_service.enable_code_index()
+
+        # WHEN getting the occupations by a code prefix and by an exact code
+        actual_unseen = await given_service.get_by_esco_code(code=re.compile("^I.*"))
+        actual_occupations = await given_service.get_by_esco_code(code="1234")
+
+        # THEN the occupations are returned from the index
+        assert [occupation.code for occupation in actual_unseen] == ["I1", "I2"]
+        assert [occupation.code for occupation in actual_occupations] == ["1234"]
+        # AND the database is not queried
+        given_service.collection.aggregate.assert_not_called()
+
+
+class TestSearchMetrics:
+    @pytest.mark.asyncio
+    async def test_search_records_the_latency_of_its_stages(self):
+        # GIVEN an occupation search service with a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        await clear_caches()
+        get_search_metrics().reset()
+
+        # WHEN searching the same query twice
+        await given_service.search(query="cook", k=1)
+        await given_service.search(query="cook", k=1)
+
+        # THEN the stages of the searches are recorded, with the cache miss and the cache hit
+        actual_stages = {(stage.operation, stage.stage, stage.cache): stage.count for stage in get_search_metrics().snapshot()
+                         if stage.service == "OccupationSearchService"}
+        assert actual_stages == {
+            ("search", "total", "none"): 2,
+            ("search", "embed", "none"): 2,
+            ("search", "results_cache", "miss"): 1,
+            ("search", "results_cache", "hit"): 1,
+            ("search", "local_index", "none"): 1,
+            ("search", "convert", "none"): 1,
+        }
+
+
+class TestSearchLean:
+    @pytest.mark.asyncio
+    async def test_search_lean_materializes_the_same_entities_as_search(self):
+        # GIVEN an occupation search service with a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+
+        # WHEN searching for lean results
+        actual_results = await given_service.search_lean(query="cook", k=2)
+
+        # THEN the lean results have the fields of the entities returned by search
+        expected_results = await given_service.search(query="cook", k=2)
+        assert [(result.id, result.UUID, result.preferredLabel, result.score) for result in actual_results] == \
+               [(entity.id, entity.UUID, entity.preferredLabel, entity.score) for entity in expected_results]
+        # AND the full entities are the same
+        assert [result.entity for result in actual_results] == expected_results
+
+    @pytest.mark.asyncio
+    async def test_search_lean_groups_only_the_requested_fields(self):
+        # GIVEN an occupation search service without a local index
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service._local_index = None
+        # AND the database returns a result
+        given_aggregate = MagicMock()
+        given_aggregate.return_value.to_list = AsyncMock(return_value=[
+            {"_id": "foo", "occupationId": "foo", "UUID": "uuid-foo", "preferredLabel": "foo", "code": "1234", "score": 0.9}])
+        given_service.collection.aggregate = given_aggregate
+
+        # WHEN searching for lean results with the code field
+        actual_results = await given_service.search_lean(query="cook", k=1, fields=["code"])
+
+        # THEN only the lean fields and the requested fields are grouped
+        actual_group = given_aggregate.call_args.args[0][2]["$group"]
+        assert set(actual_group.keys()) == {"_id", "modelId", "UUID", "preferredLabel", "occupationId", "code", "score"}
+        # AND the lean result is returned
+        assert [(result.id, result.score) for result in actual_results] == [("foo", 0.9)]
+        assert actual_results[0].entity.code == "1234"
+
+
+
+class TestLabelSearch:
+    @pytest.mark.asyncio
+    async def test_exact_label_matches_are_answered_without_an_embedding(self):
+        # GIVEN an occupation search service with a local index
+        given_embedding_service = FakeEmbeddingService(embed_text=_VECTORS.__getitem__)
+        given_service = _get_occupation_search_service(given_embedding_service)
+        # AND a label index of the occupations, except the driver
+        given_service.stream_all = lambda: _stream([given_service._to_entity(entity) for entity in given_service._local_index.entities
+                                                    if entity["preferredLabel"] != "driver"])
+        await given_service.enable_label_index(mode="exact")
+
+        # WHEN embedding and searching a label and another query
+        given_queries = await given_service.embed_queries(["Baker", "driver"])
+        actual_results = await given_service.search_many(queries=given_queries, k=2)
+
+        # THEN only the other query is embedded
+        assert given_embedding_service.calls == [["driver"]]
+        # AND the label is answered by the occupation with the label
+        assert [(entity.preferredLabel, entity.score) for entity in actual_results[0]] == [("baker", 1.0)]
+        # AND the other query is answered by the vector search
+        assert [entity.preferredLabel for entity in actual_results[1]][0] == "driver"
+
+    @pytest.mark.asyncio
+    async def test_hybrid_label_matches_are_followed_by_the_vector_search_results(self):
+        # GIVEN an occupation search service with a local index and a hybrid label index
+        given_embedding_service = FakeEmbeddingService(embed_text=_VECTORS.__getitem__)
+        given_service = _get_occupation_search_service(given_embedding_service)
+        given_service.stream_all = lambda: _stream([given_service._to_entity(entity) for entity in given_service._local_index.entities])
+        await given_service.enable_label_index(mode="hybrid")
+
+        # WHEN searching a label with more results than the label matches
+        actual_results = await given_service.search(query="baker", k=2)
+
+        # THEN the occupation with the label is first, followed by the other results of the vector search
+        assert [entity.preferredLabel for entity in actual_results][0] == "baker"
+        assert len(actual_results) == 2
+        assert len({entity.UUID for entity in actual_results}) == 2
+
+
+async def _stream(items: list):
+    for item in items:
+        yield item
+
+
+def _get_occupation(model_id: ObjectId) -> OccupationEntity:
+    return OccupationEntity(id=str(ObjectId()), modelId=str(model_id), UUID=str(ObjectId()), code="1234",
+                            preferredLabel="label", description="", altLabels=[], score=0.0)
+
+
+def _get_relation(occupation: OccupationEntity, skill_uuid: str) -> dict:
+    return {"requiringOccupationId": ObjectId(occupation.id),
+            "requiredSkillId": ObjectId(),
+            "modelId": ObjectId(occupation.modelId),
+            "relationType": "essential",
+            "signallingValueLabel": "",
+            "skills": {"skillId": ObjectId(), "UUID": skill_uuid, "preferredLabel": skill_uuid, "skillType": "skill/competence"}}
+
+
+class TestRetrieveSkillsOfOccupations:
+    @pytest.mark.asyncio
+    async def test_skills_of_occupations_are_retrieved_in_bulk(self):
+        # GIVEN an occupation skill search service
+        await clear_caches()
+        given_model_id = ObjectId()
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(embed_text=_VECTORS.__getitem__), str(given_model_id))
+        # AND three occupations, the last one without skills
+        given_occupations = [_get_occupation(given_model_id) for _ in range(3)]
+        # AND the relations collection returns the skills of the occupations
+        given_relations = [_get_relation(given_occupations[0], "skill-1"),
+                           _get_relation(given_occupations[1], "skill-2"),
+                           _get_relation(given_occupations[0], "skill-3")]
+        given_service.relations_collection = MagicMock()
+        given_service.relations_collection.aggregate.return_value.to_list = AsyncMock(return_value=given_relations)
+
+        # WHEN retrieving the skills of the occupations twice
+        actual_first_result = await given_service._retrieve_skills_of_occupations(given_occupations)
+        actual_second_result = await given_service._retrieve_skills_of_occupations(given_occupations)
+
+        # THEN the skills are split per occupation
+        assert [[skill.UUID for skill in entity.associated_skills] for entity in actual_first_result] == \
+               [["skill-1", "skill-3"], ["skill-2"], []]
+        assert [entity.occupation for entity in actual_first_result] == given_occupations
+        # AND the database is queried once for all the occupations
+        given_service.relations_collection.aggregate.assert_called_once()
+        actual_match = given_service.relations_collection.aggregate.call_args.args[0][0]["$match"]
+        assert actual_match["requiringOccupationId"] == {"$in": [ObjectId(occupation.id) for occupation in given_occupations]}
+        # AND the second retrieval is answered from the cache
+        assert actual_second_result == actual_first_result
+        await clear_caches()
+
+
+class TestSkillGraphRebuild:
+    @pytest.mark.asyncio
+    async def test_the_graph_is_rebuilt_once_after_a_burst_of_relation_changes(self, mocker):
+        # GIVEN an occupation skill search service that answers the skills from a graph
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(), str(ObjectId()))
+        given_service._skill_graph = MagicMock()
+        # AND the rebuilt graph
+        given_rebuilt_graph = MagicMock()
+        given_load = mocker.patch("app.vector_search.esco_search_service._get_occupation_skill_graph",
+                                  AsyncMock(return_value=given_rebuilt_graph))
+        mocker.patch("app.vector_search.esco_search_service._SKILL_GRAPH_REBUILD_DELAY", 0)
+
+        # WHEN the relations change several times in a row
+        for _ in range(3):
+            given_service._schedule_skill_graph_rebuild()
+        await given_service._skill_graph_rebuild_task
+
+        # THEN the graph is rebuilt once
+        given_load.assert_awaited_once()
+        assert given_load.call_args.kwargs["rebuild"] is True
+        # AND the searches use the rebuilt graph
+        assert given_service._skill_graph is given_rebuilt_graph
+
+    @pytest.mark.asyncio
+    async def test_the_previous_graph_is_kept_when_the_rebuild_fails(self, mocker):
+        # GIVEN an occupation skill search service that answers the skills from a graph
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(), str(ObjectId()))
+        given_graph = MagicMock()
+        given_service._skill_graph = given_graph
+        # AND the graph cannot be rebuilt
+        mocker.patch("app.vector_search.esco_search_service._get_occupation_skill_graph",
+                     AsyncMock(side_effect=Exception("database is down")))
+        mocker.patch("app.vector_search.esco_search_service._SKILL_GRAPH_REBUILD_DELAY", 0)
+
+        # WHEN the relations change
+        given_service._schedule_skill_graph_rebuild()
+        await given_service._skill_graph_rebuild_task
+
+        # THEN the previous graph is still used
+        assert given_service._skill_graph is given_graph
+
+
+def _get_coded_occupations(codes: list[str]) -> list[OccupationEntity]:
+    return [OccupationEntity(id=str(ObjectId()), UUID=f"uuid-{code}", code=code, preferredLabel=code,
+                             altLabels=[], description="", score=0.0) for code in codes]
+
+
+class TestIndexesRebuild:
+    @pytest.mark.asyncio
+    async def test_the_code_index_is_rebuilt_once_after_a_burst_of_occupation_changes(self, mocker):
+        # GIVEN an occupation search service with the code index of its occupations
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service.stream_all = MagicMock(return_value=_stream(_get_coded_occupations(["I1", "1234"])))
+        await given_service.enable_code_index()
+        mocker.patch("app.vector_search.esco_search_service._INDEXES_REBUILD_DELAY", 0)
+        # AND since then an unseen occupation was added, and an occupation was removed
+        given_service.stream_all.return_value = _stream(_get_coded_occupations(["I1", "I2"]))
+
+        # WHEN the occupations change several times in a row
+        for _ in range(3):
+            given_service._schedule_indexes_rebuild()
+        await given_service._indexes_rebuild_task
+
+        # THEN the code index is rebuilt once
+        assert given_service.stream_all.call_count == 2
+        # AND the lookups are answered from the rebuilt index
+        actual_unseen = await given_service.get_by_esco_code(code=re.compile("^I.*"))
+        assert [occupation.code for occupation in actual_unseen] == ["I1", "I2"]
+        assert given_service._code_index.lookup("1234") == ()
+
+    @pytest.mark.asyncio
+    async def test_the_previous_code_index_is_kept_when_the_rebuild_fails(self, mocker):
+        # GIVEN an occupation search service with the code index of its occupations
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service.stream_all = MagicMock(return_value=_stream(_get_coded_occupations(["I1", "1234"])))
+        await given_service.enable_code_index()
+        given_code_index = given_service._code_index
+        mocker.patch("app.vector_search.esco_search_service._INDEXES_REBUILD_DELAY", 0)
+        # AND the occupations cannot be streamed anymore
+        given_service.stream_all.side_effect = Exception("database is down")
+
+        # WHEN the occupations change
+        given_service._schedule_indexes_rebuild()
+        await given_service._indexes_rebuild_task
+
+        # THEN the previous code index is still used
+        assert given_service._code_index is given_code_index
+
+    @pytest.mark.asyncio
+    async def test_the_label_index_is_rebuilt_after_the_occupations_change(self, mocker):
+        # GIVEN an occupation search service with a local index
+        given_embedding_service = FakeEmbeddingService(embed_text=_VECTORS.__getitem__)
+        given_service = _get_occupation_search_service(given_embedding_service)
+        given_occupations = [given_service._to_entity(entity) for entity in given_service._local_index.entities]
+        # AND a label index of the occupations
+        given_service.stream_all = MagicMock(return_value=_stream(given_occupations))
+        await given_service.enable_label_index(mode="exact")
+        mocker.patch("app.vector_search.esco_search_service._INDEXES_REBUILD_DELAY", 0)
+        # AND since then the baker was renamed
+        given_service.stream_all.return_value = _stream(
+            [occupation.model_copy(update={"preferredLabel": "pastry chef"}) if occupation.preferredLabel == "baker" else occupation
+             for occupation in given_occupations])
+
+        # WHEN the occupations change
+        given_service._schedule_indexes_rebuild()
+        await given_service._indexes_rebuild_task
+
+        # THEN the new label is matched without an embedding
+        actual_results = await given_service.search_many(queries=["Pastry chef"], k=1)
+        assert [entity.preferredLabel for entity in actual_results[0]] == ["pastry chef"]
+        assert given_embedding_service.calls == []
+        # AND the old label is not matched anymore
+        assert given_service._label_index.match("baker", k=1) == []
+
+    @pytest.mark.asyncio
+    async def test_the_local_index_is_reloaded_from_the_database_after_the_collection_changes(self, mocker):
+        # GIVEN an occupation search service with a local index
+        given_embedding_service = FakeEmbeddingService(embed_text=_VECTORS.__getitem__)
+        given_service = _get_occupation_search_service(given_embedding_service)
+        await given_service.search(query="driver", k=1)
+        mocker.patch("app.vector_search.esco_search_service._INDEXES_REBUILD_DELAY", 0)
+        # AND since then the driver was deleted
+        given_entities = [entity for entity in given_service._local_index.entities if entity["preferredLabel"] != "driver"]
+        given_reloaded_index = LocalEmbeddingIndex(embeddings=np.asarray([_VECTORS["baker"], _VECTORS["cook"]], dtype=np.float32),
+                                                   row_entities=np.arange(len(given_entities)),
+                                                   entities=given_entities)
+        given_load = mocker.patch("app.vector_search.esco_search_service.load_local_embedding_index",
+                                  AsyncMock(return_value=given_reloaded_index))
+        given_load_snapshot = mocker.patch("app.vector_search.esco_search_service.load_embeddings_snapshot")
+
+        # WHEN the collection changes
+        given_service._schedule_indexes_rebuild()
+        await given_service._indexes_rebuild_task
+
+        # THEN the index is reloaded from the database, not from the snapshot
+        given_load.assert_awaited_once()
+        given_load_snapshot.assert_not_called()
+        assert given_service._local_index is given_reloaded_index
+        # AND the deleted occupation is not found anymore, even by a search that was cached before the change
+        actual_results = await given_service.search(query="driver", k=1)
+        assert [entity.preferredLabel for entity in actual_results] != ["driver"]
+        await clear_caches()
+
+    @pytest.mark.asyncio
+    async def test_nothing_is_rebuilt_without_indexes(self):
+        # GIVEN an occupation search service without in-memory indexes
+        given_service = _get_occupation_search_service(FakeEmbeddingService(embed_text=_VECTORS.__getitem__))
+        given_service._local_index = None
+
+        # WHEN the occupations change
+        given_service._schedule_indexes_rebuild()
+
+        # THEN no rebuild is scheduled
+        assert given_service._indexes_rebuild_task is None
+
+
+class TestSkillsOfOccupationCacheBudget:
+    def test_the_skills_of_the_complete_model_fit_in_the_cache(self):
+        # GIVEN the skills of the complete esco model, 3035 occupations with approx 130k associated skills
+        given_skills_counts = [130_000 // 3035] * 3035
+        given_skills_counts[0] += 130_000 - sum(given_skills_counts)
+
+        # WHEN estimating the size of the skills of every occupation in the cache
+        actual_bytes = sum(_skills_of_occupation_cache._sizeof(str(i), range(count)) for i, count in enumerate(given_skills_counts))
+
+        # THEN they fit in the cache, so that warming it up does not evict its own entries
+        assert len(given_skills_counts) <= _skills_of_occupation_cache.max_size
+        assert actual_bytes <= _skills_of_occupation_cache.max_bytes
+        # AND the estimate is close to the measured 223 MB
+        assert actual_bytes == pytest.approx(223 * 1024 * 1024, rel=0.1)
+
+
+class _AsyncCursor:
+    def __init__(self, docs: list[dict]):
+        self._docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestWarmUpCaches:
+    @pytest.mark.asyncio
+    async def test_skills_of_all_the_occupations_are_loaded_in_batches(self):
+        # GIVEN an occupation skill search service
+        await clear_caches()
+        given_model_id = ObjectId()
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(embed_text=_VECTORS.__getitem__), str(given_model_id))
+        # AND three occupations in the occupations collection
+        given_occupations = [_get_occupation(given_model_id) for _ in range(3)]
+        given_service.occupation_search_service.collection = MagicMock()
+        given_service.occupation_search_service.collection.aggregate.return_value = _AsyncCursor(
+            [{"occupationId": ObjectId(occupation.id), "modelId": given_model_id, "UUID": occupation.UUID}
+             for occupation in given_occupations])
+        # AND the relations collection
+        given_service.relations_collection = MagicMock()
+        given_service.relations_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+
+        # WHEN warming up the caches in batches of two occupations
+        actual_progress: list[int] = []
+        actual_count = await given_service.warm_up_caches(batch_size=2, on_progress=actual_progress.append)
+
+        # THEN all the occupations are warmed up
+        assert actual_count == 3
+        assert actual_progress == [2, 3]
+        # AND the skills are retrieved with one aggregation per batch
+        assert given_service.relations_collection.aggregate.call_count == 2
+        # AND the skills are then answered from the cache
+        await given_service._retrieve_skills_of_occupations(given_occupations)
+        assert given_service.relations_collection.aggregate.call_count == 2
+        await clear_caches()
+
+    @pytest.mark.asyncio
+    async def test_only_the_occupations_still_cached_are_counted(self, mocker, caplog):
+        # GIVEN an occupation skill search service
+        await clear_caches()
+        given_model_id = ObjectId()
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(), str(given_model_id))
+        # AND three occupations in the occupations collection
+        given_occupations = [_get_occupation(given_model_id) for _ in range(3)]
+        given_service.occupation_search_service.collection = MagicMock()
+        given_service.occupation_search_service.collection.aggregate.return_value = _AsyncCursor(
+            [{"occupationId": ObjectId(occupation.id), "modelId": given_model_id, "UUID": occupation.UUID}
+             for occupation in given_occupations])
+        given_service.relations_collection = MagicMock()
+        given_service.relations_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+        # AND a skills cache that can only hold the skills of two occupations
+        mocker.patch.object(_skills_of_occupation_cache, "max_size", 2)
+
+        # WHEN warming up the caches
+        with caplog.at_level("WARNING"):
+            actual_count = await given_service.warm_up_caches(batch_size=1)
+
+        # THEN only the occupations whose skills are still in the cache are counted
+        assert actual_count == 2
+        # AND a warning is logged about the evictions
+        assert "evicted 1 entries from the skills cache" in caplog.text
+        await clear_caches()
+
+    @pytest.mark.asyncio
+    async def test_skills_of_a_batch_are_loaded_in_chunks(self, mocker):
+        # GIVEN an occupation skill search service
+        await clear_caches()
+        given_model_id = ObjectId()
+        given_service = OccupationSkillSearchService(MagicMock(), FakeEmbeddingService(), str(given_model_id))
+        # AND three occupations in the occupations collection
+        given_occupations = [_get_occupation(given_model_id) for _ in range(3)]
+        given_service.occupation_search_service.collection = MagicMock()
+        given_service.occupation_search_service.collection.aggregate.return_value = _AsyncCursor(
+            [{"occupationId": ObjectId(occupation.id), "modelId": given_model_id, "UUID": occupation.UUID}
+             for occupation in given_occupations])
+        given_service.relations_collection = MagicMock()
+        given_service.relations_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+        # AND chunks of two occupations
+        mocker.patch("app.vector_search.esco_search_service._WARM_UP_CHUNK_SIZE", 2)
+
+        # WHEN warming up the caches in a single batch
+        actual_count = await given_service.warm_up_caches(batch_size=10)
+
+        # THEN all the occupations are warmed up
+        assert actual_count == 3
+        # AND the skills are retrieved with one aggregation per chunk
+        assert given_service.relations_collection.aggregate.call_count == 2
+        await clear_caches()
@@ -0,0 +1,72 @@
+from bson import ObjectId
+
+from app.vector_search.esco_entities import OccupationEntity
+from app.vector_search.label_index import LabelIndex
+
+
+def _get_occupation(preferred_label: str, alt_labels: list[str]) -> OccupationEntity:
+    return OccupationEntity(id=str(ObjectId()), UUID=f"uuid-{preferred_label}", code="1234", preferredLabel=preferred_label,
+                            altLabels=alt_labels, description="", score=0.0)
+
+
+_OCCUPATIONS = [
+    _get_occupation("baker", ["bread maker"]),
+    _get_occupation("pastry baker", ["pastry chef"]),
+    _get_occupation("cook", ["chef"]),
+    _get_occupation("baker assistant", []),
+]
+
+
+class TestLabelIndex:
+    def test_match_returns_the_exact_matches_then_the_near_exact_matches(self):
+        # GIVEN a label index of some occupations
+        given_index = LabelIndex(_OCCUPATIONS)
+
+        # WHEN matching a query that is a label, with a different case and whitespace
+        actual_matches = given_index.match("  Baker ", k=5)
+
+        # THEN the occupation with the label is returned first with a score of 1
+        assert (actual_matches[0][0].preferredLabel, actual_matches[0][1]) == ("baker", 1.0)
+        # AND the occupations with a label containing the query follow, with a lower score
+        assert {occupation.preferredLabel for occupation, _ in actual_matches[1:]} == {"pastry baker", "baker assistant"}
+        assert all(0 < score < 1 for _, score in actual_matches[1:])
+
+    def test_match_of_an_alternative_label(self):
+        # GIVEN a label index of some occupations
+        given_index = LabelIndex(_OCCUPATIONS)
+
+        # WHEN matching an alternative label
+        actual_matches = given_index.match("bread maker", k=1)
+
+        # THEN the occupation with the alternative label is returned
+        assert [occupation.preferredLabel for occupation, _ in actual_matches] == ["baker"]
+
+    def test_match_without_an_exact_match_returns_nothing(self):
+        # GIVEN a label index of some occupations
+        given_index = LabelIndex(_OCCUPATIONS)
+
+        # WHEN matching a query that is not a label, although some labels contain its words
+        actual_matches = given_index.match("bakers of bread", k=5)
+
+        # THEN nothing is returned
+        assert actual_matches == []
+
+    def test_match_only_considers_the_given_uuids(self):
+        # GIVEN a label index of some occupations
+        given_index = LabelIndex(_OCCUPATIONS)
+
+        # WHEN matching a label, filtering the occupation with the label out
+        actual_matches = given_index.match("baker", k=5, uuids=["uuid-pastry baker"])
+
+        # THEN nothing is returned
+        assert actual_matches == []
+
+    def test_bm25_ranks_the_labels_with_the_rarest_words_first(self):
+        # GIVEN a label index of some occupations
+        given_index = LabelIndex(_OCCUPATIONS)
+
+        # WHEN scoring a query with BM25
+        actual_results = given_index.bm25("pastry chef at a baker", k=2)
+
+        # THEN the occupation with the label matching the most and rarest words is first
+        assert actual_results[0][0].preferredLabel == "pastry baker"
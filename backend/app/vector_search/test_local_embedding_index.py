@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from app.vector_search.local_embedding_index import LocalEmbeddingIndex
+
+
+def _get_index(given_vectors: dict[str, list[list[float]]]) -> LocalEmbeddingIndex:
+    # each entity has one or more rows (e.g. preferredLabel, description, altLabels)
+    embeddings = []
+    row_entities = []
+    entities = []
+    for idx, (uuid, vectors) in enumerate(given_vectors.items()):
+        entities.append({"UUID": uuid, "preferredLabel": f"label of {uuid}"})
+        for vector in vectors:
+            embeddings.append(np.asarray(vector, dtype=np.float32) / np.linalg.norm(vector))
+            row_entities.append(idx)
+    return LocalEmbeddingIndex(embeddings=np.asarray(embeddings), row_entities=np.asarray(row_entities), entities=entities)
+
+
+class TestLocalEmbeddingIndex:
+    def test_search_returns_the_best_entities_sorted_by_score(self):
+        # GIVEN an index with three entities, the second entity has two rows
+        given_index = _get_index({
+            "uuid-1": [[1, 0, 0]],
+            "uuid-2": [[0, 1, 0], [0.9, 0.1, 0]],
+            "uuid-3": [[0, 0, 1]],
+        })
+
+        # WHEN searching for a vector close to the first axis
+        actual_results = given_index.search([1, 0, 0], k=2)
+
+        # THEN the entities are returned in descending score order
+        assert [entity["UUID"] for entity, _ in actual_results] == ["uuid-1", "uuid-2"]
+        # AND the score of an entity is the best score of its rows, normalized like atlas ((1 + cosine) / 2)
+        assert actual_results[0][1] == pytest.approx(1.0)
+        expected_second_score = (1 + 0.9 / np.linalg.norm([0.9, 0.1, 0])) / 2
+        assert actual_results[1][1] == pytest.approx(expected_second_score, rel=1e-5)
+
+    def test_search_with_uuids_only_considers_the_given_entities(self):
+        # GIVEN an index with three entities
+        given_index = _get_index({
+            "uuid-1": [[1, 0, 0]],
+            "uuid-2": [[0, 1, 0]],
+            "uuid-3": [[0, 0, 1]],
+        })
+
+        # WHEN searching with a filter on some UUIDs (including an unknown one)
+        actual_results = given_index.search([1, 0, 0], k=5, uuids=["uuid-3", "uuid-2", "unknown"])
+
+        # THEN only the filtered entities are returned
+        assert {entity["UUID"] for entity, _ in actual_results} == {"uuid-2", "uuid-3"}
+
+    def test_search_many_answers_every_query(self):
+        # GIVEN an index with three entities
+        given_index = _get_index({
+            "uuid-1": [[1, 0, 0]],
+            "uuid-2": [[0, 1, 0]],
+            "uuid-3": [[0, 0, 1]],
+        })
+
+        # WHEN searching for several queries at once
+        actual_results = given_index.search_many(np.asarray([[0, 0, 2], [0, 3, 0]]), k=1)
+
+        # THEN each query gets its own results
+        assert [[entity["UUID"] for entity, _ in results] for results in actual_results] == [["uuid-3"], ["uuid-2"]]
+
+    def test_rows_not_grouped_by_entity_raise_an_error(self):
+        # GIVEN rows that are not sorted by entity
+        given_embeddings = np.eye(3, dtype=np.float32)
+        given_row_entities = np.asarray([0, 1, 0])
+
+        # WHEN creating the index
+        # THEN a ValueError is raised
+        with pytest.raises(ValueError):
+            LocalEmbeddingIndex(embeddings=given_embeddings, row_entities=given_row_entities,
+                                entities=[{"UUID": "uuid-1"}, {"UUID": "uuid-2"}])
+
+    @pytest.mark.parametrize("given_dtype", ["float16", "int8"])
+    def test_quantized_index_returns_the_results_of_the_float32_index(self, given_dtype):
+        # GIVEN a float32 index of random entities, some with several rows
+        rng = np.random.default_rng(42)
+        given_index = _get_index({f"uuid-{i}": rng.normal(size=(1 + i % 3, 16)).tolist() for i in range(200)})
+        # AND the index quantized to the given type
+        actual_index = given_index.quantize(given_dtype)
+
+        # WHEN searching both indexes
+        given_queries = rng.normal(size=(5, 16))
+        expected_results = given_index.search_many(given_queries, k=5, uuids=[f"uuid-{i}" for i in range(0, 200, 2)])
+        actual_results = actual_index.search_many(given_queries, k=5, uuids=[f"uuid-{i}" for i in range(0, 200, 2)])
+
+        # THEN the quantized index uses less memory
+        assert actual_index.nbytes < given_index.nbytes
+        # AND the best candidates are re-scored exactly, so the results and their scores are the same
+        for expected, actual in zip(expected_results, actual_results):
+            assert [entity["UUID"] for entity, _ in actual] == [entity["UUID"] for entity, _ in expected]
+            assert [score for _, score in actual] == pytest.approx([score for _, score in expected], abs=1e-6)
+
+    @pytest.mark.parametrize("given_dtype", ["float32", "float16", "int8"])
+    def test_search_of_a_few_entities_returns_the_results_of_the_full_search(self, given_dtype, mocker):
+        # GIVEN an index of random entities, some with several rows, stored with the given type
+        rng = np.random.default_rng(42)
+        given_index = _get_index({f"uuid-{i}": rng.normal(size=(1 + i % 3, 16)).tolist() for i in range(200)}).quantize(given_dtype)
+        # AND a filter of a few entities
+        given_uuids = [f"uuid-{i}" for i in range(0, 200, 7)]
+        given_queries = rng.normal(size=(5, 16))
+        # AND the results of the search scoring all the entities
+        mocker.patch("app.vector_search.local_embedding_index._MAX_FILTERED_ENTITIES", 0)
+        expected_results = given_index.search_many(given_queries, k=5, uuids=given_uuids)
+        mocker.stopall()
+
+        # WHEN searching the few entities only, twice with the same key of the filter
+        actual_results = given_index.search_many(given_queries, k=5, uuids=given_uuids, uuids_key="foo")
+        actual_cached_results = given_index.search_many(given_queries, k=5, uuids=given_uuids, uuids_key="foo")
+
+        # THEN the results and their scores are the same as the full search
+        for expected, actual, actual_cached in zip(expected_results, actual_results, actual_cached_results):
+            assert [entity["UUID"] for entity, _ in actual] == [entity["UUID"] for entity, _ in expected]
+            assert [score for _, score in actual] == pytest.approx([score for _, score in expected], abs=1e-6)
+            assert actual_cached == actual
@@ -0,0 +1,296 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import numpy as np
+import pytest
+
+from app.vector_search.lru_cache import AsyncLRUCache, freeze, items_sizeof, nbytes_sizeof
+
+
+class TestAsyncLRUCache:
+    @pytest.mark.asyncio
+    async def test_values_are_copied_by_default(self):
+        # GIVEN a cache with a value
+        given_cache = AsyncLRUCache(max_size=2)
+        given_value = [{"foo": "bar"}]
+        await given_cache.set("key", given_value)
+
+        # WHEN the original value and the returned value are modified
+        given_value[0]["foo"] = "changed"
+        actual_value = await given_cache.get("key")
+        actual_value.append("changed")
+
+        # THEN the cached value is not modified
+        assert await given_cache.get("key") == [{"foo": "bar"}]
+
+    @pytest.mark.asyncio
+    async def test_values_are_not_copied_when_copy_values_is_false(self):
+        # GIVEN a cache that does not copy its values
+        given_cache = AsyncLRUCache(max_size=2, copy_values=False)
+        # AND a frozen value
+        given_value = freeze([{"foo": "bar"}])
+        await given_cache.set("key", given_value)
+
+        # WHEN getting the value
+        actual_value = await given_cache.get("key")
+
+        # THEN the cached value itself is returned
+        assert actual_value is given_value
+        assert isinstance(actual_value, tuple)
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_is_evicted(self):
+        # GIVEN a full cache
+        given_cache = AsyncLRUCache(max_size=2, copy_values=False)
+        await given_cache.set("a", 1)
+        await given_cache.set("b", 2)
+        # AND the first key was used recently
+        await given_cache.get("a")
+
+        # WHEN setting a new key
+        await given_cache.set("c", 3)
+
+        # THEN the least recently used key is evicted
+        assert await given_cache.get("b") is None
+        assert await given_cache.get("a") == 1
+        assert await given_cache.get("c") == 3
+        assert (await given_cache.stats())["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_is_evicted_when_over_max_bytes(self):
+        # GIVEN a cache bounded by bytes, that can hold two small entries but not a large one besides them
+        given_small_value = freeze(["x" * 10])
+        given_large_value = freeze(["x" * 10_000])
+        given_cache = AsyncLRUCache(max_size=100, copy_values=False, max_bytes=8_000)
+        await given_cache.set("a", given_small_value)
+        await given_cache.set("b", given_small_value)
+        # AND the first key was used recently
+        await given_cache.get("a")
+
+        # WHEN setting a small new key
+        await given_cache.set("c", given_small_value)
+
+        # THEN nothing is evicted
+        assert await given_cache.size() == 3
+
+        # AND WHEN setting a value larger than the budget
+        await given_cache.set("d", given_large_value)
+
+        # THEN all the entries are evicted, including the large value itself
+        assert await given_cache.size() == 0
+        assert await given_cache.memory_usage() == 0
+
+    @pytest.mark.asyncio
+    async def test_the_size_of_the_entries_is_estimated_with_the_given_sizeof(self):
+        # GIVEN a cache bounded by bytes, that estimates the size of an entry from its number of items
+        given_cache = AsyncLRUCache(max_size=100, copy_values=False, max_bytes=3 * (256 + 1000),
+                                    sizeof=items_sizeof(1000))
+
+        # WHEN setting entries of one and two items
+        await given_cache.set("a", freeze(["x"]))
+        await given_cache.set("b", freeze(["y", "z"]))
+
+        # THEN the memory usage is the estimated size of the entries
+        assert await given_cache.memory_usage() == (256 + 1000) + (256 + 2000)
+
+        # AND WHEN setting another entry of two items
+        await given_cache.set("c", freeze(["x", "y"]))
+
+        # THEN the least recently used entries are evicted to stay within the budget
+        assert await given_cache.get("a") is None
+        assert await given_cache.get("b") is None
+        assert await given_cache.memory_usage() == 256 + 2000
+
+    @pytest.mark.asyncio
+    async def test_nbytes_sizeof_uses_the_size_of_the_arrays(self):
+        # GIVEN a cache of arrays
+        given_cache = AsyncLRUCache(max_size=10, copy_values=False, sizeof=nbytes_sizeof)
+
+        # WHEN setting an array
+        await given_cache.set("a", np.zeros(768, dtype=np.float32))
+
+        # THEN the memory usage is the size of the array
+        assert await given_cache.memory_usage() == 256 + 768 * 4
+
+    @pytest.mark.asyncio
+    async def test_memory_usage_is_the_running_total_of_the_entries(self):
+        # GIVEN a cache with some entries
+        given_cache = AsyncLRUCache(max_size=2, copy_values=False)
+        await given_cache.set("a", freeze(["x" * 100]))
+        await given_cache.set("b", freeze(["y" * 100]))
+        given_usage = await given_cache.memory_usage()
+        assert given_usage > 0
+
+        # WHEN overwriting an entry and evicting another one
+        await given_cache.set("a", freeze(["x" * 1000]))
+        await given_cache.set("c", freeze(["z" * 100]))
+
+        # THEN the memory usage accounts only for the entries in the cache
+        actual_stats = await given_cache.stats()
+        assert actual_stats["memory_usage_bytes"] == await given_cache.memory_usage()
+        assert actual_stats["memory_usage_bytes"] > given_usage
+        assert actual_stats["current_size"] == 2
+
+        # AND WHEN clearing the cache
+        await given_cache.clear()
+
+        # THEN the memory usage is zero
+        assert await given_cache.memory_usage() == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_run_a_single_loader(self):
+        # GIVEN a cache
+        given_cache = AsyncLRUCache(max_size=2, copy_values=False)
+        # AND a slow loader
+        given_loader_calls = 0
+        given_release = asyncio.Event()
+
+        async def given_loader():
+            nonlocal given_loader_calls
+            given_loader_calls += 1
+            await given_release.wait()
+            return freeze([1, 2])
+
+        # WHEN the same missing key is loaded concurrently
+        given_tasks = [asyncio.create_task(given_cache.get_or_load("key", given_loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        given_release.set()
+        actual_values = await asyncio.gather(*given_tasks)
+
+        # THEN the loader runs once
+        assert given_loader_calls == 1
+        # AND all the callers get its value
+        assert all(actual_value == (1, 2) for actual_value in actual_values)
+        # AND the value is cached
+        assert await given_cache.get("key") == (1, 2)
+        assert (await given_cache.stats())["coalesced_loads"] == 4
+
+    @pytest.mark.asyncio
+    async def test_get_or_load_many_loads_only_the_missing_keys(self):
+        # GIVEN a cache with a value
+        given_cache = AsyncLRUCache(max_size=10, copy_values=False)
+        await given_cache.set("a", 1)
+        # AND a loader
+        given_loader_calls: list[list[str]] = []
+
+        async def given_loader(keys: list[str]) -> dict:
+            given_loader_calls.append(keys)
+            return {key: key.upper() for key in keys if key != "missing"}
+
+        # WHEN getting cached and missing keys
+        actual_values = await given_cache.get_or_load_many(["a", "b", "c", "missing"], given_loader)
+
+        # THEN the missing keys are loaded with a single call
+        assert given_loader_calls == [["b", "c", "missing"]]
+        assert actual_values == {"a": 1, "b": "B", "c": "C", "missing": None}
+        # AND the keys without a value are not cached
+        assert await given_cache.size() == 3
+
+    @pytest.mark.asyncio
+    async def test_loader_error_is_raised_to_all_callers(self):
+        # GIVEN a cache
+        given_cache = AsyncLRUCache(max_size=2)
+        # AND a loader that fails
+        given_release = asyncio.Event()
+
+        async def given_loader():
+            await given_release.wait()
+            raise ValueError("foo")
+
+        # WHEN the same missing key is loaded concurrently
+        given_tasks = [asyncio.create_task(given_cache.get_or_load("key", given_loader)) for _ in range(2)]
+        await asyncio.sleep(0)
+        given_release.set()
+        actual_results = await asyncio.gather(*given_tasks, return_exceptions=True)
+
+        # THEN the error is raised to all the callers
+        assert all(isinstance(actual_result, ValueError) for actual_result in actual_results)
+        # AND the next caller runs the loader again
+        assert await given_cache.get_or_load("key", AsyncMock(return_value="bar")) == "bar"
+
+    @pytest.mark.asyncio
+    async def test_value_loaded_before_a_clear_is_not_cached(self):
+        # GIVEN a cache
+        given_cache = AsyncLRUCache(max_size=2)
+        # AND a loader that is running when the cache is cleared
+        given_release = asyncio.Event()
+
+        async def given_loader():
+            await given_release.wait()
+            return "stale"
+
+        given_task = asyncio.create_task(given_cache.get_or_load("key", given_loader))
+        await asyncio.sleep(0)
+        await given_cache.clear()
+        given_release.set()
+
+        # WHEN the loader completes
+        actual_value = await given_task
+
+        # THEN its value is returned to the caller, but not cached
+        assert actual_value == "stale"
+        assert await given_cache.get("key") is None
+
+    @pytest.mark.asyncio
+    async def test_delete_evicts_only_the_given_key(self):
+        # GIVEN a cache with two entries
+        given_cache = AsyncLRUCache(max_size=2)
+        await given_cache.set("foo", "foo value")
+        await given_cache.set("bar", "bar value")
+        given_memory_usage = await given_cache.memory_usage()
+
+        # WHEN one of the keys is deleted
+        actual_deleted = await given_cache.delete("foo")
+
+        # THEN the key is no longer cached
+        assert actual_deleted is True
+        assert await given_cache.get("foo") is None
+        # AND the other key is still cached
+        assert await given_cache.get("bar") == "bar value"
+        # AND the memory usage is reduced
+        assert await given_cache.memory_usage() < given_memory_usage
+        # AND deleting a key that is not cached reports it
+        assert await given_cache.delete("foo") is False
+
+    @pytest.mark.asyncio
+    async def test_delete_while_loading_discards_only_the_value_of_the_deleted_key(self):
+        # GIVEN a cache
+        given_cache = AsyncLRUCache(max_size=10, copy_values=False)
+        # AND a loader of two keys that is running when one of them is deleted
+        given_release = asyncio.Event()
+
+        async def given_loader(keys: list) -> dict:
+            await given_release.wait()
+            return {key: f"{key} value" for key in keys}
+
+        given_task = asyncio.create_task(given_cache.get_or_load_many(["foo", "bar"], given_loader))
+        await asyncio.sleep(0)
+        await given_cache.delete("foo")
+        given_release.set()
+
+        # WHEN the loader completes
+        actual_values = await given_task
+
+        # THEN the values are returned to the caller
+        assert actual_values == {"foo": "foo value", "bar": "bar value"}
+        # AND only the value of the key that was not deleted is cached
+        assert await given_cache.get("foo") is None
+        assert await given_cache.get("bar") == "bar value"
+
+    @pytest.mark.asyncio
+    async def test_entries_expire_after_the_ttl(self):
+        # GIVEN a cache with a ttl
+        given_cache = AsyncLRUCache(max_size=2, ttl=0.05)
+        await given_cache.set("foo", "foo value")
+        assert await given_cache.get("foo") == "foo value"
+
+        # WHEN the ttl has passed
+        await asyncio.sleep(0.1)
+
+        # THEN the entry is a miss
+        assert await given_cache.get("foo") is None
+        # AND it is no longer accounted for
+        actual_stats = await given_cache.stats()
+        assert actual_stats["expirations"] == 1
+        assert actual_stats["current_size"] == 0
+        assert actual_stats["memory_usage_bytes"] == 0
@@ -0,0 +1,68 @@
+import re
+
+import pytest
+from bson import ObjectId
+
+from app.vector_search.esco_entities import OccupationEntity
+from app.vector_search.occupation_code_index import OccupationCodeIndex, SELF_EMPLOYMENT_OCCUPATION_CODE, \
+    UNSEEN_OCCUPATIONS_CODE_PATTERN
+
+
+def _get_occupation(code: str) -> OccupationEntity:
+    return OccupationEntity(id=str(ObjectId()), UUID=f"uuid-{code}", code=code, preferredLabel=f"label of {code}",
+                            altLabels=[], description="", score=0.0)
+
+
+_CODES = ["I41_0", "I41_1", "I5", "5221_2", "5221_1", "5221", "J1", "H9"]
+
+
+class TestOccupationCodeIndex:
+    @pytest.mark.parametrize("given_code", [
+        "5221",
+        "unknown",
+        re.compile("^I.*"),
+        re.compile("^I41"),
+        re.compile("^5221.*$"),
+        re.compile("^5221_2$"),
+        re.compile(r"^5221\_"),
+        re.compile(".*"),
+    ], ids=["exact code", "unknown code", "unseen prefix", "prefix", "prefix with end", "exact pattern", "escaped prefix",
+            "all codes"])
+    def test_lookup_returns_the_occupations_that_match_the_code(self, given_code):
+        # GIVEN an index of occupations
+        given_index = OccupationCodeIndex([_get_occupation(code) for code in _CODES])
+
+        # WHEN looking up a code or a prefix pattern
+        actual_occupations = given_index.lookup(given_code)
+
+        # THEN the occupations are the ones that the database regex or exact match returns
+        if isinstance(given_code, str):
+            expected_codes = {code for code in _CODES if code == given_code}
+        else:
+            expected_codes = {code for code in _CODES if given_code.search(code)}
+        assert {occupation.code for occupation in actual_occupations} == expected_codes
+
+    @pytest.mark.parametrize("given_pattern", [re.compile("I4"), re.compile("^I.*", re.IGNORECASE), re.compile("^(I|J)")],
+                             ids=["unanchored", "flags", "alternation"])
+    def test_lookup_of_other_patterns_is_not_answered(self, given_pattern):
+        # GIVEN an index of occupations
+        given_index = OccupationCodeIndex([_get_occupation(code) for code in _CODES])
+
+        # WHEN looking up a pattern that is not a prefix or an exact code
+        actual_occupations = given_index.lookup(given_pattern)
+
+        # THEN it is not answered by the index
+        assert actual_occupations is None
+
+    def test_unseen_and_self_employment_occupations_are_precomputed(self):
+        # GIVEN an index of occupations
+        given_index = OccupationCodeIndex([_get_occupation(code) for code in _CODES])
+
+        # WHEN looking up the unseen and the self-employment occupations
+        actual_unseen = given_index.lookup(UNSEEN_OCCUPATIONS_CODE_PATTERN)
+        actual_self_employment = given_index.lookup(SELF_EMPLOYMENT_OCCUPATION_CODE)
+
+        # THEN the precomputed occupations are returned
+        assert actual_unseen is given_index.unseen_occupations
+        assert [occupation.code for occupation in actual_unseen] == ["I41_0", "I41_1", "I5"]
+        assert [occupation.code for occupation in actual_self_employment] == ["5221_2"]
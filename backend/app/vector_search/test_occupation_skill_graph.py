@@ -0,0 +1,95 @@
+import logging
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app.vector_search.occupation_skill_graph import OccupationSkillGraph, load_occupation_skill_graph
+
+
+def _get_skill_docs(model_id: ObjectId, skill_id: ObjectId, uuid: str) -> list[dict]:
+    # each skill has 3 documents, one for each embedded field
+    return [{"modelId": model_id, "skillId": skill_id, "UUID": uuid, "preferredLabel": f"label of {uuid}",
+             "description": "", "altLabels": [], "skillType": "skill/competence",
+             "embedded_field": field, "embedding": [0.1, 0.2]}
+            for field in ["preferredLabel", "description", "altLabels"]]
+
+
+class TestOccupationSkillGraph:
+    def test_skills_of_occupation(self):
+        # GIVEN a graph of two occupations sharing a skill
+        given_graph = OccupationSkillGraph(
+            skills=[{"skillId": ObjectId(), "UUID": f"skill-{i}", "preferredLabel": f"skill {i}", "skillType": "skill/competence"}
+                    for i in range(3)],
+            occupation_ids=["occupation-1", "occupation-2"],
+            indptr=np.asarray([0, 2, 3], dtype=np.int32),
+            skill_indices=np.asarray([2, 0, 0], dtype=np.int32),
+            relation_type_codes=np.asarray([0, 1, 1], dtype=np.int8),
+            relation_types=["essential", "optional"],
+            signalling_value_codes=np.asarray([0, 0, 1], dtype=np.int8),
+            signalling_values=["", "high"])
+
+        # WHEN getting the skills of each occupation
+        actual_skills_1 = given_graph.skills_of_occupation("occupation-1")
+        actual_skills_2 = given_graph.skills_of_occupation("occupation-2")
+
+        # THEN the skills of the occupations are returned with the attributes of their relations
+        assert [(skill.UUID, skill.relationType, skill.signallingValueLabel) for skill in actual_skills_1] == \
+               [("skill-2", "essential", ""), ("skill-0", "optional", "")]
+        assert [(skill.UUID, skill.relationType, skill.signallingValueLabel) for skill in actual_skills_2] == \
+               [("skill-0", "optional", "high")]
+        # AND an occupation without relations has no skills
+        assert given_graph.skills_of_occupation("unknown-occupation") == []
+
+    def test_inconsistent_offsets_fail(self):
+        # GIVEN offsets that do not cover all the edges
+        # WHEN creating the graph
+        # THEN a ValueError is raised
+        with pytest.raises(ValueError):
+            OccupationSkillGraph(skills=[{}], occupation_ids=["occupation-1"],
+                                 indptr=np.asarray([0, 1], dtype=np.int32),
+                                 skill_indices=np.asarray([0, 0], dtype=np.int32),
+                                 relation_type_codes=np.asarray([0, 0], dtype=np.int8), relation_types=["essential"],
+                                 signalling_value_codes=np.asarray([0, 0], dtype=np.int8), signalling_values=[""])
+
+    @pytest.mark.asyncio
+    async def test_load_occupation_skill_graph(self, in_memory_taxonomy_database):
+        # GIVEN the skills and the relations of a taxonomy model
+        given_model_id = ObjectId()
+        given_skills_collection = in_memory_taxonomy_database.get_collection("skillsmodelsembeddings")
+        given_relations_collection = in_memory_taxonomy_database.get_collection("occupationtoskillrelations")
+        given_skill_ids = [ObjectId() for _ in range(3)]
+        for i, skill_id in enumerate(given_skill_ids):
+            await given_skills_collection.insert_many(_get_skill_docs(given_model_id, skill_id, f"skill-{i}"))
+        given_occupation_ids = [ObjectId(), ObjectId()]
+        await given_relations_collection.insert_many([
+            {"modelId": given_model_id, "requiringOccupationId": given_occupation_ids[1], "requiredSkillId": given_skill_ids[0],
+             "relationType": "essential", "signallingValueLabel": ""},
+            {"modelId": given_model_id, "requiringOccupationId": given_occupation_ids[0], "requiredSkillId": given_skill_ids[1],
+             "relationType": "optional", "signallingValueLabel": ""},
+            {"modelId": given_model_id, "requiringOccupationId": given_occupation_ids[1], "requiredSkillId": given_skill_ids[2],
+             "relationType": "optional", "signallingValueLabel": "high"},
+            # a relation to a skill that is not in the skills collection
+            {"modelId": given_model_id, "requiringOccupationId": given_occupation_ids[0], "requiredSkillId": ObjectId(),
+             "relationType": "essential", "signallingValueLabel": ""},
+            # a relation of another model
+            {"modelId": ObjectId(), "requiringOccupationId": given_occupation_ids[0], "requiredSkillId": given_skill_ids[0],
+             "relationType": "essential", "signallingValueLabel": ""},
+        ])
+
+        # WHEN loading the graph of the model
+        actual_graph = await load_occupation_skill_graph(relations_collection=given_relations_collection,
+                                                         skills_collection=given_skills_collection,
+                                                         model_id=given_model_id,
+                                                         logger=logging.getLogger())
+
+        # THEN each skill is stored once
+        assert actual_graph.skills_count == 3
+        # AND the relations to unknown skills and of other models are ignored
+        assert actual_graph.edges_count == 3
+        # AND the skills of the occupations are returned in the order of their relations
+        assert [(skill.UUID, skill.relationType, skill.signallingValueLabel)
+                for skill in actual_graph.skills_of_occupation(str(given_occupation_ids[1]))] == \
+               [("skill-0", "essential", ""), ("skill-2", "optional", "high")]
+        assert [skill.UUID for skill in actual_graph.skills_of_occupation(str(given_occupation_ids[0]))] == ["skill-1"]
+        assert actual_graph.skills_of_occupation(str(given_occupation_ids[0]))[0].modelId == str(given_model_id)
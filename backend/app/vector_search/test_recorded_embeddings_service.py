@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from app.vector_search.recorded_embeddings_service import EmbeddingNotRecordedError, EmbeddingsRecording, \
+    RecordingEmbeddingService, ReplayEmbeddingService
+from app.vector_search.test_utils import FakeEmbeddingService
+
+
+def _embed_text(text: str) -> list[float]:
+    return [float(len(text)), 0.5, -1.0]
+
+
+class TestRecordedEmbeddingService:
+    @pytest.mark.asyncio
+    async def test_replay_returns_the_recorded_embeddings(self, tmp_path):
+        # GIVEN a recording service of a live service
+        given_path = str(tmp_path / "embeddings.rec")
+        given_live_service = FakeEmbeddingService(embed_text=_embed_text)
+        given_recording_service = RecordingEmbeddingService(embedding_service=given_live_service,
+                                                            recording=EmbeddingsRecording(given_path))
+        # AND some texts were embedded during a live run, some of them twice
+        expected_embeddings = await given_recording_service.embed_batch(["baker", "cook"])
+        await given_recording_service.embed_batch(["cook", "software developer"])
+
+        # WHEN replaying the embeddings from the file, in another process
+        given_replay_service = ReplayEmbeddingService(service_name=given_live_service.service_name,
+                                                      model_name=given_live_service.model_name,
+                                                      recording=EmbeddingsRecording(given_path))
+        actual_embeddings = await given_replay_service.embed_batch(["cook", "baker", "software developer"])
+
+        # THEN the recorded embeddings are returned
+        assert actual_embeddings == [expected_embeddings[1], expected_embeddings[0], [18.0, 0.5, -1.0]]
+        # AND the live service was only called for the texts that were not recorded yet
+        assert given_live_service.calls == [["baker", "cook"], ["software developer"]]
+        # AND the replay service keeps the names of the recorded service
+        assert given_replay_service.service_name == given_live_service.service_name
+        assert given_replay_service.model_name == given_live_service.model_name
+
+    @pytest.mark.asyncio
+    async def test_replay_of_another_model_or_text_fails(self, tmp_path):
+        # GIVEN a recording of the embedding of a text with a model
+        given_path = str(tmp_path / "embeddings.rec")
+        await RecordingEmbeddingService(embedding_service=FakeEmbeddingService(embed_text=_embed_text),
+                                        recording=EmbeddingsRecording(given_path)).embed("baker")
+
+        # WHEN replaying the text with another model
+        given_service = ReplayEmbeddingService(service_name="fake-service", model_name="other-model",
+                                               recording=EmbeddingsRecording(given_path), miss_policy="fail")
+        # THEN an error is raised
+        with pytest.raises(EmbeddingNotRecordedError):
+            await given_service.embed("baker")
+        # AND the miss is counted
+        assert given_service.misses == 1
+
+    @pytest.mark.asyncio
+    async def test_replay_misses_get_deterministic_hashed_vectors(self, tmp_path):
+        # GIVEN a recording with embeddings of 3 dimensions
+        given_path = str(tmp_path / "embeddings.rec")
+        await RecordingEmbeddingService(embedding_service=FakeEmbeddingService(embed_text=_embed_text),
+                                        recording=EmbeddingsRecording(given_path)).embed("baker")
+        # AND a replay service that hashes the texts that were not recorded
+        given_service = ReplayEmbeddingService(service_name="fake-service", model_name="fake-model",
+                                               recording=EmbeddingsRecording(given_path), miss_policy="hash")
+
+        # WHEN embedding texts that were not recorded, twice
+        actual_first = await given_service.embed_batch(["cook", "tailor"])
+        actual_second = await given_service.embed_batch(["cook", "tailor"])
+
+        # THEN the vectors are the same each time
+        assert actual_first == actual_second
+        # AND they are unit vectors with the dimensions of the recording, different for every text
+        assert all(len(vector) == 3 and np.linalg.norm(vector) == pytest.approx(1.0) for vector in actual_first)
+        assert actual_first[0] != actual_first[1]
+
+    @pytest.mark.asyncio
+    async def test_recording_ignores_a_partially_written_record(self, tmp_path):
+        # GIVEN a recording with two embeddings
+        given_path = tmp_path / "embeddings.rec"
+        given_live_service = FakeEmbeddingService(embed_text=_embed_text)
+        await RecordingEmbeddingService(embedding_service=given_live_service,
+                                        recording=EmbeddingsRecording(str(given_path))).embed_batch(["baker", "cook"])
+        # AND the last record was partially written
+        given_path.write_bytes(given_path.read_bytes()[:-5])
+
+        # WHEN recording another embedding
+        given_service = RecordingEmbeddingService(embedding_service=given_live_service,
+                                                  recording=EmbeddingsRecording(str(given_path)))
+        await given_service.embed_batch(["cook", "tailor"])
+
+        # THEN the partially written embedding is embedded again
+        assert given_live_service.calls[-1] == ["cook", "tailor"]
+        # AND all the embeddings can be replayed
+        actual_recording = EmbeddingsRecording(str(given_path))
+        assert len(actual_recording) == 3
+        assert actual_recording.get("fake-model", "baker") == [5.0, 0.5, -1.0]
+        assert actual_recording.get("fake-model", "cook") == [4.0, 0.5, -1.0]
+        assert actual_recording.get("fake-model", "tailor") == [6.0, 0.5, -1.0]
+
+    def test_recording_many_flushes(self, tmp_path):
+        # GIVEN a recording with an embedding
+        given_path = str(tmp_path / "embeddings.rec")
+        given_recording = EmbeddingsRecording(given_path)
+        given_recording.add("fake-model", "text 0", _embed_text("text 0"))
+        given_recording.flush()
+        # AND the recording is loaded again
+        actual_recording = EmbeddingsRecording(given_path)
+
+        # WHEN many embeddings are added and flushed one at a time
+        given_texts = [f"text {i}" for i in range(1, 100)]
+        for text in given_texts:
+            actual_recording.add("fake-model", text, _embed_text(text))
+            actual_recording.flush()
+
+        # THEN all the embeddings are recorded
+        assert len(actual_recording) == 100
+        for text in ["text 0"] + given_texts:
+            assert actual_recording.get("fake-model", text) == _embed_text(text)
+        # AND they can be replayed from the file
+        actual_replayed_recording = EmbeddingsRecording(given_path)
+        for text in ["text 0"] + given_texts:
+            assert actual_replayed_recording.get("fake-model", text) == _embed_text(text)
@@ -0,0 +1,57 @@
+import pytest
+
+from app.vector_search.search_metrics import SearchMetrics
+
+
+def _get_stages(metrics: SearchMetrics) -> dict[tuple[str, str, str, str], int]:
+    return {(stage.service, stage.operation, stage.stage, stage.cache): stage.count for stage in metrics.snapshot()}
+
+
+class TestSearchMetrics:
+    def test_observations_are_counted_in_cumulative_buckets(self):
+        # GIVEN search metrics with some buckets
+        given_metrics = SearchMetrics(buckets=(0.1, 1.0))
+
+        # WHEN observing some latencies of a stage
+        for given_seconds in [0.05, 0.1, 0.5, 2.0]:
+            given_metrics.observe(service="foo", operation="search", stage="embed", seconds=given_seconds)
+
+        # THEN the histogram counts the latencies less than or equal to each bound
+        [actual_stage] = given_metrics.snapshot()
+        assert actual_stage.buckets == {"0.1": 2, "1.0": 3, "+Inf": 4}
+        assert actual_stage.count == 4
+        assert actual_stage.sum_seconds == pytest.approx(2.65)
+
+    def test_stages_are_attributed_to_the_outer_operation(self):
+        # GIVEN search metrics
+        given_metrics = SearchMetrics()
+
+        # WHEN an operation times a stage, and runs another operation with its own stage
+        with given_metrics.time_operation(service="outer", operation="search"):
+            with given_metrics.time_stage(stage="results_cache", cache="hit") as timer:
+                # the cache label is known once the stage is over
+                timer.cache = "miss"
+            with given_metrics.time_operation(service="inner", operation="search_many"):
+                with given_metrics.time_stage(stage="embed"):
+                    pass
+
+        # THEN all the stages are attributed to the outer operation
+        assert _get_stages(given_metrics) == {
+            ("outer", "search", "total", "none"): 1,
+            ("outer", "search", "results_cache", "miss"): 1,
+            ("outer", "search", "inner.search_many", "none"): 1,
+            ("outer", "search", "embed", "none"): 1,
+        }
+
+    def test_failed_stages_are_recorded(self):
+        # GIVEN search metrics
+        given_metrics = SearchMetrics()
+
+        # WHEN a stage of an operation fails
+        with pytest.raises(ValueError):
+            with given_metrics.time_operation(service="foo", operation="search"):
+                with given_metrics.time_stage(stage="db_aggregate"):
+                    raise ValueError("foo")
+
+        # THEN the stage and the operation are recorded
+        assert set(_get_stages(given_metrics)) == {("foo", "search", "total", "none"), ("foo", "search", "db_aggregate", "none")}
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Callable, Optional
+
+from app.vector_search.embeddings_model import EmbeddingService
+
+
+class FakeEmbeddingService(EmbeddingService):
+    """
+    A deterministic embedding service for the tests and the benchmarks, that records the batches of texts it embeds.
+    """
+
+    def __init__(self, *,
+                 embed_text: Callable[[str], list[float]] = lambda text: [float(len(text))],
+                 failing_texts: Optional[set[str]] = None,
+                 error: Optional[Exception] = None,
+                 record_calls: bool = True,
+                 service_name: str = "fake-service",
+                 model_name: str = "fake-model"):
+        """
+        :param embed_text: Computes the embedding of a text, by default a vector with the length of the text.
+        :param failing_texts: The batches with any of these texts fail with a ValueError.
+        :param error: If set, every batch fails with this error (e.g. a transport or quota error).
+        :param record_calls: Whether to record the batches in calls.
+        """
+        super().__init__(service_name=service_name, model_name=model_name)
+        self.calls: list[list[str]] = []
+        self._embed_text = embed_text
+        self._failing_texts = failing_texts or set()
+        self._error = error
+        self._record_calls = record_calls
+
+    async def embed(self, text: str) -> list[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        if self._record_calls:
+            self.calls.append(list(texts))
+        await asyncio.sleep(0)
+        if self._error is not None:
+            raise self._error
+        if self._failing_texts.intersection(texts):
+            raise ValueError(f"failed to embed {texts}")
+        return [self._embed_text(text) for text in texts]
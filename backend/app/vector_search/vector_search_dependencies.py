@@ -5,13 +5,18 @@ from fastapi import Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.app_config import get_application_config
+from app.server_dependencies.database_collections import Collections
 from app.server_dependencies.db_dependencies import CompassDBProvider
+from app.vector_search.caching_embeddings_service import CachingEmbeddingService, MongoEmbeddingCacheStore
 from app.vector_search.embeddings_model import GoogleEmbeddingService, \
-    EmbeddingService
+    EmbeddingService, CoalescingEmbeddingService
 from app.vector_search.esco_entities import OccupationEntity, OccupationSkillEntity, SkillEntity
 from app.vector_search.esco_search_service import VectorSearchConfig, OccupationSearchService, \
     OccupationSkillSearchService, SkillSearchService
+from app.vector_search.recorded_embeddings_service import RECORD_SERVICE_PREFIX, REPLAY_SERVICE_PREFIX, \
+    EmbeddingsRecording, RecordingEmbeddingService, ReplayEmbeddingService, get_recording_settings
 from app.vector_search.similarity_search_service import SimilaritySearchService
+from app.vector_search.vector_search_settings import VectorSearchSettings
 from common_libs.environment_settings.constants import EmbeddingConfig
 
 logger = logging.getLogger(__name__)
@@ -19,6 +24,14 @@ logger = logging.getLogger(__name__)
 # Define a singleton instance of the Google VertexAI embeddings
 _embedding_config = EmbeddingConfig()
 
+
+def get_vector_search_settings() -> VectorSearchSettings:
+    """
+    Get the vector search settings from the application config.
+    """
+    return VectorSearchSettings.from_application_config(application_config=get_application_config(), logger=logger)
+
+
 # Lock to ensure that the singleton instances are thread-safe
 _lock = asyncio.Lock()
 
@@ -31,6 +44,8 @@ async def get_embeddings_service(*, service_name: str = Depends(lambda: get_appl
                                  ) -> EmbeddingService:
     """
     Get the embeddings service singleton instance.
+    The service name can be prefixed with RECORD: to record the embeddings of the service into a local file,
+    or with REPLAY: to replay the recorded embeddings offline (see recorded_embeddings_service.py).
     :param service_name: The name of the service to use. If not provided, the one from the application config is used.
     :param model_name: The name of the model to use. If not provided, the one from the application config is used.
     :return: The embeddings service singleton instance.
@@ -41,10 +56,44 @@ async def get_embeddings_service(*, service_name: str = Depends(lambda: get_appl
     if _embeddings_service_singleton is None:  # initial check to avoid the lock if the instance is already created (lock is expensive)
         async with _lock:  # before modifying the singleton instance, acquire the lock
             if _embeddings_service_singleton is None:  # double check after acquiring the lock
+                recording: EmbeddingsRecording | None = None
+                if service_name.startswith((RECORD_SERVICE_PREFIX, REPLAY_SERVICE_PREFIX)):
+                    recording_path, miss_policy, dimensions = get_recording_settings(logger)
+                    recording = EmbeddingsRecording(recording_path, dimensions=dimensions)
+                if service_name.startswith(REPLAY_SERVICE_PREFIX):
+                    logger.info(f"Replaying {len(recording)} recorded embeddings of the model:{model_name}.")
+                    _embeddings_service_singleton = ReplayEmbeddingService(service_name=service_name.removeprefix(REPLAY_SERVICE_PREFIX),
+                                                                           model_name=model_name,
+                                                                           recording=recording,
+                                                                           miss_policy=miss_policy)
+                    return _embeddings_service_singleton
+                service_name = service_name.removeprefix(RECORD_SERVICE_PREFIX)
                 if service_name != "GOOGLE-VERTEX-AI":
                     raise ValueError(f"Unsupported embedding service: {service_name}. Only Google Vertex AI is supported.")
                 logger.info(f"Creating a new instance of the Google VertexAI embeddings using model:{model_name}.")
-                _embeddings_service_singleton = GoogleEmbeddingService(model_name=model_name)
+                google_embeddings_service = GoogleEmbeddingService(model_name=model_name)
+                embeddings_service: EmbeddingService = google_embeddings_service
+                try:
+                    settings = get_vector_search_settings()
+                except RuntimeError:
+                    # The application is not configured (e.g. the embeddings scripts), the embeddings service is used as is
+                    settings = None
+                if settings is not None and settings.embeddings_coalescing_window_ms > 0:
+                    embeddings_service = CoalescingEmbeddingService(embedding_service=embeddings_service,
+                                                                    window_seconds=settings.embeddings_coalescing_window_ms / 1000,
+                                                                    max_batch_size=google_embeddings_service.max_batch_size)
+                if settings is not None and (settings.embeddings_cache_max_size > 0 or settings.embeddings_cache_persistent):
+                    store = None
+                    if settings.embeddings_cache_persistent:
+                        application_db = await CompassDBProvider.get_application_db()
+                        store = MongoEmbeddingCacheStore(application_db.get_collection(Collections.EMBEDDINGS_CACHE))
+                    embeddings_service = CachingEmbeddingService(embedding_service=embeddings_service,
+                                                                 max_size=settings.embeddings_cache_max_size,
+                                                                 store=store)
+                if recording is not None:
+                    # all the requested texts are recorded, including the ones answered from the caches
+                    embeddings_service = RecordingEmbeddingService(embedding_service=embeddings_service, recording=recording)
+                _embeddings_service_singleton = embeddings_service
 
     """ Get the Google VertexAI embeddings singleton instance."""
     return _embeddings_service_singleton
@@ -75,7 +124,14 @@ async def get_skill_search_service(db: AsyncIOMotorDatabase = Depends(CompassDBP
                     index_name=_embedding_config.embedding_index,
                     embedding_key=_embedding_config.embedding_key,
                 )
-                _skill_search_service_singleton = SkillSearchService(db, embedding_model, skill_vector_search_config, taxonomy_model_id)
+                skill_search_service = SkillSearchService(db, embedding_model, skill_vector_search_config, taxonomy_model_id)
+                settings = get_vector_search_settings()
+                if settings.backend == "in-memory":
+                    await skill_search_service.enable_local_index(atlas_fallback=settings.atlas_fallback,
+                                                                    snapshot_dir=settings.snapshot_dir,
+                                                                    dtype=settings.local_index_dtype)
+                _skill_search_service_singleton = skill_search_service
+                asyncio.create_task(_skill_search_service_singleton.watch_db_changes())
 
     return _skill_search_service_singleton
 
@@ -105,7 +161,17 @@ async def get_occupation_search_service(db: AsyncIOMotorDatabase = Depends(Compa
                     index_name=_embedding_config.embedding_index,
                     embedding_key=_embedding_config.embedding_key,
                 )
-                _occupation_search_service_singleton = OccupationSearchService(db, embedding_model, occupation_vector_search_config, taxonomy_model_id)
+                occupation_search_service = OccupationSearchService(db, embedding_model, occupation_vector_search_config, taxonomy_model_id)
+                settings = get_vector_search_settings()
+                if settings.backend == "in-memory":
+                    await occupation_search_service.enable_local_index(atlas_fallback=settings.atlas_fallback,
+                                                                    snapshot_dir=settings.snapshot_dir,
+                                                                    dtype=settings.local_index_dtype)
+                if settings.occupation_label_search != "off":
+                    await occupation_search_service.enable_label_index(mode=settings.occupation_label_search)
+                if settings.occupation_code_index:
+                    await occupation_search_service.enable_code_index()
+                _occupation_search_service_singleton = occupation_search_service
                 asyncio.create_task(_occupation_search_service_singleton.watch_db_changes())
     return _occupation_search_service_singleton
 
@@ -130,7 +196,19 @@ async def get_occupation_skill_search_service(db: AsyncIOMotorDatabase = Depends
         async with _lock:  # before modifying the singleton instance, acquire the lock
             if _occupation_skill_search_service_singleton is None:  # double check after acquiring the lock
                 logger.info("Creating a new instance of the occupation search service.")
-                _occupation_skill_search_service_singleton = OccupationSkillSearchService(db, embedding_model, taxonomy_model_id)
+                occupation_skill_search_service = OccupationSkillSearchService(db, embedding_model, taxonomy_model_id)
+                settings = get_vector_search_settings()
+                if settings.backend == "in-memory":
+                    await occupation_skill_search_service.enable_local_index(atlas_fallback=settings.atlas_fallback,
+                                                                    snapshot_dir=settings.snapshot_dir,
+                                                                    dtype=settings.local_index_dtype)
+                if settings.occupation_label_search != "off":
+                    await occupation_skill_search_service.enable_label_index(mode=settings.occupation_label_search)
+                if settings.occupation_code_index:
+                    await occupation_skill_search_service.enable_code_index()
+                if settings.occupation_skill_graph:
+                    await occupation_skill_search_service.enable_skill_graph()
+                _occupation_skill_search_service_singleton = occupation_skill_search_service
                 # Start watching for changes in the occupation skill search service
                 asyncio.create_task(_occupation_skill_search_service_singleton.watch_db_changes())
     return _occupation_skill_search_service_singleton
@@ -168,3 +246,25 @@ def get_all_search_services(skill_search_service=Depends(get_skill_search_servic
         occupation_search_service,
         occupation_skill_search_service
     )
+
+
+async def initialize_search_services(*, taxonomy_db: AsyncIOMotorDatabase,
+                                     taxonomy_model_id: str,
+                                     embeddings_service_name: str,
+                                     embeddings_model_name: str) -> SearchServices:
+    """
+    Eagerly create the search services singletons, e.g. at startup, so that the in-memory indexes and graph are loaded
+    before the first request instead of during it.
+    :param taxonomy_db: The taxonomy database instance.
+    :param taxonomy_model_id: The taxonomy model id.
+    :param embeddings_service_name: The name of the embeddings service.
+    :param embeddings_model_name: The name of the embeddings model.
+    :return: An instance of SearchServices containing all the search services.
+    """
+    embedding_service = await get_embeddings_service(service_name=embeddings_service_name, model_name=embeddings_model_name)
+    skill_search_service, occupation_search_service, occupation_skill_search_service = await asyncio.gather(
+        get_skill_search_service(db=taxonomy_db, embedding_model=embedding_service, taxonomy_model_id=taxonomy_model_id),
+        get_occupation_search_service(db=taxonomy_db, embedding_model=embedding_service, taxonomy_model_id=taxonomy_model_id),
+        get_occupation_skill_search_service(db=taxonomy_db, embedding_model=embedding_service, taxonomy_model_id=taxonomy_model_id),
+    )
+    return SearchServices(skill_search_service, occupation_search_service, occupation_skill_search_service)
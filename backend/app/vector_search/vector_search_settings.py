@@ -0,0 +1,128 @@
+from logging import Logger
+from typing import Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.app_config import ApplicationConfig
+
+
+class VectorSearchSettings(BaseModel):
+    """
+    Settings of the vector search services.
+    They are loaded from the BACKEND_VECTOR_SEARCH_CONFIG environment variable (a JSON object), see app/server.py.
+    """
+
+    backend: Literal["atlas", "in-memory"] = "atlas"
+    """
+    Default is "atlas"
+    The backend used to answer the similarity searches of the ESCO search services.
+      - "atlas": every search is a $vectorSearch aggregation against the taxonomy database.
+      - "in-memory": the embeddings of the taxonomy model are loaded into the process memory at startup,
+                     and the searches are answered locally.
+                     The embeddings are loaded again from the database a few seconds after the collection changes,
+                     while they are reloaded the process holds both copies.
+    """
+
+    atlas_fallback: bool = True
+    """
+    Default is True
+    Only relevant when the backend is "in-memory".
+    If True, the searches fall back to Atlas when the in-memory index could not be loaded or fails to answer a search.
+    If False, the error is raised to the caller.
+    """
+
+    snapshot_dir: Optional[str] = None
+    """
+    Default is None
+    Only relevant when the backend is "in-memory".
+    A directory with embeddings snapshots (see scripts/embeddings/export_embeddings_snapshot.py).
+    If the snapshot of the taxonomy model is found, its embeddings are memory-mapped read-only, so that all the workers
+    on a node share the same pages. Otherwise, the embeddings are loaded from the database.
+    """
+
+    local_index_dtype: Literal["float32", "float16", "int8"] = "float32"
+    """
+    Default is "float32"
+    Only relevant when the backend is "in-memory".
+    The type the embeddings are stored with in memory. "float16" halves and "int8" quarters their memory,
+    the best candidates of every search are re-scored with the float32 embeddings, which are memory-mapped from the
+    snapshot, or from a temporary file when the embeddings are loaded from the database.
+    The recall against Atlas can be measured with scripts/embeddings/evaluate_embeddings.py --local-index-dtype.
+    """
+
+    occupation_label_search: Literal["off", "exact", "hybrid"] = "off"
+    """
+    Default is "off"
+    If not "off", an index of the preferred and alternative labels of the occupations is built at startup,
+    and the occupation searches of a text that matches a label exactly are answered from it.
+      - "exact": the occupations with the label and the near-exact matches are returned, without an embedding
+                 or a vector search (there may be fewer than k results).
+      - "hybrid": the matches of the label index are followed by the results of the vector search, up to k.
+    The index is rebuilt a few seconds after the occupations change.
+    """
+
+    occupation_code_index: bool = False
+    """
+    Default is False
+    If True, the codes of the occupations are indexed in memory at startup, and the occupations looked up by an exact code
+    or by a code prefix (e.g. the unseen economy occupations) are retrieved from the index instead of the database.
+    The index is rebuilt a few seconds after the occupations change.
+    """
+
+    occupation_skill_graph: bool = False
+    """
+    Default is False
+    If True, the occupation to skill relations of the taxonomy model are loaded at startup into a compact in-memory graph,
+    and the skills of the occupations are retrieved from it instead of the database.
+    The graph is rebuilt a few seconds after the relations change, the changes of the skills are picked up by the next rebuild.
+    """
+
+    cache_warm_up: bool = False
+    """
+    Default is False
+    If True, all the occupations of the taxonomy model and their skills are loaded into the search caches
+    in the background at startup. The /ready route returns 503 until the warm-up is over,
+    so that the instance receives traffic only once its caches are warm.
+    """
+
+    embeddings_cache_max_size: int = Field(default=0, ge=0)
+    """
+    Default is 0 (disabled)
+    The maximum number of query embeddings kept in memory by the embeddings service, 0 disables the in-memory cache.
+    Note that when the cache is enabled, the texts are normalized (unicode NFC and collapsed whitespace) before they are
+    embedded, see caching_embeddings_service.normalize_text.
+    The conversation agents embed the same short texts (job titles, responsibilities) repeatedly,
+    a hit avoids a round-trip to the embeddings service.
+    """
+
+    embeddings_cache_persistent: bool = False
+    """
+    Default is False
+    If True, the query embeddings are also stored in the application database (embeddings_cache collection),
+    so that they are shared across the workers and survive restarts. They expire 30 days after they were stored.
+    """
+
+    embeddings_coalescing_window_ms: float = Field(default=0, ge=0)
+    """
+    Default is 0 (disabled)
+    The concurrent embedding requests arriving within this window (in milliseconds) are sent to the embeddings service
+    as a single batch (up to the maximum batch size of its region), 0 disables the coalescing.
+    Every embedding request waits for the window, e.g. 5 milliseconds, before it is sent.
+    """
+
+    model_config = ConfigDict(
+        extra="forbid"
+    )
+
+    @staticmethod
+    def from_application_config(*,
+                                application_config: Optional[ApplicationConfig],
+                                logger: Logger) -> "VectorSearchSettings":
+        if application_config is None or not application_config.vector_search_config:
+            return VectorSearchSettings()
+
+        try:
+            return VectorSearchSettings.model_validate(application_config.vector_search_config)
+        except Exception as e:
+            logger.error("Falling back to the default vector search settings due to an error: %s", e)
+            return VectorSearchSettings()
@@ -1,9 +1,12 @@
 import asyncio
+import hashlib
 import logging.config
 import re
-from typing import Literal, Sequence, Mapping, Any
+from datetime import datetime
+from typing import Literal, Sequence, Mapping, Any, Optional
 
-from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCursor, AsyncIOMotorDatabase
 from pydantic import BaseModel, Field
 from pymongo.errors import OperationFailure
 from pymongo.operations import SearchIndexModel
@@ -19,6 +22,92 @@ def redact_credentials_from_uri(uri: str) -> str:
     return re.sub(pattern, "//*:*@", uri)
 
 
+def embedded_text_hash(text: str) -> str:
+    """
+    The hash of an embedded text, it is stored with the embedding so that the unchanged texts of a model
+    are not embedded again (see the incremental mode of generate_taxonomy_embeddings.py)
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BatchCheckpoint:
+    """
+    The progress of a script that processes the documents of a collection in batches (e.g. embeds or copies them).
+
+    The source documents are processed in the order of their _id, in numbered batches that complete in any order.
+    The checkpoint is the _id of the last document of the longest run of completed batches, so that an interrupted
+    run resumes after it. The batches after the checkpoint may have been partially saved, they are processed
+    again, so saving a batch must be idempotent.
+    """
+
+    def __init__(self, *, hot_run: bool, collection: AsyncIOMotorCollection, key: dict[str, Any],
+                 last_source_id: Optional[ObjectId]):
+        """
+        :param hot_run: If False, the checkpoint is not saved.
+        :param collection: The collection of the checkpoints.
+        :param key: The fields that identify the checkpoint in the collection (e.g. the model id).
+        :param last_source_id: The _id of the last document processed by a previous run, if any.
+        """
+        self._hot_run = hot_run
+        self._collection = collection
+        self._key = key
+        self.last_source_id = last_source_id
+        self._next_batch = 0
+        self._completed_batches: dict[int, ObjectId] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def load(*, hot_run: bool, collection: AsyncIOMotorCollection, key: dict[str, Any]) -> "BatchCheckpoint":
+        checkpoint = await collection.find_one(key)
+        return BatchCheckpoint(hot_run=hot_run, collection=collection, key=key,
+                               last_source_id=checkpoint["lastSourceId"] if checkpoint else None)
+
+    async def complete(self, *, batch_number: int, last_source_id: ObjectId):
+        """
+        Mark a batch as saved, and save the checkpoint if the run of completed batches has grown.
+        """
+        async with self._lock:
+            self._completed_batches[batch_number] = last_source_id
+            if self._next_batch not in self._completed_batches:
+                return
+            while self._next_batch in self._completed_batches:
+                self.last_source_id = self._completed_batches.pop(self._next_batch)
+                self._next_batch += 1
+            if self._hot_run:
+                await self._collection.update_one(self._key,
+                                                  {"$set": {"lastSourceId": self.last_source_id, "updatedAt": datetime.now()}},
+                                                  upsert=True)
+
+
+async def read_batches(cursor: AsyncIOMotorCursor, queue: asyncio.Queue[Optional[tuple[int, list[Any]]]], batch_size: int,
+                       consumers: int):
+    """
+    Read the documents of a cursor into numbered batches (see BatchCheckpoint), and put them in a queue.
+    When the cursor is exhausted, a None is put in the queue for each consumer, so that they all stop.
+    The cursor is closed in any case.
+
+    :param cursor: The cursor of the source documents, sorted by their _id.
+    :param queue: The queue of the batches, it should be bounded so that the reading cannot get ahead of the consumers.
+    :param batch_size: The number of documents of a batch.
+    :param consumers: The number of tasks that consume the batches of the queue.
+    """
+    try:
+        batch_number = 0
+        batch = []
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) == batch_size:
+                await queue.put((batch_number, batch))
+                batch_number += 1
+                batch = []
+        if batch:
+            await queue.put((batch_number, batch))
+        for _ in range(consumers):
+            await queue.put(None)
+    finally:
+        await cursor.close()
+
+
 class EmbeddingContext(BaseModel):
     collection_schema: Literal["occupation", "skill"]
     """
@@ -131,6 +220,15 @@ async def _create_std_indexes(*, hot_run: bool,
         name='UUID_index',
         logger=logger
     )
+    # The modelId, embedded_text_hash index is used by the incremental generation of the embeddings
+    # to find the embeddings of the unchanged texts in the previous model
+    await _upsert_index(
+        hot_run=hot_run,
+        collection=collection,
+        keys={'modelId': 1, 'embedded_text_hash': 1},
+        name='embedded_text_hash_index',
+        logger=logger
+    )
 
 
 async def _create_vector_search_index(*,
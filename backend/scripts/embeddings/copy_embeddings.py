@@ -2,18 +2,23 @@
 import argparse
 import asyncio
 import logging
+import time
 from textwrap import dedent
+from typing import Optional
 
 from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorClientSession
 from pydantic import Field
 from pydantic_settings import BaseSettings
 from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
 
+from _base_data_settings import CompassEmbeddingsCollections
 from common_libs.logging.log_utilities import setup_logging_config
-from generate_taxonomy_embeddings import CompassEmbeddingsCollections
-from scripts.embeddings._common import generate_indexes, redact_credentials_from_uri
+from scripts.embeddings._common import BatchCheckpoint, generate_indexes, read_batches, redact_credentials_from_uri
 
 # Set up logging
 setup_logging_config("logging.cfg.yaml")
@@ -40,6 +45,17 @@ class CopyEmbeddingsScriptSettings(BaseSettings):
         env_prefix = "COPY_EMBEDDINGS_SCRIPT_"
 
 
+_DEFAULT_NUM_OF_DIMENSIONS = 768
+_DEFAULT_READ_BATCH_SIZE = 2000
+_DEFAULT_WRITERS = 4
+
+# The progress of the copy of every collection and model ids in the target database, see BatchCheckpoint
+_CHECKPOINTS_COLLECTION = "embeddingscopycheckpoints"
+
+# The error code of a duplicate key, the documents of a partially copied batch are already in the target collection
+_DUPLICATE_KEY_ERROR_CODE = 11000
+
+
 def get_filter(model_ids: list[str]):
     """
     Generate a filter for the MongoDB query to select documents with the given model IDs.
@@ -65,25 +81,76 @@ async def delete_existing_collection(*,
         logging.info(f"Would have deleted {count_before} {collection_name} with model IDs {model_ids}...")
 
 
+def _checkpoint_key(*, collection_name: str, model_ids: list[str]) -> dict:
+    return {"collection": collection_name, "modelIds": sorted(model_ids)}
+
+
+async def delete_checkpoint(*,
+                            hot_run: bool = False,
+                            db: AsyncIOMotorDatabase,
+                            collection_name: str,
+                            model_ids: list[str]):
+    if hot_run:
+        await db[_CHECKPOINTS_COLLECTION].delete_one(_checkpoint_key(collection_name=collection_name, model_ids=model_ids))
+
+
+def _is_duplicate_id(error: dict) -> bool:
+    """
+    Whether a write error is a duplicate _id, the document was already copied by an interrupted run.
+    The duplicate keys of the other unique indexes are conflicts with different documents, they are not skipped.
+    """
+    return error.get("code") == _DUPLICATE_KEY_ERROR_CODE and dict(error.get("keyPattern") or {}) == {"_id": 1}
+
+
+async def _bulk_insert(*, target_col, ops: list[InsertOne]) -> int:
+    """
+    Insert the documents, skipping the documents that are already in the target collection.
+    :return: int - the number of documents inserted
+    """
+    try:
+        result = await target_col.bulk_write(ops, ordered=False)
+        return result.inserted_count
+    except BulkWriteError as e:
+        # the documents of a batch that was partially copied by an interrupted run are skipped
+        errors = e.details.get("writeErrors", [])
+        if not all(_is_duplicate_id(error) for error in errors) or e.details.get("writeConcernErrors"):
+            raise
+        logging.info(f"Skipped {len(errors)} documents already in collection '{target_col.name}'")
+        return e.details.get("nInserted", len(ops) - len(errors))
+
+
 async def copy_collection(*,
                           hot_run: bool = False,
                           source_db: AsyncIOMotorDatabase,
-                          source_session: AsyncIOMotorClientSession,
+                          source_session: Optional[AsyncIOMotorClientSession] = None,
                           target_db: AsyncIOMotorDatabase,
                           # target_session: AsyncIOMotorClientSession,
                           collection_name: str,
-                          model_ids: list[str]):
-    _model_ids = [ObjectId(model_id) for model_id in model_ids]
+                          model_ids: list[str],
+                          read_batch_size: int = _DEFAULT_READ_BATCH_SIZE,
+                          writers: int = _DEFAULT_WRITERS):
+    """
+    Copy the documents of a collection with the given model IDs.
+
+    The documents are streamed from the source collection in the order of their _id, and inserted in batches by
+    a pool of concurrent writers. The batches wait in a bounded queue, so that the reading cannot get ahead of the
+    writing. The documents are copied as raw BSON with their _id, and the progress is checkpointed in the target
+    database, so that an interrupted copy resumes where it left off.
+    """
     selection_filter = get_filter(model_ids)
-    batch_size = 500
 
-    source_col = source_db[collection_name]
+    # the documents are not decoded, they are copied as they are read
+    source_col = source_db[collection_name].with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
     target_col = target_db[collection_name]
 
+    checkpoint = await BatchCheckpoint.load(hot_run=hot_run,
+                                            collection=target_db[_CHECKPOINTS_COLLECTION],
+                                            key=_checkpoint_key(collection_name=collection_name, model_ids=model_ids))
+    if checkpoint.last_source_id is not None:
+        logging.info(f"Resuming the copy of collection '{collection_name}' after the document {checkpoint.last_source_id}")
+        selection_filter = {**selection_filter, "_id": {"$gt": checkpoint.last_source_id}}
+
     documents_count = await source_col.count_documents(selection_filter, session=source_session)
-    cursor = source_col.find(selection_filter, no_cursor_timeout=True, session=source_session)
-    ops = []
-    count = 0
     logging.info(f"Copying collection '{collection_name}' with model ID {model_ids}...")
 
     progress = tqdm(
@@ -91,30 +158,45 @@ async def copy_collection(*,
         total=documents_count
     )
 
-    async for doc in cursor:
-        doc.pop("_id", None)  # remove the _id so MongoDB assigns a new one
-        ops.append(InsertOne(doc))
-        if len(ops) >= batch_size:
+    batches: asyncio.Queue[Optional[tuple[int, list[RawBSONDocument]]]] = asyncio.Queue(maxsize=2 * writers)
+    count = 0
+    skipped = 0
+    size = 0
+    start_time = time.time()
+
+    async def _write_batches():
+        nonlocal count, skipped, size
+        while (item := await batches.get()) is not None:
+            batch_number, batch = item
+            inserted = len(batch)
             if hot_run:
                 # In normal mode, we insert the documents
-                await target_col.bulk_write(ops, ordered=False)
-            count += len(ops)
-            progress.update(len(ops))
-            ops = []
-
-    if ops:
-        if hot_run:
-            await target_col.bulk_write(ops, ordered=False)
-        count += len(ops)
-        progress.update(len(ops))
-
+                inserted = await _bulk_insert(target_col=target_col, ops=[InsertOne(doc) for doc in batch])
+            await checkpoint.complete(batch_number=batch_number, last_source_id=batch[-1]["_id"])
+            count += inserted
+            skipped += len(batch) - inserted
+            size += sum(len(doc.raw) for doc in batch)
+            progress.update(len(batch))
+
+    # If a writer fails, the other tasks are cancelled, and the next run resumes from the checkpoint
+    async with asyncio.TaskGroup() as task_group:
+        cursor = (source_col.find(selection_filter, no_cursor_timeout=True, session=source_session)
+                  .sort("_id", 1)
+                  .batch_size(read_batch_size))
+        task_group.create_task(read_batches(cursor, batches, read_batch_size, writers))
+        for _ in range(writers):
+            task_group.create_task(_write_batches())
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    progress.close()
+    throughput = (f"in {elapsed:.1f} seconds, {count / elapsed:.0f} docs/s, {size / elapsed / 1024 / 1024:.2f} MB/s "
+                  f"({size / 1024 / 1024:.1f} MB)")
     if hot_run:
-        logging.info(f"Inserted {count} new docs into collection '{collection_name}'")
+        logging.info(f"Inserted {count} new docs into collection '{collection_name}' {throughput}, "
+                     f"skipped {skipped} docs already copied")
     else:
-        logging.info(f"Would have inserted {count} new docs into collection '{collection_name}'")
-
-    await cursor.close()
-    progress.close()
+        logging.info(f"Would have inserted {count} new docs into collection '{collection_name}', read {throughput}")
+    return count, size
 
 
 async def main():
@@ -169,6 +251,28 @@ async def main():
         action="store_true",
         help="Generate indexes after copying")
 
+    options_group.add_argument(
+        "--num-of-dimensions",
+        type=int,
+        required=False,
+        default=_DEFAULT_NUM_OF_DIMENSIONS,
+        choices=[768, 3072],
+        help="The number of dimensions of the embeddings, for the vector search indexes")
+
+    options_group.add_argument(
+        "--read-batch-size",
+        type=int,
+        required=False,
+        default=_DEFAULT_READ_BATCH_SIZE,
+        help="The number of documents read from the source and inserted in the target at once")
+
+    options_group.add_argument(
+        "--writers",
+        type=int,
+        required=False,
+        default=_DEFAULT_WRITERS,
+        help="The number of batches of each collection inserted concurrently")
+
     args = parser.parse_args()
 
     # Load settings from environment variables
@@ -197,49 +301,61 @@ async def main():
         target_clients.append(client)
         target_dbs.append(db)
 
+    async def _copy(target_db: AsyncIOMotorDatabase, col: CompassEmbeddingsCollections) -> tuple[int, int]:
+        if args.delete_existing:
+            await delete_existing_collection(
+                hot_run=args.hot_run,
+                db=target_db,
+                collection_name=col.value,
+                model_ids=settings.tabiya_model_ids
+            )
+            await delete_checkpoint(
+                hot_run=args.hot_run,
+                db=target_db,
+                collection_name=col.value,
+                model_ids=settings.tabiya_model_ids
+            )
+        # a session can only be used by one cursor at a time
+        async with await source_client.start_session() as source_session:
+            result = await copy_collection(
+                hot_run=args.hot_run,
+                source_db=source_db,
+                target_db=target_db,
+                collection_name=col.value,
+                model_ids=settings.tabiya_model_ids,
+                source_session=source_session,
+                read_batch_size=args.read_batch_size,
+                writers=args.writers,
+            )
+        progress.update(1)
+        return result
+
     total = len(CompassEmbeddingsCollections) * len(target_dbs) + len(target_dbs)
     progress = tqdm(desc="Processing", total=total)
-    async with await source_client.start_session() as source_session:
-        for target_db in target_dbs:
-            logger.info(f"Processing target database: {target_db.name}")
-
-            if args.indexes_only:
-                logger.info("Generating indexes only...")
-                await generate_indexes(
-                    hot_run=args.hot_run,
-                    db=target_db,
-                    logger=logger
-                )
-                progress.update(1)
-            elif not args.generate_indexes:
-                logger.info("Copying collections...")
-
-                for col in CompassEmbeddingsCollections:
-                    if args.delete_existing:
-                        await delete_existing_collection(
-                            hot_run=args.hot_run,
-                            db=target_db,
-                            collection_name=col.value,
-                            model_ids=settings.tabiya_model_ids
-                        )
-                    await copy_collection(
-                        hot_run=args.hot_run,
-                        source_db=source_db,
-                        target_db=target_db,
-                        collection_name=col.value,
-                        model_ids=settings.tabiya_model_ids,
-                        source_session=source_session,
-                    )
-                    progress.update(1)
-
-                if args.generate_indexes:
-                    logger.info("Generating indexes after copying collections...")
-                    await generate_indexes(
-                        hot_run=args.hot_run,
-                        db=target_db,
-                        logger=logger
-                    )
-                    progress.update(1)
+    for target_db in target_dbs:
+        logger.info(f"Processing target database: {target_db.name}")
+
+        if not args.indexes_only:
+            logger.info("Copying collections...")
+
+            # the collections are copied concurrently
+            start_time = time.time()
+            results = await asyncio.gather(*(_copy(target_db, col) for col in CompassEmbeddingsCollections))
+            elapsed = max(time.time() - start_time, 1e-9)
+            count = sum(result[0] for result in results)
+            size = sum(result[1] for result in results)
+            logger.info(f"Copied {count} docs ({size / 1024 / 1024:.1f} MB) to {target_db.name} in {elapsed:.1f} seconds, "
+                        f"{count / elapsed:.0f} docs/s, {size / elapsed / 1024 / 1024:.2f} MB/s")
+
+        if args.indexes_only or args.generate_indexes:
+            logger.info("Generating indexes...")
+            await generate_indexes(
+                hot_run=args.hot_run,
+                db=target_db,
+                num_of_dimensions=args.num_of_dimensions,
+                logger=logger
+            )
+        progress.update(1)
 
     progress.close()
 
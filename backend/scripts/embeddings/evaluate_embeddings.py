@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
+import hashlib
 import json
 import logging
 import os
 import sys
+import time
 from typing import List, Optional, Tuple, Any
 
+import numpy as np
 import vertexai
 from datasets import load_dataset, Features, Value, VerificationMode
 from dotenv import load_dotenv
@@ -14,7 +17,8 @@ from tqdm import tqdm
 
 from _base_data_settings import Type
 from app.i18n.types import Locale
-from app.vector_search.esco_search_service import VectorSearchConfig
+from app.vector_search.esco_search_service import AbstractEscoSearchService, VectorSearchConfig, clear_caches
+from app.vector_search.local_embedding_index import IndexDType
 from app.vector_search.similarity_search_service import SimilaritySearchService
 from common_libs.agent.translation_tool import TranslationTool
 from common_libs.environment_settings.constants import EmbeddingConfig
@@ -35,6 +39,16 @@ logger = logging.getLogger()
 # TODO: Change according to the model you are evaluating
 _TARGET_LOCALE = Locale.ES_ES
 
+# The offline evaluation reports the metrics at these k by default
+_OFFLINE_KS = [1, 3, 5, 10, 20, 50]
+
+# The number of queries embedded at once, and searched with a single matrix product in the offline evaluation
+_OFFLINE_EMBED_BATCH_SIZE = 250
+_OFFLINE_SEARCH_BATCH_SIZE = 1024
+
+# The number of queries searched at once against Atlas, each query is a $vectorSearch aggregation of its own
+_ATLAS_SEARCH_BATCH_SIZE = 16
+
 
 def _precision_at_k(prediction: List[List[str]], true: List[List[str]], k: Optional[int] = None):
     """
@@ -108,6 +122,141 @@ async def _get_predictions(*, search_service: SimilaritySearchService, queries:
     return predictions
 
 
+async def _search_uuids(*, search_service: AbstractEscoSearchService, embeddings: List[List[float]], k: int,
+                        batch_size: int) -> List[List[str]]:
+    """
+    Search the embeddings in batches, so that a search service without a local index runs at most batch_size
+    concurrent Atlas searches.
+    :return: The UUIDs of the entities found for each embedding.
+    """
+    results = []
+    for start in range(0, len(embeddings), batch_size):
+        searched = await search_service.search_many(queries=embeddings[start:start + batch_size], k=k)
+        results.extend([entity.UUID for entity in result] for result in searched)
+    return results
+
+
+async def _get_local_index_recall(*, search_service: AbstractEscoSearchService, queries: List[str],
+                                  evaluated_type: Type, dtype: IndexDType, k: int = 10):
+    """
+    Report the recall at k of the local index with the embeddings stored with the given type, against the Atlas
+    vector search, i.e. the share of the entities found by Atlas that are also found by the local index.
+    """
+    # The queries are embedded once, sequentially, to stay within the quota of the embedding service
+    embeddings = []
+    for query in tqdm(queries, desc=f"Embedding the queries of {evaluated_type.name}", file=sys.stdout):
+        embeddings.append(await search_service.embedding_service.embed(query))
+
+    atlas_results = await _search_uuids(search_service=search_service, embeddings=embeddings, k=k,
+                                        batch_size=_ATLAS_SEARCH_BATCH_SIZE)
+    # the results of the local index must not be answered from the cached results of Atlas
+    await clear_caches()
+    await search_service.enable_local_index(atlas_fallback=False, dtype=dtype)
+    local_results = await _search_uuids(search_service=search_service, embeddings=embeddings, k=k,
+                                        batch_size=_OFFLINE_SEARCH_BATCH_SIZE)
+
+    logger.info(f"Recall of the {dtype} local index against Atlas for the {evaluated_type.name} embeddings:")
+    for _k in [1, 3, 5, 10]:
+        if _k > k:
+            break
+        recall = _recall_at_k(local_results, [result[:_k] for result in atlas_results], _k)
+        logger.info(f"K = {_k}, recall: {recall}")
+
+
+async def _translate_queries(queries: List[str]) -> List[str]:
+    # Since the tests are in English, do not translate them
+    if _TARGET_LOCALE in [Locale.EN_GB, Locale.EN_US]:
+        return queries
+    translation_tool = TranslationTool(_TARGET_LOCALE)
+    return [await translation_tool.translate(query)
+            for query in tqdm(queries, desc="Translating the queries", file=sys.stdout)]
+
+
+async def _embed_queries(*, search_service: SimilaritySearchService, queries: List[str], evaluated_type: Type,
+                         cache_dir: Optional[str]) -> np.ndarray:
+    """
+    Embed the (translated) queries in batches.
+    If a cache directory is given, the embeddings are saved in it, so that the same queries are not embedded again
+    when evaluating other indexes (e.g. other quantization settings) with the same embedding model.
+    :return: A (queries x dimensions) float32 matrix.
+    """
+    cache_file = None
+    if cache_dir:
+        embedding_service = search_service.embedding_service
+        queries_hash = hashlib.blake2b("\n".join(queries).encode("utf-8"), digest_size=8).hexdigest()
+        cache_file = os.path.join(cache_dir, f"{evaluated_type.value}_{embedding_service.service_name}_"
+                                             f"{embedding_service.model_name}_{_TARGET_LOCALE.value}_{queries_hash}.npy")
+        if os.path.exists(cache_file):
+            logger.info(f"Loading the embeddings of the {evaluated_type.name} queries from {cache_file}")
+            return np.load(cache_file)
+
+    translated_queries = await _translate_queries(queries)
+    embeddings = []
+    for start in tqdm(range(0, len(translated_queries), _OFFLINE_EMBED_BATCH_SIZE),
+                      desc=f"Embedding the queries of {evaluated_type.name}", file=sys.stdout):
+        embeddings.extend(await search_service.embedding_service.embed_batch(
+            translated_queries[start:start + _OFFLINE_EMBED_BATCH_SIZE]))
+    matrix = np.asarray(embeddings, dtype=np.float32)
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_file, matrix)
+        logger.info(f"Saved the embeddings of the {evaluated_type.name} queries to {cache_file}")
+    return matrix
+
+
+def _get_ranks(predictions: List[List[str]], ground_truth: List[str]) -> np.ndarray:
+    """
+    Get the 1-based rank of the ground truth in the predictions of every query, infinity if it was not predicted.
+    """
+    ranks = np.full(len(ground_truth), np.inf)
+    for i, (pred_list, true_value) in enumerate(zip(predictions, ground_truth)):
+        if true_value in pred_list:
+            ranks[i] = pred_list.index(true_value) + 1
+    return ranks
+
+
+def _get_ranking_metrics(ranks: np.ndarray, ks: List[int]) -> dict[str, float]:
+    """
+    Get the recall at every k and the mean reciprocal rank (up to the largest k) from the ranks of the ground truth.
+    """
+    hits = ranks[:, np.newaxis] <= np.asarray(ks)[np.newaxis, :]
+    metrics = {f"recall@{k}": float(recall) for k, recall in zip(ks, hits.mean(axis=0))}
+    metrics[f"mrr@{max(ks)}"] = float(np.where(ranks <= max(ks), 1 / ranks, 0).mean())
+    return metrics
+
+
+async def _evaluate_offline(*, search_service: AbstractEscoSearchService, queries: List[str], ground_truth: List[str],
+                            evaluated_type: Type, dtypes: List[IndexDType], ks: List[int], snapshot_dir: Optional[str],
+                            query_embeddings_dir: Optional[str]) -> dict[str, dict[str, float]]:
+    """
+    Evaluate the retrieval quality of the in-memory index of the embeddings, with each of the given types.
+    The queries are embedded once, and searched in large batches, every batch is scored with a single matrix product
+    of the queries and all the embeddings, so that thousands of queries are evaluated in seconds.
+    """
+    embeddings = await _embed_queries(search_service=search_service, queries=queries, evaluated_type=evaluated_type,
+                                      cache_dir=query_embeddings_dir)
+    metrics = {}
+    for dtype in dtypes:
+        # the results must not be answered from the cached results of another index
+        await clear_caches()
+        await search_service.enable_local_index(atlas_fallback=False, snapshot_dir=snapshot_dir, dtype=dtype)
+
+        start_time = time.time()
+        predictions: List[List[str]] = []
+        for start in range(0, len(embeddings), _OFFLINE_SEARCH_BATCH_SIZE):
+            results = await search_service.search_many(
+                queries=embeddings[start:start + _OFFLINE_SEARCH_BATCH_SIZE].tolist(), k=max(ks))
+            predictions.extend([_get_evaluated_field(e, evaluated_type) for e in result] for result in results)
+        elapsed = time.time() - start_time
+
+        metrics[dtype] = _get_ranking_metrics(_get_ranks(predictions, ground_truth), ks)
+        logger.info(f"Offline metrics of the {dtype} index for the {evaluated_type.name} embeddings "
+                    f"({len(queries)} queries in {elapsed:.2f} seconds): "
+                    + ", ".join(f"{name}: {value:.4f}" for name, value in metrics[dtype].items()))
+    return metrics
+
+
 def _get_metrics(*, predictions: list[list[str]], ground_truth: List[str], evaluated_type: Type):
     """ Evaluate the embeddings using ground truth data and synthetic queries."""
     ground_truth = [[elem] for elem in ground_truth]
@@ -174,7 +323,9 @@ def evaluate_top_k_hits(
     return results
 
 
-async def main(*, do_skills: bool = False, do_occupations: bool = False):
+async def main(*, do_skills: bool = False, do_occupations: bool = False, local_index_dtype: Optional[IndexDType] = None,
+               offline_dtypes: Optional[List[IndexDType]] = None, offline_ks: Optional[List[int]] = None,
+               snapshot_dir: Optional[str] = None, query_embeddings_dir: Optional[str] = None):
     region = os.getenv("VERTEX_API_EMBEDDINGS_REGION")
     if not region:
         raise ValueError("VERTEX_API_EMBEDDINGS_REGION environment variable is not set.")
@@ -193,6 +344,17 @@ async def main(*, do_skills: bool = False, do_occupations: bool = False):
                                               token=hf_access_token).get("train")
             occupation_queries: list[str] = occupation_dataset["synthetic_query"]
             occupation_ground_truth: list[str] = occupation_dataset["esco_code"]
+            if offline_dtypes:
+                occupation_metrics = await _evaluate_offline(search_service=search_services.occupation_search_service,
+                                                             queries=occupation_queries,
+                                                             ground_truth=occupation_ground_truth,
+                                                             evaluated_type=Type.OCCUPATION,
+                                                             dtypes=offline_dtypes,
+                                                             ks=offline_ks or _OFFLINE_KS,
+                                                             snapshot_dir=snapshot_dir,
+                                                             query_embeddings_dir=query_embeddings_dir)
+                store_data_as_json(data=occupation_metrics, output_file="occupation_offline_evaluation_output.json")
+                return
             occupations_predictions: list[list[str]] = await _get_predictions(
                 search_service=search_services.occupation_search_service,
                 queries=occupation_queries,
@@ -211,6 +373,11 @@ async def main(*, do_skills: bool = False, do_occupations: bool = False):
                 predictions=occupations_predictions,
                 ground_truth=occupation_ground_truth,
                 evaluated_type=Type.OCCUPATION)
+            if local_index_dtype:
+                await _get_local_index_recall(search_service=search_services.occupation_search_service,
+                                              queries=occupation_queries,
+                                              evaluated_type=Type.OCCUPATION,
+                                              dtype=local_index_dtype)
 
         tasks.append(evaluate_occupations_task)
 
@@ -235,6 +402,17 @@ async def main(*, do_skills: bool = False, do_occupations: bool = False):
                                          verification_mode=VerificationMode.NO_CHECKS)
             skills_queries: list[str] = skill_dataset["synthetic_query"]
             skill_ground_truth: list[str] = skill_dataset["label"]
+            if offline_dtypes:
+                skills_metrics = await _evaluate_offline(search_service=search_services.skill_search_service,
+                                                         queries=skills_queries,
+                                                         ground_truth=skill_ground_truth,
+                                                         evaluated_type=Type.SKILL,
+                                                         dtypes=offline_dtypes,
+                                                         ks=offline_ks or _OFFLINE_KS,
+                                                         snapshot_dir=snapshot_dir,
+                                                         query_embeddings_dir=query_embeddings_dir)
+                store_data_as_json(data=skills_metrics, output_file="skills_offline_evaluation_output.json")
+                return
             skills_predictions: list[list[str]] = await _get_predictions(
                 search_service=search_services.skill_search_service,
                 queries=skills_queries,
@@ -253,6 +431,11 @@ async def main(*, do_skills: bool = False, do_occupations: bool = False):
             _get_metrics(predictions=skills_predictions,
                          ground_truth=skill_ground_truth,
                          evaluated_type=Type.SKILL)
+            if local_index_dtype:
+                await _get_local_index_recall(search_service=search_services.skill_search_service,
+                                              queries=skills_queries,
+                                              evaluated_type=Type.SKILL,
+                                              dtype=local_index_dtype)
 
         tasks.append(evaluate_skills_task)
 
@@ -276,6 +459,42 @@ if __name__ == "__main__":
         action="store_true",
         help="Evaluate occupations embeddings")
 
+    options_group.add_argument(
+        "--local-index-dtype",
+        required=False,
+        choices=["float32", "float16", "int8"],
+        help="Also report the recall at k of the in-memory index, with the embeddings stored with this type,\n"
+             "against the Atlas vector search")
+
+    options_group.add_argument(
+        "--offline",
+        required=False,
+        nargs="+",
+        choices=["float32", "float16", "int8"],
+        metavar="DTYPE",
+        help="Evaluate offline: search all the queries at once in the in-memory index, with the embeddings stored with\n"
+             "each of these types (float32, float16, int8), and report the recall at k and the MRR,\n"
+             "instead of searching the queries one at a time")
+
+    options_group.add_argument(
+        "--offline-k",
+        required=False,
+        nargs="+",
+        type=int,
+        default=_OFFLINE_KS,
+        help="The k of the offline metrics")
+
+    options_group.add_argument(
+        "--snapshot-dir",
+        required=False,
+        help="Offline: memory-map the embeddings from the snapshot of the model in this directory,\n"
+             "instead of loading them from the database")
+
+    options_group.add_argument(
+        "--query-embeddings-dir",
+        required=False,
+        help="Offline: save the embeddings of the queries in this directory, and reuse them in the next runs")
+
     args = parser.parse_args()
     if not args.skills and not args.occupations:
         parser.error("At least one of --skills or --occupations must be specified.")
@@ -283,5 +502,10 @@ if __name__ == "__main__":
     load_dotenv()
     asyncio.run(main(
         do_skills=args.skills,
-        do_occupations=args.occupations
+        do_occupations=args.occupations,
+        local_index_dtype=args.local_index_dtype,
+        offline_dtypes=args.offline,
+        offline_ks=sorted(set(args.offline_k)),
+        snapshot_dir=args.snapshot_dir,
+        query_embeddings_dir=args.query_embeddings_dir
     ))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import logging
+from textwrap import dedent
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic_settings import BaseSettings
+
+from _base_data_settings import CompassEmbeddingsCollections
+from app.vector_search.embeddings_snapshot import write_embeddings_snapshot
+from common_libs.environment_settings.constants import EmbeddingConfig
+from common_libs.logging.log_utilities import setup_logging_config
+from scripts.embeddings._common import redact_credentials_from_uri
+
+load_dotenv()
+
+# Set up logging
+setup_logging_config("logging.cfg.yaml")
+logger = logging.getLogger()
+
+
+class ExportEmbeddingsSnapshotScriptSettings(BaseSettings):
+    taxonomy_mongodb_uri: str
+    """ The URI of the MongoDB with the taxonomy embeddings."""
+
+    taxonomy_db_name: str
+    """ The name of the database with the taxonomy embeddings."""
+
+    taxonomy_model_id: str
+    """ The model ID of the taxonomy model to export the embeddings for."""
+
+    class Config:
+        env_prefix = "EXPORT_EMBEDDINGS_SNAPSHOT_SCRIPT_"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=dedent("""
+                                        Export the embeddings of a taxonomy model to an on-disk snapshot.
+
+                                        The snapshot can be memory-mapped by the backend when the vector search backend is "in-memory"
+                                        (see the snapshot_dir setting of BACKEND_VECTOR_SEARCH_CONFIG), so that all the workers
+                                        on a node share the same embeddings instead of loading them from the database.
+
+                                        Required environment variables:
+                                          - EXPORT_EMBEDDINGS_SNAPSHOT_SCRIPT_TAXONOMY_MONGODB_URI: MongoDB URI of the taxonomy database
+                                          - EXPORT_EMBEDDINGS_SNAPSHOT_SCRIPT_TAXONOMY_DB_NAME: Name of the taxonomy database
+                                          - EXPORT_EMBEDDINGS_SNAPSHOT_SCRIPT_TAXONOMY_MODEL_ID: The taxonomy model id to export
+
+                                        Example:
+                                          python export_embeddings_snapshot.py --snapshot-dir /var/lib/compass/snapshots --dtype float16
+                                        """),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    options_group = parser.add_argument_group("Options")
+    options_group.add_argument(
+        "--snapshot-dir",
+        required=True,
+        help="The directory to write the snapshot to, the snapshot is written to <snapshot-dir>/<model-id>")
+    options_group.add_argument(
+        "--dtype",
+        required=False,
+        default="float32",
+        choices=["float32", "float16"],
+        help="The type used to store the embeddings, float16 halves the size of the snapshot")
+    args = parser.parse_args()
+
+    # noinspection PyArgumentList
+    settings = ExportEmbeddingsSnapshotScriptSettings()
+    logger.info(f"Taxonomy MongoDB URI: {redact_credentials_from_uri(settings.taxonomy_mongodb_uri)}")
+    client = AsyncIOMotorClient(settings.taxonomy_mongodb_uri, tlsAllowInvalidCertificates=True)
+    db = client.get_database(settings.taxonomy_db_name)
+
+    model_info = await db[CompassEmbeddingsCollections.MODEL_INFO.value].find_one({"modelId": ObjectId(settings.taxonomy_model_id)})
+    if model_info is None:
+        raise ValueError(f"Taxonomy model id {settings.taxonomy_model_id} is not found in the taxonomy model info collection.")
+
+    embedding_config = EmbeddingConfig()
+    await write_embeddings_snapshot(
+        snapshot_dir=args.snapshot_dir,
+        model_id=settings.taxonomy_model_id,
+        collections={
+            "occupationId": db[CompassEmbeddingsCollections.OCCUPATIONS.value],
+            "skillId": db[CompassEmbeddingsCollections.SKILLS.value],
+        },
+        embedding_key=embedding_config.embedding_key,
+        dtype=args.dtype,
+        embeddings_service=model_info.get("embeddingsService"),
+        logger=logger
+    )
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
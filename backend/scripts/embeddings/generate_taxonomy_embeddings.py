@@ -4,13 +4,14 @@ import asyncio
 import logging.config
 import time
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
 
 import vertexai
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
 from tqdm import tqdm
 
 from _base_data_settings import EmbeddingsScriptSettings, CompassEmbeddingsCollections, PlatformCollections
@@ -18,7 +19,8 @@ from app.vector_search.embeddings_model import EmbeddingService
 from app.vector_search.vector_search_dependencies import get_embeddings_service
 from common_libs.logging.log_utilities import setup_logging_config
 from common_libs.time_utilities import get_now, datetime_to_mongo_date
-from scripts.embeddings._common import EmbeddingContext, generate_indexes, redact_credentials_from_uri
+from scripts.embeddings._common import BatchCheckpoint, EmbeddingContext, embedded_text_hash, generate_indexes, \
+    read_batches, redact_credentials_from_uri
 
 load_dotenv()
 vertexai.init()
@@ -53,6 +55,10 @@ COMPASS_DB = (AsyncIOMotorClient(
 ##########################
 
 _DEFAULT_NUM_OF_DIMENSIONS = 768
+_DEFAULT_EMBEDDING_WORKERS = 4
+
+# The progress of the generation of the embeddings of every model and schema, see BatchCheckpoint
+_CHECKPOINTS_COLLECTION = "embeddingsgenerationcheckpoints"
 
 
 class Options(BaseModel):
@@ -61,6 +67,9 @@ class Options(BaseModel):
     delete_existing: bool = False
     generate_embeddings: bool = True
     generate_indexes: bool = True
+    embedding_workers: int = _DEFAULT_EMBEDDING_WORKERS
+    max_texts_per_minute: int = 0
+    previous_model_id: Optional[str] = None
 
 
 _OCCUPATIONS_EMBEDDING_CONTEXT = EmbeddingContext(
@@ -82,21 +91,36 @@ _SKILLS_EMBEDDING_CONTEXT = EmbeddingContext(
 )
 
 
-async def generate_and_save_embeddings(*,
-                                       hot_run: bool,
-                                       documents: list[dict[str, Any]],
-                                       ctx: EmbeddingContext,
-                                       embeddings_service: EmbeddingService):
+class _RateLimiter:
     """
-    Generate the embeddings for the given documents
-    :param hot_run: bool - if True, the embeddings will be generated and saved
-    :param documents: list[dict[str, any]] - the documents to generate the embeddings for
-    :param ctx: EmbeddingContext - the context
-    :param embeddings_service: EmbeddingService - the embeddings service to use
-    :return:
+    Limits the number of texts embedded per minute, so that the embedding workers stay within the quota of the
+    embeddings service. The texts are spread evenly over the minute, instead of being sent in bursts.
     """
-    texts = []
 
+    def __init__(self, texts_per_minute: int):
+        """
+        :param texts_per_minute: The maximum number of texts per minute, 0 for no limit.
+        """
+        self._seconds_per_text = 60 / texts_per_minute if texts_per_minute > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, texts: int):
+        if not self._seconds_per_text:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(self._next_time, now) + texts * self._seconds_per_text
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
+def _texts_of(documents: list[dict[str, Any]]) -> list[str]:
+    """
+    The texts to embed of the documents, in the order of the embedded fields of _to_embedding_documents
+    """
+    texts = []
     for document in documents:
         texts.append(document["description"])
         texts.append(document["preferredLabel"])
@@ -105,22 +129,17 @@ async def generate_and_save_embeddings(*,
     # Remove the empty strings
     # Later when iterating over the documents we need to make that we check
     # for empty strings to ensure that we keep the same order
-    texts = [text for text in texts if text]
+    return [text for text in texts if text]
 
-    embeddings: list[list[float]]
-    if hot_run:
-        logger.info(f"Generate embeddings for {len(texts)} texts")
-        start_time = time.time()
-        embeddings = await embeddings_service.embed_batch(texts)
-        end_time = time.time()
-        logger.info(f"Time taken to generate embeddings: {end_time - start_time:.2f} seconds for {len(texts)} texts, "
-                    f"{len(texts) / (end_time - start_time):.2f} texts/seconds")
-    else:
-        # and array of length len(texts) and each element is an empty array
-        embeddings: list[list[float]] = [[] for _ in range(len(texts))]
-        logger.info(f"Would generate embeddings for {len(texts)} texts")
 
-    insertable_documents = []
+def _to_embedding_documents(*,
+                            documents: list[dict[str, Any]],
+                            embeddings: list[list[float]],
+                            ctx: EmbeddingContext) -> list[dict[str, Any]]:
+    """
+    Create a document for every embedded field of the given documents.
+    """
+    embedding_documents = []
 
     i = 0
     for document in documents:
@@ -139,54 +158,177 @@ async def generate_and_save_embeddings(*,
         for extra_field in ctx.extra_fields:
             new_document[extra_field] = document[extra_field]
 
-        if document["description"]:
-            insertable_documents.append({
-                **new_document,
-                "embedding": embeddings[i],
-                "embedded_field": "description",
-                "embedded_text": document["description"]
-            })
-            i += 1
-
-        if document["preferredLabel"]:
-            insertable_documents.append({
-                **new_document,
-                "embedding": embeddings[i],
-                "embedded_field": "preferredLabel",
-                "embedded_text": document["preferredLabel"]
-            })
-            i += 1
-
         alt_labels = "\n".join(document["altLabels"])
-        if alt_labels:
-            insertable_documents.append({
-                **new_document,
-                "embedding": embeddings[i],
-                "embedded_field": "altLabels",
-                "embedded_text": alt_labels
-            })
-            i += 1
-
-    if len(texts) != i:
-        raise ValueError(f"The number of embeddings generated {len(texts)} does not match the number of texts {i}")
+        for embedded_field, embedded_text in [("description", document["description"]),
+                                              ("preferredLabel", document["preferredLabel"]),
+                                              ("altLabels", alt_labels)]:
+            if embedded_text:
+                embedding_documents.append({
+                    **new_document,
+                    "embedding": embeddings[i],
+                    "embedded_field": embedded_field,
+                    "embedded_text": embedded_text,
+                    "embedded_text_hash": embedded_text_hash(embedded_text)
+                })
+                i += 1
+
+    if len(embeddings) != i:
+        raise ValueError(f"The number of embeddings generated {len(embeddings)} does not match the number of texts {i}")
+    return embedding_documents
+
+
+async def _find_previous_embeddings(*,
+                                    ctx: EmbeddingContext,
+                                    model_ids: list[ObjectId],
+                                    hashes: list[str]) -> dict[str, list[float]]:
+    """
+    Find the embeddings of the texts with the given hashes, in the embeddings of the given models
+    :return: dict[str, list[float]] - the embedding of every hash that was found
+    """
+    cursor = COMPASS_DB[ctx.destination_collection].find(
+        {"modelId": {"$in": model_ids}, "embedded_text_hash": {"$in": list(set(hashes))}},
+        {"_id": 0, "embedded_text_hash": 1, "embedding": 1})
+    return {doc["embedded_text_hash"]: doc["embedding"] async for doc in cursor if doc.get("embedding")}
+
+
+async def generate_and_save_embeddings(*,
+                                       hot_run: bool,
+                                       documents: list[dict[str, Any]],
+                                       ctx: EmbeddingContext,
+                                       embeddings_service: EmbeddingService,
+                                       rate_limiter: _RateLimiter,
+                                       previous_model_id: Optional[ObjectId] = None):
+    """
+    Generate the embeddings for the given documents
+    :param hot_run: bool - if True, the embeddings will be generated and saved
+    :param documents: list[dict[str, any]] - the documents to generate the embeddings for
+    :param ctx: EmbeddingContext - the context
+    :param embeddings_service: EmbeddingService - the embeddings service to use
+    :param rate_limiter: _RateLimiter - the rate limiter shared by the embedding workers
+    :param previous_model_id: ObjectId - in incremental mode, the model to copy the embeddings of the unchanged texts from
+    :return:
+    """
+    texts = _texts_of(documents)
+
+    # In incremental mode, the embeddings of the texts that did not change are copied from the previous model,
+    # or from the current model if they were already generated (e.g. by an interrupted run)
+    embeddings: list[Optional[list[float]]] = [None] * len(texts)
+    if previous_model_id is not None:
+        hashes = [embedded_text_hash(text) for text in texts]
+        previous_embeddings = await _find_previous_embeddings(ctx=ctx,
+                                                              model_ids=[previous_model_id, documents[0]["modelId"]],
+                                                              hashes=hashes)
+        embeddings = [previous_embeddings.get(text_hash) for text_hash in hashes]
+        logger.info(f"Copying the embeddings of {len(texts) - embeddings.count(None)} unchanged texts "
+                    f"from the model {previous_model_id}")
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    texts_to_embed = [texts[i] for i in missing]
+
+    if texts_to_embed and hot_run:
+        await rate_limiter.acquire(len(texts_to_embed))
+        logger.info(f"Generate embeddings for {len(texts_to_embed)} texts")
+        start_time = time.time()
+        new_embeddings = await embeddings_service.embed_batch(texts_to_embed)
+        end_time = time.time()
+        logger.info(f"Time taken to generate embeddings: {end_time - start_time:.2f} seconds for {len(texts_to_embed)} texts, "
+                    f"{len(texts_to_embed) / (end_time - start_time):.2f} texts/seconds")
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+    elif texts_to_embed:
+        # each missing embedding is an empty array
+        for i in missing:
+            embeddings[i] = []
+        logger.info(f"Would generate embeddings for {len(texts_to_embed)} texts")
+
+    embedding_documents = _to_embedding_documents(documents=documents, embeddings=embeddings, ctx=ctx)
+
     if hot_run:
+        # The embeddings are replaced, as the batch may have been partially saved by an interrupted run
+        requests: list[ReplaceOne | DeleteMany] = [
+            ReplaceOne({"modelId": document["modelId"],
+                        ctx.id_field_name: document[ctx.id_field_name],
+                        "embedded_field": document["embedded_field"]}, document, upsert=True)
+            for document in embedding_documents
+        ]
+        if previous_model_id is not None:
+            # The embeddings of the fields that became empty since the embeddings were generated are deleted
+            embedded_fields: dict[ObjectId, list[str]] = {document["_id"]: [] for document in documents}
+            for document in embedding_documents:
+                embedded_fields[document[ctx.id_field_name]].append(document["embedded_field"])
+            requests.extend(DeleteMany({"modelId": documents[0]["modelId"],
+                                        ctx.id_field_name: entity_id,
+                                        "embedded_field": {"$nin": fields}})
+                            for entity_id, fields in embedded_fields.items())
         start_time = time.time()
-        await COMPASS_DB[ctx.destination_collection].insert_many(insertable_documents)
+        await COMPASS_DB[ctx.destination_collection].bulk_write(requests, ordered=False)
         end_time = time.time()
         logger.info(
-            f"Time taken to insert documents in collection {ctx.destination_collection}: {end_time - start_time:.2f} seconds "
-            f"for {len(insertable_documents)} documents, "
-            f"{len(insertable_documents) / (end_time - start_time):.2f} documents/seconds")
+            f"Time taken to save documents in collection {ctx.destination_collection}: {end_time - start_time:.2f} seconds "
+            f"for {len(embedding_documents)} documents, "
+            f"{len(embedding_documents) / (end_time - start_time):.2f} documents/seconds")
+    else:
+        logger.info(f"Would save {len(embedding_documents)} documents in {ctx.destination_collection} collection")
+
+
+async def _backfill_embedded_text_hashes(*, hot_run: bool, ctx: EmbeddingContext, model_id: ObjectId):
+    """
+    Add the hash of the embedded text to the embeddings of a model that were generated without it,
+    so that they can be copied by the incremental mode.
+    """
+    collection = COMPASS_DB[ctx.destination_collection]
+    search_filter = {"modelId": model_id, "embedded_text_hash": {"$exists": False}}
+    if not hot_run:
+        count = await collection.count_documents(search_filter)
+        logger.info(f"Would add the hash of the embedded text to {count} {ctx.collection_schema}s of the model {model_id}")
+        return
+
+    batch_size = 1000
+    updates = []
+    count = 0
+    async for document in collection.find(search_filter, {"_id": 1, "embedded_text": 1}).batch_size(batch_size):
+        updates.append(UpdateOne({"_id": document["_id"]},
+                                 {"$set": {"embedded_text_hash": embedded_text_hash(document["embedded_text"])}}))
+        if len(updates) == batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            count += len(updates)
+            updates = []
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        count += len(updates)
+    logger.info(f"Added the hash of the embedded text to {count} {ctx.collection_schema}s of the model {model_id}")
+
+
+async def _delete_removed_documents(*, hot_run: bool, ctx: EmbeddingContext, search_filter: dict[str, Any]):
+    """
+    Delete the embeddings of the documents that are no longer in the source collection, or that are now excluded.
+    """
+    model_id = search_filter["modelId"]
+    source_ids = await PLATFORM_DB[ctx.source_collection].distinct("_id", search_filter)
+    removed_filter = {"modelId": model_id, ctx.id_field_name: {"$nin": source_ids}}
+    if hot_run:
+        result = await COMPASS_DB[ctx.destination_collection].delete_many(removed_filter)
+        logger.info(f"Deleted {result.deleted_count} embeddings of removed {ctx.collection_schema}s")
     else:
-        logger.info(f"Would insert {len(insertable_documents)} documents in {ctx.destination_collection} collection")
+        count = await COMPASS_DB[ctx.destination_collection].count_documents(removed_filter)
+        logger.info(f"Would delete {count} embeddings of removed {ctx.collection_schema}s")
 
 
-async def process_schema(*, hot_run: bool, ctx: EmbeddingContext, embeddings_service: EmbeddingService):
+async def process_schema(*, hot_run: bool, ctx: EmbeddingContext, embeddings_service: EmbeddingService,
+                         workers: int = _DEFAULT_EMBEDDING_WORKERS, rate_limiter: Optional[_RateLimiter] = None,
+                         previous_model_id: Optional[ObjectId] = None):
     """
     Process the documents collection
+
+    The documents are streamed from the source collection, embedded by a bounded pool of concurrent workers and saved
+    in batches, and the progress is checkpointed, so that an interrupted run resumes where it left off.
+
+    In incremental mode (if previous_model_id is given), all the documents are processed, but only the new and changed
+    texts are embedded, the embeddings of the unchanged texts are copied from the previous model.
+    The embeddings of the removed documents and of the emptied fields are deleted.
     :return:
     """
     logger.info(f"Processing documents: {ctx.collection_schema}")
+    rate_limiter = rate_limiter or _RateLimiter(0)
 
     # Define the context
     # it is used to define the source and destination collections
@@ -194,16 +336,14 @@ async def process_schema(*, hot_run: bool, ctx: EmbeddingContext, embeddings_ser
 
     from_collection = PLATFORM_DB[ctx.source_collection]
     to_collection = COMPASS_DB[ctx.destination_collection]
+    model_id = ObjectId(SCRIPT_SETTINGS.tabiya_model_id)
 
     logger.info(
         f"[1/2] copying the {ctx.collection_schema}s documents from {from_collection.name} to {to_collection.name}")
 
     # Define the search filter
-    # check all ids in the to_collection where the embeddings are already generated
-    done_ids = await to_collection.distinct(ctx.id_field_name, {"modelId": ObjectId(SCRIPT_SETTINGS.tabiya_model_id)})
-    logger.info(f"Found {len(done_ids)} documents already processed for {ctx.collection_schema}")
     search_filter = {
-        "modelId": ObjectId(SCRIPT_SETTINGS.tabiya_model_id),
+        "modelId": model_id,
         "code": {
             "$nin": ctx.excluded_codes
         }
@@ -211,31 +351,69 @@ async def process_schema(*, hot_run: bool, ctx: EmbeddingContext, embeddings_ser
     # Find all the documents that are relevant in the source collection
     all_relevant_documents_count = await from_collection.count_documents(search_filter)
     logger.info(f"Found {all_relevant_documents_count} documents in the source collection for {ctx.collection_schema}")
-    # Find all the documents that were not copied in a previous run
-    search_filter["_id"] = {
-        "$nin": done_ids
-    }
+
+    # Find all the documents that were not processed in a previous run
+    checkpoint = await BatchCheckpoint.load(hot_run=hot_run,
+                                            collection=COMPASS_DB[_CHECKPOINTS_COLLECTION],
+                                            key={"modelId": model_id, "collectionSchema": ctx.collection_schema})
+    if previous_model_id is not None:
+        # The unchanged texts are not embedded again, it is cheaper to process all the documents
+        # than to find the documents that changed
+        logger.info(f"Updating the {ctx.collection_schema}s incrementally from the model {previous_model_id}")
+        await _backfill_embedded_text_hashes(hot_run=hot_run, ctx=ctx, model_id=previous_model_id)
+        await _delete_removed_documents(hot_run=hot_run, ctx=ctx, search_filter=dict(search_filter))
+    elif checkpoint.last_source_id is not None:
+        logger.info(f"Resuming {ctx.collection_schema}s after the document {checkpoint.last_source_id}")
+        search_filter["_id"] = {
+            "$gt": checkpoint.last_source_id
+        }
+    else:
+        # check all ids in the to_collection where the embeddings are already generated (by a run without checkpoints)
+        done_ids = await to_collection.distinct(ctx.id_field_name, {"modelId": model_id})
+        logger.info(f"Found {len(done_ids)} documents already processed for {ctx.collection_schema}")
+        search_filter["_id"] = {
+            "$nin": done_ids
+        }
     documents_to_process_count = await from_collection.count_documents(search_filter)
     if documents_to_process_count == 0:
         logger.info(f"No documents to process for {ctx.collection_schema}")
         return
 
+    if hot_run:
+        # The embeddings are saved by (modelId, id, embedded_field), the unique index is needed before saving them.
+        # It is created again with the other indexes at the end of the script.
+        await to_collection.create_index({"modelId": 1, ctx.id_field_name: 1, "embedded_field": 1},
+                                         name=f"model_id_and_{ctx.id_field_name}_index", unique=True)
+        if previous_model_id is not None:
+            await to_collection.create_index({"modelId": 1, "embedded_text_hash": 1}, name="embedded_text_hash_index")
+
     progress = tqdm(
         desc=f'generating embeddings for {ctx.collection_schema}',
         total=documents_to_process_count,
     )
 
     # Set the batch size
-    # The batch size is the amount of documents to insert in one batch.
+    # The batch size is the amount of documents to embed and save in one batch.
+    # The queue holds a few batches per worker, so that the workers do not wait for the cursor,
+    # without reading the whole collection in memory.
     batch_size = 500
-    cursor = from_collection.find(search_filter).batch_size(batch_size)
-    documents = await cursor.to_list(length=None)
-    for i in range(0, len(documents), batch_size):
-        batch = documents[i:i + batch_size]
-        if batch:  # double-check just in case
-            progress.update(len(batch))
+    batches: asyncio.Queue[Optional[tuple[int, list[dict[str, Any]]]]] = asyncio.Queue(maxsize=2 * workers)
+
+    async def _embed_batches():
+        while (item := await batches.get()) is not None:
+            batch_number, batch = item
             await generate_and_save_embeddings(hot_run=hot_run, documents=batch, ctx=ctx,
-                                               embeddings_service=embeddings_service)
+                                               embeddings_service=embeddings_service, rate_limiter=rate_limiter,
+                                               previous_model_id=previous_model_id)
+            await checkpoint.complete(batch_number=batch_number, last_source_id=batch[-1]["_id"])
+            progress.update(len(batch))
+
+    # If a worker fails, the other tasks are cancelled, and the next run resumes from the checkpoint
+    async with asyncio.TaskGroup() as task_group:
+        cursor = from_collection.find(search_filter).sort("_id", 1).batch_size(batch_size)
+        task_group.create_task(read_batches(cursor, batches, batch_size, workers))
+        for _ in range(workers):
+            task_group.create_task(_embed_batches())
 
     # Close the progress bar
     progress.close()
@@ -310,29 +488,64 @@ async def _copy_model_info(*, hot_run: bool, embeddings_service: EmbeddingServic
             f"Would upsert the model info document in {CompassEmbeddingsCollections.MODEL_INFO.value} collection")
 
 
-async def copy_relations_collection(*, hot_run: bool = False):
+async def _check_previous_model(*, previous_model_id: ObjectId, embeddings_service: EmbeddingService):
+    """
+    Check that the embeddings of the previous model can be copied to the current model,
+    they must have been generated by the same embeddings service and model.
+    """
+    previous_model_info = await COMPASS_DB[CompassEmbeddingsCollections.MODEL_INFO.value].find_one({"modelId": previous_model_id})
+    if not previous_model_info:
+        raise ValueError(f"The embeddings of the previous model with modelid:{previous_model_id} were not found.")
+    previous_embeddings_service = previous_model_info.get("embeddingsService") or {}
+    if (previous_embeddings_service.get("service_name") != embeddings_service.service_name or
+            previous_embeddings_service.get("model_name") != embeddings_service.model_name):
+        error = ValueError(
+            f"The embeddings of the previous model with modelid:{previous_model_id} were generated with a different "
+            f"embeddings service: {previous_embeddings_service.get('service_name')} or model: "
+            f"{previous_embeddings_service.get('model_name')}, they cannot be copied.")
+        logger.error(error)
+        raise error
+
+
+async def copy_relations_collection(*, hot_run: bool = False, incremental: bool = False):
     """
     Copy the relations collection from the platform database to the compass database
+    :param incremental: bool - if True, all the relations are copied again, so that the relations that changed are
+                        updated, and the relations that were removed from the platform database are deleted
     :return:
     """
 
     from_collection = PLATFORM_DB[PlatformCollections.RELATIONS.value]
     to_collection = COMPASS_DB[CompassEmbeddingsCollections.RELATIONS.value]
+    model_id = ObjectId(SCRIPT_SETTINGS.tabiya_model_id)
 
     logger.info(f"[1/2] Copying the relations documents from {from_collection.name} to {to_collection.name}")
 
-    # Currently the embeddings of a model are generated only once.
-    # Find all the documents that were not copied in a previous run.
-    # Completed ids are the ids of the documents that were already copied.
-    # The source_id is used to keep track of the original document id,
-    # it is found in the source_id field, it's insertion happens in the next step.
-    completed_ids = await to_collection.distinct("source_id", {"modelId": ObjectId(SCRIPT_SETTINGS.tabiya_model_id)})
-    search_filter = {
-        "modelId": ObjectId(SCRIPT_SETTINGS.tabiya_model_id),
-        "_id": {
-            "$nin": completed_ids
+    if incremental:
+        source_ids = await from_collection.distinct("_id", {"modelId": model_id})
+        removed_filter = {"modelId": model_id, "source_id": {"$nin": source_ids}}
+        if hot_run:
+            result = await to_collection.delete_many(removed_filter)
+            logger.info(f"Deleted {result.deleted_count} removed relations")
+        else:
+            logger.info(f"Would delete {await to_collection.count_documents(removed_filter)} removed relations")
+
+        # A relation can change without changing its _id, and the relations are cheap to copy,
+        # so all of them are replaced.
+        search_filter = {"modelId": model_id}
+    else:
+        # Currently the embeddings of a model are generated only once.
+        # Find all the documents that were not copied in a previous run.
+        # Completed ids are the ids of the documents that were already copied.
+        # The source_id is used to keep track of the original document id,
+        # it is found in the source_id field, it's insertion happens in the next step.
+        completed_ids = await to_collection.distinct("source_id", {"modelId": model_id})
+        search_filter = {
+            "modelId": model_id,
+            "_id": {
+                "$nin": completed_ids
+            }
         }
-    }
 
     documents_to_process_count = await from_collection.count_documents(search_filter)
     if documents_to_process_count == 0:
@@ -345,6 +558,20 @@ async def copy_relations_collection(*, hot_run: bool = False):
 
     )
 
+    async def _save(documents: list[dict[str, Any]]):
+        progress.update(len(documents))
+        if not hot_run:
+            logger.info(f"Would save a batch of {len(documents)} relations")
+        elif incremental:
+            logger.info(f"Replacing a batch of {len(documents)} relations")
+            await to_collection.bulk_write([
+                ReplaceOne({"modelId": document["modelId"], "source_id": document["source_id"]}, document, upsert=True)
+                for document in documents
+            ], ordered=False)
+        else:
+            logger.info(f"Inserting a batch of {len(documents)} relations")
+            await to_collection.insert_many(documents)
+
     # Set the batch size
     # The batch size is the number of documents to insert in one batch
     batch_size = 5000
@@ -363,21 +590,11 @@ async def copy_relations_collection(*, hot_run: bool = False):
         documents.append(new_document)
 
         if len(documents) == batch_size:
-            progress.update(batch_size)
-            if hot_run:
-                logger.info(f"Inserting a batch of {len(documents)} relations")
-                await to_collection.insert_many(documents)
-            else:
-                logger.info(f"Would insert a batch of {len(documents)} relations")
+            await _save(documents)
             documents = []
 
     if len(documents) > 0:
-        progress.update(len(documents))
-        if hot_run:
-            logger.info(f"Inserting a batch of {len(documents)} relations")
-            await to_collection.insert_many(documents)
-        else:
-            logger.info(f"Would insert a batch of {len(documents)} relations")
+        await _save(documents)
 
     progress.close()
 
@@ -408,9 +625,9 @@ async def main(opts: Options):
     if opts.generate_embeddings:
         if opts.delete_existing:
             # Delete existing relations and model info collections
-            for collection in CompassEmbeddingsCollections:
+            for collection_name in [collection.value for collection in CompassEmbeddingsCollections] + [_CHECKPOINTS_COLLECTION]:
                 await delete_existing(hot_run=opts.hot_run,
-                                      collection_name=collection.value,
+                                      collection_name=collection_name,
                                       model_id=SCRIPT_SETTINGS.tabiya_model_id)
 
         embeddings_service = await get_embeddings_service(service_name=SCRIPT_SETTINGS.embeddings_service_name,
@@ -418,17 +635,27 @@ async def main(opts: Options):
 
         await _copy_model_info(hot_run=opts.hot_run, embeddings_service=embeddings_service)
 
+        previous_model_id = ObjectId(opts.previous_model_id) if opts.previous_model_id else None
+        if previous_model_id is not None:
+            await _check_previous_model(previous_model_id=previous_model_id, embeddings_service=embeddings_service)
+
+        # the occupations and the skills share the quota of the embeddings service
+        rate_limiter = _RateLimiter(opts.max_texts_per_minute)
+
         # run the three tasks in parallel
         await asyncio.gather(
             # [2/5] Copy the relations collection
-            copy_relations_collection(hot_run=opts.hot_run),
+            copy_relations_collection(hot_run=opts.hot_run, incremental=previous_model_id is not None),
 
             # [3/5] Process the occupations
             process_schema(hot_run=opts.hot_run, ctx=_OCCUPATIONS_EMBEDDING_CONTEXT,
-                           embeddings_service=embeddings_service),
+                           embeddings_service=embeddings_service, workers=opts.embedding_workers,
+                           rate_limiter=rate_limiter, previous_model_id=previous_model_id),
 
             # [4/5] Process the skills
-            process_schema(hot_run=opts.hot_run, ctx=_SKILLS_EMBEDDING_CONTEXT, embeddings_service=embeddings_service),
+            process_schema(hot_run=opts.hot_run, ctx=_SKILLS_EMBEDDING_CONTEXT, embeddings_service=embeddings_service,
+                           workers=opts.embedding_workers, rate_limiter=rate_limiter,
+                           previous_model_id=previous_model_id),
         )
 
     # [5/5] Create the indexes
@@ -475,6 +702,29 @@ if __name__ == "__main__":
             choices=[768, 3072],
             help="The number of dimensions for the embeddings"
         )
+        options_group.add_argument(
+            "--previous-model-id",
+            type=str,
+            required=False,
+            default=None,
+            help="Incremental mode: only embed the new and changed texts, and copy the embeddings of the unchanged texts "
+                 "from the embeddings of this model (it can be the same model, to update it after the taxonomy changed)"
+        )
+        options_group.add_argument(
+            "--embedding-workers",
+            type=int,
+            required=False,
+            default=_DEFAULT_EMBEDDING_WORKERS,
+            help="The number of batches of each schema embedded concurrently"
+        )
+        options_group.add_argument(
+            "--max-texts-per-minute",
+            type=int,
+            required=False,
+            default=0,
+            help="The maximum number of texts embedded per minute, to stay within the quota of the embeddings service "
+                 "(0 for no limit, the rate limit errors are retried with an exponential backoff)"
+        )
 
         args = parser.parse_args()
 
@@ -489,7 +739,10 @@ if __name__ == "__main__":
             num_of_dimensions=args.num_of_dimensions,
             delete_existing=args.delete_existing,
             generate_embeddings=generate_embeddings,
-            generate_indexes=True
+            generate_indexes=True,
+            embedding_workers=args.embedding_workers,
+            max_texts_per_minute=args.max_texts_per_minute,
+            previous_model_id=args.previous_model_id
         )
 
         asyncio.run(main(_options))
@@ -0,0 +1,170 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from bson import ObjectId
+
+from scripts.embeddings._common import BatchCheckpoint, read_batches
+
+
+def _get_checkpoints_collection(checkpoint: dict | None = None) -> AsyncMock:
+    collection = AsyncMock()
+    collection.find_one.return_value = checkpoint
+    return collection
+
+
+class _AsyncCursor:
+    def __init__(self, documents: list[dict], error: Exception | None = None):
+        self._documents = documents
+        self._error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents:
+            yield document
+        if self._error:
+            raise self._error
+
+    async def close(self):
+        self.closed = True
+
+
+def _drain(queue: asyncio.Queue) -> list:
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def _saved_source_ids(collection: AsyncMock) -> list[ObjectId]:
+    return [call.args[1]["$set"]["lastSourceId"] for call in collection.update_one.call_args_list]
+
+
+class TestBatchCheckpoint:
+    @pytest.mark.asyncio
+    async def test_load_without_previous_run(self):
+        # GIVEN no checkpoint was saved by a previous run
+        given_key = {"modelId": ObjectId(), "collectionSchema": "skill"}
+        given_collection = _get_checkpoints_collection(None)
+
+        # WHEN the checkpoint is loaded
+        actual_checkpoint = await BatchCheckpoint.load(hot_run=True, collection=given_collection, key=given_key)
+
+        # THEN the checkpoint is looked up by its key
+        given_collection.find_one.assert_awaited_once_with(given_key)
+        # AND the run starts from the beginning
+        assert actual_checkpoint.last_source_id is None
+
+    @pytest.mark.asyncio
+    async def test_load_resumes_after_the_saved_source_id(self):
+        # GIVEN a checkpoint was saved by a previous run
+        given_key = {"modelId": ObjectId(), "collectionSchema": "occupation"}
+        given_last_source_id = ObjectId()
+        given_collection = _get_checkpoints_collection({**given_key, "lastSourceId": given_last_source_id})
+
+        # WHEN the checkpoint is loaded
+        actual_checkpoint = await BatchCheckpoint.load(hot_run=True, collection=given_collection, key=given_key)
+
+        # THEN the run resumes after the saved source id
+        assert actual_checkpoint.last_source_id == given_last_source_id
+
+    @pytest.mark.asyncio
+    async def test_complete_out_of_order_batches(self):
+        # GIVEN a checkpoint of a hot run
+        given_key = {"modelId": ObjectId(), "collectionSchema": "skill"}
+        given_collection = _get_checkpoints_collection()
+        checkpoint = BatchCheckpoint(hot_run=True, collection=given_collection, key=given_key, last_source_id=None)
+        # AND the last source ids of three batches
+        given_source_ids = [ObjectId() for _ in range(3)]
+
+        # WHEN the batch 2 completes first
+        await checkpoint.complete(batch_number=2, last_source_id=given_source_ids[2])
+        # THEN the checkpoint does not advance, the batches 0 and 1 may not be saved yet
+        assert checkpoint.last_source_id is None
+        given_collection.update_one.assert_not_awaited()
+
+        # WHEN the batch 0 completes
+        await checkpoint.complete(batch_number=0, last_source_id=given_source_ids[0])
+        # THEN the checkpoint advances to the end of the batch 0 only
+        assert checkpoint.last_source_id == given_source_ids[0]
+
+        # WHEN the batch 1 completes
+        await checkpoint.complete(batch_number=1, last_source_id=given_source_ids[1])
+        # THEN the checkpoint advances to the end of the batch 2
+        assert checkpoint.last_source_id == given_source_ids[2]
+
+        # AND the checkpoint is saved every time it advances
+        assert _saved_source_ids(given_collection) == [given_source_ids[0], given_source_ids[2]]
+        # AND it is upserted by its key
+        for call in given_collection.update_one.call_args_list:
+            assert call.args[0] == given_key
+            assert call.kwargs == {"upsert": True}
+
+    @pytest.mark.asyncio
+    async def test_complete_concurrent_batches(self):
+        # GIVEN a checkpoint of a hot run
+        given_collection = _get_checkpoints_collection()
+        checkpoint = BatchCheckpoint(hot_run=True, collection=given_collection, key={}, last_source_id=None)
+        # AND the last source ids of many batches, in the order of the _id
+        given_source_ids = sorted(ObjectId() for _ in range(20))
+
+        # WHEN the batches complete concurrently, in reverse order
+        await asyncio.gather(*[checkpoint.complete(batch_number=batch_number, last_source_id=given_source_ids[batch_number])
+                               for batch_number in reversed(range(len(given_source_ids)))])
+
+        # THEN the checkpoint is at the end of the last batch
+        assert checkpoint.last_source_id == given_source_ids[-1]
+        # AND the saved checkpoints never go backwards
+        actual_saved_source_ids = _saved_source_ids(given_collection)
+        assert actual_saved_source_ids == sorted(actual_saved_source_ids)
+        assert actual_saved_source_ids[-1] == given_source_ids[-1]
+
+    @pytest.mark.asyncio
+    async def test_complete_dry_run_does_not_persist(self):
+        # GIVEN a checkpoint of a dry run
+        given_collection = _get_checkpoints_collection()
+        checkpoint = BatchCheckpoint(hot_run=False, collection=given_collection, key={}, last_source_id=None)
+        given_source_ids = [ObjectId() for _ in range(2)]
+
+        # WHEN the batches complete
+        await checkpoint.complete(batch_number=1, last_source_id=given_source_ids[1])
+        await checkpoint.complete(batch_number=0, last_source_id=given_source_ids[0])
+
+        # THEN the progress is tracked
+        assert checkpoint.last_source_id == given_source_ids[1]
+        # AND the checkpoint is not saved
+        given_collection.update_one.assert_not_awaited()
+
+
+class TestReadBatches:
+    @pytest.mark.asyncio
+    async def test_read_numbered_batches_then_stop_every_consumer(self):
+        # GIVEN a cursor of 5 documents
+        given_documents = [{"_id": ObjectId()} for _ in range(5)]
+        given_cursor = _AsyncCursor(given_documents)
+        # AND a queue
+        given_queue = asyncio.Queue()
+
+        # WHEN the documents are read in batches of 2 for 3 consumers
+        await read_batches(given_cursor, given_queue, 2, 3)
+
+        # THEN the documents are put in the queue in numbered batches, the last one partial
+        # AND a None is put for each consumer
+        assert _drain(given_queue) == [(0, given_documents[0:2]), (1, given_documents[2:4]), (2, given_documents[4:]),
+                                       None, None, None]
+        # AND the cursor is closed
+        assert given_cursor.closed
+
+    @pytest.mark.asyncio
+    async def test_close_the_cursor_on_error(self):
+        # GIVEN a cursor that fails after the first document
+        given_error = RuntimeError("cursor failed")
+        given_cursor = _AsyncCursor([{"_id": ObjectId()}], error=given_error)
+
+        # WHEN the documents are read
+        # THEN the error is raised
+        with pytest.raises(RuntimeError) as error_info:
+            await read_batches(given_cursor, asyncio.Queue(), 2, 1)
+        assert error_info.value is given_error
+        # AND the cursor is closed
+        assert given_cursor.closed
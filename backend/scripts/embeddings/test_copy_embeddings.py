@@ -0,0 +1,94 @@
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+from scripts.embeddings.copy_embeddings import _bulk_insert
+
+
+def _get_ops(count: int) -> list[InsertOne]:
+    return [InsertOne({"_id": ObjectId()}) for _ in range(count)]
+
+
+def _get_duplicate_key_error(index: int, key_pattern: dict) -> dict:
+    return {"index": index, "code": 11000, "keyPattern": key_pattern, "errmsg": "E11000 duplicate key error"}
+
+
+def _get_target_collection(*, inserted_count: int = 0, error: BulkWriteError = None) -> AsyncMock:
+    collection = AsyncMock()
+    collection.name = "foo"
+    if error:
+        collection.bulk_write.side_effect = error
+    else:
+        collection.bulk_write.return_value = Mock(inserted_count=inserted_count)
+    return collection
+
+
+class TestBulkInsert:
+    @pytest.mark.asyncio
+    async def test_insert_all_the_documents(self):
+        # GIVEN documents that are not in the target collection
+        given_ops = _get_ops(3)
+        given_collection = _get_target_collection(inserted_count=3)
+
+        # WHEN the documents are inserted
+        actual_inserted = await _bulk_insert(target_col=given_collection, ops=given_ops)
+
+        # THEN all the documents are inserted
+        assert actual_inserted == 3
+        given_collection.bulk_write.assert_awaited_once_with(given_ops, ordered=False)
+
+    @pytest.mark.asyncio
+    async def test_skip_the_documents_already_copied(self):
+        # GIVEN documents of which 2 were already copied by an interrupted run
+        given_ops = _get_ops(5)
+        given_collection = _get_target_collection(error=BulkWriteError({
+            "nInserted": 3,
+            "writeErrors": [_get_duplicate_key_error(0, {"_id": 1}), _get_duplicate_key_error(3, {"_id": 1})],
+            "writeConcernErrors": [],
+        }))
+
+        # WHEN the documents are inserted
+        actual_inserted = await _bulk_insert(target_col=given_collection, ops=given_ops)
+
+        # THEN the documents already copied are skipped
+        # AND only the documents actually inserted are counted
+        assert actual_inserted == 3
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("given_key_pattern", [
+        {"modelId": 1, "skillId": 1, "embedded_field": 1},
+        {"modelId": 1},
+        {"modelId": 1, "source_id": 1},
+    ], ids=["model_id_and_id_index", "model_id_index", "model_id_and_source_id_index"])
+    async def test_raise_on_duplicate_key_of_another_unique_index(self, given_key_pattern: dict):
+        # GIVEN a document that conflicts with a different document on a unique index other than the _id
+        given_error = BulkWriteError({
+            "nInserted": 1,
+            "writeErrors": [_get_duplicate_key_error(0, {"_id": 1}), _get_duplicate_key_error(1, given_key_pattern)],
+            "writeConcernErrors": [],
+        })
+        given_collection = _get_target_collection(error=given_error)
+
+        # WHEN the documents are inserted
+        # THEN the conflict is raised
+        with pytest.raises(BulkWriteError) as error_info:
+            await _bulk_insert(target_col=given_collection, ops=_get_ops(3))
+        assert error_info.value is given_error
+
+    @pytest.mark.asyncio
+    async def test_raise_on_other_write_errors(self):
+        # GIVEN a write error that is not a duplicate key
+        given_error = BulkWriteError({
+            "nInserted": 0,
+            "writeErrors": [{"index": 0, "code": 121, "errmsg": "Document failed validation"}],
+            "writeConcernErrors": [],
+        })
+        given_collection = _get_target_collection(error=given_error)
+
+        # WHEN the documents are inserted
+        # THEN the error is raised
+        with pytest.raises(BulkWriteError):
+            await _bulk_insert(target_col=given_collection, ops=_get_ops(1))
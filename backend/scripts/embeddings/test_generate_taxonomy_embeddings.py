@@ -0,0 +1,355 @@
+from typing import Awaitable
+from unittest.mock import AsyncMock
+
+import pytest
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from app.vector_search.test_utils import FakeEmbeddingService
+from common_libs.test_utilities.setup_env_vars import setup_env_vars, teardown_env_vars
+from conftest import drop_database_and_close_client, random_db_name
+from _base_data_settings import CompassEmbeddingsCollections, PlatformCollections
+
+_GIVEN_MODEL_ID = ObjectId()
+
+# The settings of the script are loaded when it is imported
+setup_env_vars(env_vars=dict(
+    EMBEDDINGS_SCRIPT_TABIYA_MONGODB_URI="mongodb://foo",
+    EMBEDDINGS_SCRIPT_TABIYA_DB_NAME="foo",
+    EMBEDDINGS_SCRIPT_TABIYA_MODEL_ID=str(_GIVEN_MODEL_ID),
+    EMBEDDINGS_SCRIPT_COMPASS_TAXONOMY_DB_URI="mongodb://foo",
+    EMBEDDINGS_SCRIPT_COMPASS_TAXONOMY_DB_NAME="foo",
+    EMBEDDINGS_SCRIPT_EMBEDDINGS_SERVICE_NAME="fake-service",
+    EMBEDDINGS_SCRIPT_EMBEDDINGS_MODEL_NAME="fake-model",
+))
+from scripts.embeddings import generate_taxonomy_embeddings  # noqa: E402
+from scripts.embeddings.generate_taxonomy_embeddings import _CHECKPOINTS_COLLECTION, _RateLimiter, \
+    _SKILLS_EMBEDDING_CONTEXT, _texts_of  # noqa: E402
+
+teardown_env_vars()
+
+# The number of documents embedded and saved in one batch by process_schema
+_BATCH_SIZE = 500
+
+
+def _get_skill(i: int, *, model_id: ObjectId = _GIVEN_MODEL_ID) -> dict:
+    return {
+        "_id": ObjectId(),
+        "UUID": f"uuid-{i}",
+        "UUIDHistory": [f"uuid-{i}"],
+        "modelId": model_id,
+        "preferredLabel": f"skill {i}",
+        "altLabels": [f"alt label {i}"],
+        "description": f"description {i}",
+        "skillType": "skill/competence",
+        "scopeNote": "",
+    }
+
+
+async def _get_embedded_skill_ids(compass_db: AsyncIOMotorDatabase) -> set[ObjectId]:
+    return set(await compass_db[CompassEmbeddingsCollections.SKILLS.value].distinct("skillId",
+                                                                                    {"modelId": _GIVEN_MODEL_ID}))
+
+
+async def _get_checkpoint(compass_db: AsyncIOMotorDatabase) -> dict | None:
+    return await compass_db[_CHECKPOINTS_COLLECTION].find_one({"modelId": _GIVEN_MODEL_ID, "collectionSchema": "skill"})
+
+
+@pytest.fixture(scope="function")
+async def given_databases(in_memory_mongo_server, request, mocker) -> tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]:
+    """
+    The platform and the compass databases of the script, in the in-memory MongoDB server.
+    """
+    client = AsyncIOMotorClient(in_memory_mongo_server.connection_string, tlsAllowInvalidCertificates=True)
+    platform_db = client.get_database(random_db_name())
+    compass_db = client.get_database(random_db_name())
+    for db in [platform_db, compass_db]:
+        request.addfinalizer(
+            lambda db_name=db.name: drop_database_and_close_client(client, in_memory_mongo_server.connection_string,
+                                                                   db_name))
+    mocker.patch.object(generate_taxonomy_embeddings, "PLATFORM_DB", platform_db)
+    mocker.patch.object(generate_taxonomy_embeddings, "COMPASS_DB", compass_db)
+    return platform_db, compass_db
+
+
+class TestRateLimiter:
+    @pytest.mark.asyncio
+    async def test_no_limit(self, mocker):
+        # GIVEN a rate limiter without limit
+        rate_limiter = _RateLimiter(0)
+        sleep_spy = mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+
+        # WHEN many texts are acquired
+        for _ in range(10):
+            await rate_limiter.acquire(1000)
+
+        # THEN it never waits
+        sleep_spy.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_spreads_the_texts_over_the_minute(self, mocker):
+        # GIVEN a rate limiter of 600 texts per minute, so 0.1 seconds per text
+        rate_limiter = _RateLimiter(600)
+        # AND the time does not pass
+        given_time = mocker.patch.object(generate_taxonomy_embeddings, "time")
+        given_time.monotonic.return_value = 100.0
+        sleep_spy = mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+
+        # WHEN 10 texts are acquired
+        await rate_limiter.acquire(10)
+        # THEN they are not delayed
+        sleep_spy.assert_not_awaited()
+
+        # WHEN 5 more texts are acquired
+        await rate_limiter.acquire(5)
+        # THEN they wait for the time of the first 10 texts
+        sleep_spy.assert_awaited_once_with(pytest.approx(1.0))
+
+        # WHEN 1 more text is acquired
+        sleep_spy.reset_mock()
+        await rate_limiter.acquire(1)
+        # THEN it waits for the time of the first 15 texts
+        sleep_spy.assert_awaited_once_with(pytest.approx(1.5))
+
+    @pytest.mark.asyncio
+    async def test_does_not_burst_after_idle_time(self, mocker):
+        # GIVEN a rate limiter of 600 texts per minute, so 0.1 seconds per text
+        rate_limiter = _RateLimiter(600)
+        given_time = mocker.patch.object(generate_taxonomy_embeddings, "time")
+        given_time.monotonic.return_value = 100.0
+        sleep_spy = mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+        # AND 10 texts were acquired
+        await rate_limiter.acquire(10)
+
+        # WHEN the rate limiter is idle for a long time
+        given_time.monotonic.return_value = 200.0
+        # AND 10 texts are acquired
+        await rate_limiter.acquire(10)
+        # THEN they are not delayed
+        sleep_spy.assert_not_awaited()
+
+        # BUT the idle time is not saved for later, the next text waits for the 10 texts
+        await rate_limiter.acquire(1)
+        sleep_spy.assert_awaited_once_with(pytest.approx(1.0))
+
+
+class TestProcessSchema:
+    @pytest.mark.asyncio
+    async def test_embeds_all_the_documents_with_concurrent_workers(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN skills that span several batches
+        given_skills = [_get_skill(i) for i in range(2 * _BATCH_SIZE + 123)]
+        await platform_db[PlatformCollections.SKILLS.value].insert_many(given_skills)
+        # AND an embeddings service
+        given_embeddings_service = FakeEmbeddingService()
+
+        # WHEN the skills are processed by concurrent workers
+        await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=given_embeddings_service, workers=3)
+
+        # THEN every text is embedded once
+        actual_texts = [text for call in given_embeddings_service.calls for text in call]
+        assert sorted(actual_texts) == sorted(_texts_of(given_skills))
+        # AND the embeddings of every embedded field of every skill are saved
+        actual_embeddings = await compass_db[CompassEmbeddingsCollections.SKILLS.value].find(
+            {"modelId": _GIVEN_MODEL_ID}).to_list(length=None)
+        assert len(actual_embeddings) == 3 * len(given_skills)
+        for actual_embedding in actual_embeddings:
+            assert actual_embedding["embedding"] == [float(len(actual_embedding["embedded_text"]))]
+        # AND the checkpoint is after the last skill
+        actual_checkpoint = await _get_checkpoint(compass_db)
+        assert actual_checkpoint["lastSourceId"] == given_skills[-1]["_id"]
+
+    @pytest.mark.asyncio
+    async def test_resumes_after_the_checkpoint(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN skills that span several batches
+        given_skills = [_get_skill(i) for i in range(2 * _BATCH_SIZE)]
+        await platform_db[PlatformCollections.SKILLS.value].insert_many(given_skills)
+        # AND a previous run was interrupted after saving the first 600 skills
+        given_resumed_skills = given_skills[600:]
+        await compass_db[_CHECKPOINTS_COLLECTION].insert_one({"modelId": _GIVEN_MODEL_ID, "collectionSchema": "skill",
+                                                              "lastSourceId": given_skills[599]["_id"]})
+        given_embeddings_service = FakeEmbeddingService()
+
+        # WHEN the skills are processed again
+        await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=given_embeddings_service, workers=2)
+
+        # THEN only the skills after the checkpoint are embedded
+        actual_texts = [text for call in given_embeddings_service.calls for text in call]
+        assert sorted(actual_texts) == sorted(_texts_of(given_resumed_skills))
+        assert await _get_embedded_skill_ids(compass_db) == {skill["_id"] for skill in given_resumed_skills}
+        # AND the checkpoint is after the last skill
+        actual_checkpoint = await _get_checkpoint(compass_db)
+        assert actual_checkpoint["lastSourceId"] == given_skills[-1]["_id"]
+
+    @pytest.mark.asyncio
+    async def test_failing_batch_stops_the_checkpoint(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN skills that span three batches
+        given_skills = [_get_skill(i) for i in range(3 * _BATCH_SIZE)]
+        await platform_db[PlatformCollections.SKILLS.value].insert_many(given_skills)
+        # AND the embedding of a text of the second batch fails
+        given_embeddings_service = FakeEmbeddingService(failing_texts={given_skills[_BATCH_SIZE + 10]["description"]})
+
+        # WHEN the skills are processed
+        # THEN the processing fails
+        with pytest.raises(Exception):
+            await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                              embeddings_service=given_embeddings_service, workers=3)
+
+        # AND the failed batch is not saved
+        actual_embedded_skill_ids = await _get_embedded_skill_ids(compass_db)
+        assert actual_embedded_skill_ids.isdisjoint(skill["_id"] for skill in given_skills[_BATCH_SIZE:2 * _BATCH_SIZE])
+        # AND the checkpoint does not go past the failed batch, so the next run processes it again
+        actual_checkpoint = await _get_checkpoint(compass_db)
+        assert actual_checkpoint is None or actual_checkpoint["lastSourceId"] == given_skills[_BATCH_SIZE - 1]["_id"]
+
+    @pytest.mark.asyncio
+    async def test_dry_run(self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN some skills
+        given_skills = [_get_skill(i) for i in range(10)]
+        await platform_db[PlatformCollections.SKILLS.value].insert_many(given_skills)
+        given_embeddings_service = FakeEmbeddingService()
+
+        # WHEN the skills are processed in a dry run
+        await generate_taxonomy_embeddings.process_schema(hot_run=False, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=given_embeddings_service)
+
+        # THEN nothing is embedded
+        assert given_embeddings_service.calls == []
+        # AND nothing is saved
+        assert await _get_embedded_skill_ids(compass_db) == set()
+        # AND the checkpoint is not saved
+        assert await _get_checkpoint(compass_db) is None
+
+
+async def _save_embeddings(compass_db: AsyncIOMotorDatabase, skill: dict, embeddings: list[list[float]]):
+    """
+    Save the embeddings of a skill, as a previous run of the script did.
+    """
+    await compass_db[CompassEmbeddingsCollections.SKILLS.value].insert_many(
+        generate_taxonomy_embeddings._to_embedding_documents(documents=[skill], embeddings=embeddings,
+                                                             ctx=_SKILLS_EMBEDDING_CONTEXT))
+
+
+async def _get_embeddings_by_field(compass_db: AsyncIOMotorDatabase, skill_id: ObjectId) -> dict[str, list[float]]:
+    return {document["embedded_field"]: document["embedding"]
+            async for document in compass_db[CompassEmbeddingsCollections.SKILLS.value].find(
+                {"modelId": _GIVEN_MODEL_ID, "skillId": skill_id})}
+
+
+def _get_relation(*, model_id: ObjectId = _GIVEN_MODEL_ID, relation_type: str = "essential") -> dict:
+    return {
+        "_id": ObjectId(),
+        "modelId": model_id,
+        "requiringOccupationId": ObjectId(),
+        "requiredSkillId": ObjectId(),
+        "relationType": relation_type,
+    }
+
+
+class TestIncrementalUpdate:
+    @pytest.mark.asyncio
+    async def test_copies_the_embeddings_of_the_unchanged_texts(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN the embeddings of a skill of a previous model
+        given_previous_model_id = ObjectId()
+        given_previous_skill = _get_skill(0, model_id=given_previous_model_id)
+        await _save_embeddings(compass_db, given_previous_skill, [[101.0], [102.0], [103.0]])
+        # AND the same skill in the current model, with a changed description
+        given_skill = {**_get_skill(0), "description": "changed description"}
+        await platform_db[PlatformCollections.SKILLS.value].insert_one(given_skill)
+        given_embeddings_service = FakeEmbeddingService()
+
+        # WHEN the skills are updated incrementally from the previous model
+        await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=given_embeddings_service,
+                                                          previous_model_id=given_previous_model_id)
+
+        # THEN only the changed text is embedded
+        assert given_embeddings_service.calls == [["changed description"]]
+        # AND the embeddings of the unchanged texts are copied from the previous model
+        assert await _get_embeddings_by_field(compass_db, given_skill["_id"]) == {
+            "description": [float(len("changed description"))],
+            "preferredLabel": [102.0],
+            "altLabels": [103.0],
+        }
+
+    @pytest.mark.asyncio
+    async def test_deletes_the_embeddings_of_the_emptied_fields(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN the embeddings of a skill with alt labels
+        given_skill = _get_skill(0)
+        await _save_embeddings(compass_db, given_skill, [[101.0], [102.0], [103.0]])
+        # AND the alt labels of the skill were removed since then
+        await platform_db[PlatformCollections.SKILLS.value].insert_one({**given_skill, "altLabels": []})
+        given_embeddings_service = FakeEmbeddingService()
+
+        # WHEN the model is updated incrementally from itself
+        await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=given_embeddings_service,
+                                                          previous_model_id=_GIVEN_MODEL_ID)
+
+        # THEN nothing is embedded
+        assert given_embeddings_service.calls == []
+        # AND the embedding of the alt labels is deleted
+        assert await _get_embeddings_by_field(compass_db, given_skill["_id"]) == {
+            "description": [101.0],
+            "preferredLabel": [102.0],
+        }
+
+    @pytest.mark.asyncio
+    async def test_deletes_the_embeddings_of_the_removed_entities(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN the embeddings of two skills
+        given_kept_skill, given_removed_skill = _get_skill(0), _get_skill(1)
+        await _save_embeddings(compass_db, given_kept_skill, [[101.0], [102.0], [103.0]])
+        await _save_embeddings(compass_db, given_removed_skill, [[201.0], [202.0], [203.0]])
+        # AND one of the skills was removed from the model since then
+        await platform_db[PlatformCollections.SKILLS.value].insert_one(given_kept_skill)
+
+        # WHEN the model is updated incrementally from itself
+        await generate_taxonomy_embeddings.process_schema(hot_run=True, ctx=_SKILLS_EMBEDDING_CONTEXT,
+                                                          embeddings_service=FakeEmbeddingService(),
+                                                          previous_model_id=_GIVEN_MODEL_ID)
+
+        # THEN the embeddings of the removed skill are deleted
+        assert await _get_embedded_skill_ids(compass_db) == {given_kept_skill["_id"]}
+
+    @pytest.mark.asyncio
+    async def test_copy_relations_incrementally(
+            self, given_databases: Awaitable[tuple[AsyncIOMotorDatabase, AsyncIOMotorDatabase]]):
+        platform_db, compass_db = await given_databases
+        # GIVEN the relations of a model were copied
+        given_changed_relation, given_removed_relation = _get_relation(), _get_relation()
+        await platform_db[PlatformCollections.RELATIONS.value].insert_many([given_changed_relation, given_removed_relation])
+        await generate_taxonomy_embeddings.copy_relations_collection(hot_run=True)
+        # AND since then a relation changed, a relation was removed and a relation was added
+        await platform_db[PlatformCollections.RELATIONS.value].update_one({"_id": given_changed_relation["_id"]},
+                                                                          {"$set": {"relationType": "optional"}})
+        await platform_db[PlatformCollections.RELATIONS.value].delete_one({"_id": given_removed_relation["_id"]})
+        given_added_relation = _get_relation()
+        await platform_db[PlatformCollections.RELATIONS.value].insert_one(given_added_relation)
+
+        # WHEN the relations are copied incrementally
+        await generate_taxonomy_embeddings.copy_relations_collection(hot_run=True, incremental=True)
+
+        # THEN the copied relations are the relations of the model
+        actual_relations = await compass_db[CompassEmbeddingsCollections.RELATIONS.value].find(
+            {"modelId": _GIVEN_MODEL_ID}).to_list(length=None)
+        actual_relation_types = {relation["source_id"]: relation["relationType"] for relation in actual_relations}
+        assert len(actual_relations) == 2
+        # AND the changed relation is updated
+        assert actual_relation_types == {
+            given_changed_relation["_id"]: "optional",
+            given_added_relation["_id"]: "essential",
+        }
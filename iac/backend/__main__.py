@@ -79,6 +79,7 @@ def main():
 
         features=getenv("BACKEND_FEATURES", True, False),
         experience_pipeline_config=getenv("BACKEND_EXPERIENCE_PIPELINE_CONFIG", False, False),
+        vector_search_config=getenv("BACKEND_VECTOR_SEARCH_CONFIG", False, False),
 
         # CV limits (no bucket name env)
         cv_max_uploads_per_user=getenv("BACKEND_CV_MAX_UPLOADS_PER_USER", False, False),
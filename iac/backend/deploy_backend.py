@@ -53,6 +53,7 @@ class BackendServiceConfig:
     api_gateway_timeout: str
     features: Optional[str]
     experience_pipeline_config: Optional[str]
+    vector_search_config: Optional[str]
     cv_max_uploads_per_user: Optional[str]
     cv_rate_limit_per_minute: Optional[str]
     enable_cv_upload: Optional[str]
@@ -405,6 +406,9 @@ def _deploy_cloud_run_service(
                         gcp.cloudrunv2.ServiceTemplateContainerEnvArgs(
                             name="BACKEND_EXPERIENCE_PIPELINE_CONFIG",
                             value=backend_service_cfg.experience_pipeline_config),
+                        gcp.cloudrunv2.ServiceTemplateContainerEnvArgs(
+                            name="BACKEND_VECTOR_SEARCH_CONFIG",
+                            value=backend_service_cfg.vector_search_config),
                         gcp.cloudrunv2.ServiceTemplateContainerEnvArgs(
                             name="BACKEND_CV_STORAGE_BUCKET",
                             value=cv_bucket_name,